@@ -0,0 +1,107 @@
+# Electrum - lightweight Bitcoin client
+# Copyright (C) 2019 The Electrum developers
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import time
+from typing import NamedTuple, Optional, Sequence, List, Iterator
+
+from . import constants, bitcoin, bip32
+from .bip32 import BIP32Node
+from .transaction import multisig_script
+from .util import bh2u, make_process_pool
+from .logging import Logger
+
+
+class DerivationParams(NamedTuple):
+    """What a worker process needs to derive the addresses of a wallet.
+    Only public data: the xpubs, in keystore order."""
+    xpubs: Sequence[str]
+    txin_type: str
+    multisig_m: Optional[int] = None  # None for single-key wallets
+
+
+class DerivedBlock(NamedTuple):
+    start: int
+    pubkeys: List[List[str]]  # one list per xpub
+    addresses: List[str]
+    scripthashes: List[str]
+
+
+def _init_worker(net):
+    constants.net = net
+
+
+def _derive_block(params: DerivationParams, for_change: int, start: int, stop: int) -> DerivedBlock:
+    pubkeys = []
+    for xpub in params.xpubs:
+        branch = BIP32Node.from_xkey(xpub).subkey_at_public_derivation((for_change,))
+        derived = bip32.CKD_pub_batch(branch.eckey.get_public_key_bytes(compressed=True),
+                                      branch.chaincode, range(start, stop))
+        pubkeys.append([bh2u(pubkey) for pubkey, chaincode in derived])
+    if params.multisig_m is None:
+        addresses = [bitcoin.pubkey_to_address(params.txin_type, pubkey) for pubkey in pubkeys[0]]
+    else:
+        addresses = [bitcoin.redeem_script_to_address(params.txin_type,
+                                                      multisig_script(sorted(x), params.multisig_m))
+                     for x in zip(*pubkeys)]
+    scripthashes = [bitcoin.address_to_scripthash(addr) for addr in addresses]
+    return DerivedBlock(start, pubkeys, addresses, scripthashes)
+
+
+class ParallelAddressDeriver(Logger):
+    """Derives addresses (and their scripthashes) in a pool of worker
+    processes, so that restoring a wallet with a large gap limit does
+    not compete with network handling for the interpreter.
+    Blocks are returned in order, as soon as they are ready.
+    """
+
+    def __init__(self, params: DerivationParams, *, num_processes: int = None, block_size: int = 1000):
+        Logger.__init__(self)
+        assert block_size > 0, block_size
+        self.params = params
+        self.block_size = block_size
+        self.pool = make_process_pool(num_processes, initializer=_init_worker,
+                                      initargs=(constants.net,))
+        self.num_derived = 0
+        self.time_spent = 0.0
+
+    def derive_blocks(self, for_change: int, start: int, stop: int) -> Iterator[DerivedBlock]:
+        t0 = time.monotonic()
+        results = [self.pool.apply_async(_derive_block, (self.params, int(for_change), i, min(i + self.block_size, stop)))
+                   for i in range(start, stop, self.block_size)]
+        for result in results:
+            block = result.get()
+            t1 = time.monotonic()
+            self.time_spent += t1 - t0
+            t0 = t1
+            self.num_derived += len(block.addresses)
+            self.logger.info(f'derived {self.num_derived} addresses, {self.get_rate():.1f} addr/s')
+            yield block
+
+    def get_rate(self) -> float:
+        """Addresses per second, over all blocks so far."""
+        return self.num_derived / self.time_spent if self.time_spent else 0.0
+
+    def shutdown(self):
+        # pending blocks are of no use once the caller stopped iterating
+        self.pool.terminate()
+        self.pool.join()
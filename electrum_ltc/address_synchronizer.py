@@ -24,8 +24,9 @@
 import threading
 import asyncio
 import itertools
+from bisect import bisect_left
 from collections import defaultdict
-from typing import TYPE_CHECKING, Dict, Optional, Set, Tuple
+from typing import TYPE_CHECKING, Dict, Optional, Set, Tuple, List, Sequence
 
 from . import bitcoin
 from .bitcoin import COINBASE_MATURITY, TYPE_ADDRESS, TYPE_PUBKEY
@@ -88,10 +89,15 @@ class AddressSynchronizer(Logger):
         return func_wrapper
 
     def load_and_cleanup(self):
-        self.load_local_history()
-        self.check_history()
-        self.load_unverified_transactions()
-        self.remove_local_transactions_we_dont_have()
+        with self.db.load_phase('local_history'):
+            self.load_local_history()
+        with self.db.load_phase('check_history'):
+            self.check_history()
+        with self.db.load_phase('unverified_txs'):
+            self.load_unverified_transactions()
+        with self.db.load_phase('remove_local_txs'):
+            self.remove_local_transactions_we_dont_have()
+        self.logger.info(f"wallet loaded in {self.db.get_load_timings_report()}")
 
     def is_mine(self, address):
         return self.db.is_addr_in_history(address)
@@ -167,11 +173,22 @@ class AddressSynchronizer(Logger):
 
     def add_address(self, address):
         if not self.db.get_addr_history(address):
-            self.db.history[address] = []
+            self.db.set_addr_history(address, [])
             self.set_up_to_date(False)
         if self.synchronizer:
             self.synchronizer.add(address)
 
+    def add_addresses(self, addresses, *, scripthashes=None):
+        """Like add_address, for many addresses at once.
+        'scripthashes', if given, are those of the addresses, precomputed.
+        """
+        new_addresses = [addr for addr in addresses if not self.db.get_addr_history(addr)]
+        if new_addresses:
+            self.db.set_empty_addr_histories(new_addresses)
+            self.set_up_to_date(False)
+        if self.synchronizer:
+            self.synchronizer.add_addresses(addresses, scripthashes=scripthashes)
+
     def get_conflicting_transactions(self, tx_hash, tx):
         """Returns a set of transaction hashes from the wallet history that are
         directly conflicting with tx, i.e. they have common outpoints being
@@ -330,6 +347,13 @@ class AddressSynchronizer(Logger):
         self.add_unverified_tx(tx_hash, tx_height)
         self.add_transaction(tx_hash, tx, allow_unrelated=True)
 
+    def receive_txs_callback(self, txs: Sequence[Tuple[str, Transaction, int]]):
+        """Adds a batch of (tx_hash, tx, tx_height) received from the
+        network, taking the wallet locks once for the whole batch."""
+        with self.lock, self.transaction_lock:
+            for tx_hash, tx, tx_height in txs:
+                self.receive_tx_callback(tx_hash, tx, tx_height)
+
     def receive_history_callback(self, addr, hist, tx_fees):
         with self.lock:
             old_hist = self.get_address_history(addr)
@@ -338,6 +362,7 @@ class AddressSynchronizer(Logger):
                     # make tx local
                     self.unverified_tx.pop(tx_hash, None)
                     self.db.remove_verified_tx(tx_hash)
+                    self._history_index_dirty.add(tx_hash)
                     if self.verifier:
                         self.verifier.remove_spv_proof_for_tx(tx_hash)
             self.db.set_addr_history(addr, hist)
@@ -359,6 +384,13 @@ class AddressSynchronizer(Logger):
     def load_local_history(self):
         self._history_local = {}  # address -> set(txid)
         self._address_history_changed_events = defaultdict(asyncio.Event)  # address -> Event
+        # Wallet history (i.e. for the whole domain), maintained incrementally.
+        # Txs are marked dirty when their position or delta may have changed,
+        # and the index is brought up to date when it is read.
+        self._history_index = []  # type: List[Tuple[tuple, str]]  # sorted (txpos, txid), oldest first
+        self._history_index_items = {}  # type: Dict[str, Tuple[tuple, int]]  # txid -> (txpos, delta)
+        self._history_index_balances = []  # type: List[int]  # running balance after each item
+        self._history_index_dirty = set()  # type: Set[str]
         for txid in itertools.chain(self.db.list_txi(), self.db.list_txo()):
             self._add_tx_to_local_history(txid)
 
@@ -367,6 +399,7 @@ class AddressSynchronizer(Logger):
         hist_addrs_mine = list(filter(lambda k: self.is_mine(k), self.db.get_history()))
         hist_addrs_not_mine = list(filter(lambda k: not self.is_mine(k), self.db.get_history()))
         for addr in hist_addrs_not_mine:
+            self._mark_history_index_dirty_for_address(addr)
             self.db.remove_addr_history(addr)
         for addr in hist_addrs_mine:
             hist = self.db.get_addr_history(addr)
@@ -387,6 +420,7 @@ class AddressSynchronizer(Logger):
         with self.lock:
             with self.transaction_lock:
                 self.db.clear_history()
+                self._history_index_dirty |= set(self._history_index_items)
 
     def get_txpos(self, tx_hash):
         """Returns (height, txpos) tuple, even if the tx is unverified."""
@@ -412,11 +446,80 @@ class AddressSynchronizer(Logger):
                 self.threadlocal_cache.local_height = orig_val
         return f
 
+    def _update_history_index(self) -> None:
+        with self.lock, self.transaction_lock:
+            dirty = self._history_index_dirty
+            if not dirty:
+                return
+            self._history_index_dirty = set()
+            index = self._history_index
+            items = self._history_index_items
+            def is_in_history(txid):
+                return any(self.is_mine(addr) for addr in self._get_tx_addresses(txid))
+            if len(dirty) > 100 and len(dirty) * 4 > len(index):
+                # e.g. at startup; cheaper to rebuild than to insert one by one
+                txids = [txid for txid in set(items) | dirty if is_in_history(txid)]
+                items.clear()
+                for txid in txids:
+                    items[txid] = (self.get_txpos(txid), self._get_wallet_tx_delta(txid))
+                index[:] = sorted((txpos, txid) for txid, (txpos, delta) in items.items())
+                first_changed = 0
+            else:
+                first_changed = len(index)
+                for txid in dirty:
+                    if txid in items:
+                        txpos, delta = items.pop(txid)
+                        pos = bisect_left(index, (txpos, txid))
+                        del index[pos]
+                        first_changed = min(first_changed, pos)
+                    if not is_in_history(txid):
+                        continue
+                    txpos = self.get_txpos(txid)
+                    pos = bisect_left(index, (txpos, txid))
+                    index.insert(pos, (txpos, txid))
+                    items[txid] = (txpos, self._get_wallet_tx_delta(txid))
+                    first_changed = min(first_changed, pos)
+            # recompute running balances from the first change on
+            balances = self._history_index_balances
+            del balances[first_changed:]
+            balance = balances[-1] if balances else 0
+            for txpos, txid in index[first_changed:]:
+                balance += items[txid][1]
+                balances.append(balance)
+
+    def _get_tx_addresses(self, txid) -> Set[str]:
+        return set(itertools.chain(self.db.get_txi(txid), self.db.get_txo(txid)))
+
+    def _get_wallet_tx_delta(self, txid) -> int:
+        """Effect of tx on the addresses of the wallet. Unlike get_tx_value,
+        this ignores the txi/txo of addresses that are no longer ours."""
+        return sum(self.get_tx_delta(txid, addr)
+                   for addr in self._get_tx_addresses(txid) if self.is_mine(addr))
+
+    def _mark_history_index_dirty_for_address(self, addr) -> None:
+        with self.transaction_lock:
+            self._history_index_dirty.update(tx_hash for tx_hash, height in self.db.get_addr_history(addr))
+            self._history_index_dirty.update(self._history_local.get(addr, ()))
+
     @with_local_height_cached
-    def get_history(self, domain=None):
-        # get domain
+    def get_history(self, domain=None, *, offset: int = 0, limit: int = None):
+        """Returns list of (tx_hash, tx_mined_status, delta, balance),
+        oldest first. offset and limit select a slice of that list.
+        """
         if domain is None:
-            domain = self.get_addresses()
+            # full wallet history, served from the index
+            with self.lock, self.transaction_lock:
+                self._update_history_index()
+                if self._history_index_balances:
+                    # fixme: this may happen if history is incomplete
+                    c, u, x = self.get_balance()
+                    if self._history_index_balances[-1] != c + u + x:
+                        self.logger.info("Error: history not synchronized")
+                        return []
+                end = None if limit is None else offset + limit
+                return [(txid, self.get_tx_height(txid), self._history_index_items[txid][1], balance)
+                        for (txpos, txid), balance in zip(self._history_index[offset:end],
+                                                          self._history_index_balances[offset:end])]
         domain = set(domain)
         # 1. Get the history of each address in the domain, maintain the
         #    delta of a tx as the sum of its deltas on domain addresses
@@ -452,7 +555,8 @@ class AddressSynchronizer(Logger):
             self.logger.info("Error: history not synchronized")
             return []
 
-        return h2
+        end = None if limit is None else offset + limit
+        return h2[offset:end]
 
     def _add_tx_to_local_history(self, txid):
         with self.transaction_lock:
@@ -461,6 +565,7 @@ class AddressSynchronizer(Logger):
                 cur_hist.add(txid)
                 self._history_local[addr] = cur_hist
                 self._mark_address_history_changed(addr)
+            self._history_index_dirty.add(txid)
 
     def _remove_tx_from_local_history(self, txid):
         with self.transaction_lock:
@@ -472,6 +577,7 @@ class AddressSynchronizer(Logger):
                     pass
                 else:
                     self._history_local[addr] = cur_hist
+            self._history_index_dirty.add(txid)
 
     def _mark_address_history_changed(self, addr: str) -> None:
         # history for this address changed, wake up coroutines:
@@ -493,24 +599,28 @@ class AddressSynchronizer(Logger):
             if tx_height in (TX_HEIGHT_UNCONFIRMED, TX_HEIGHT_UNCONF_PARENT):
                 with self.lock:
                     self.db.remove_verified_tx(tx_hash)
+                    self._history_index_dirty.add(tx_hash)
                 if self.verifier:
                     self.verifier.remove_spv_proof_for_tx(tx_hash)
         else:
             with self.lock:
                 # tx will be verified only if height > 0
                 self.unverified_tx[tx_hash] = tx_height
+                self._history_index_dirty.add(tx_hash)
 
     def remove_unverified_tx(self, tx_hash, tx_height):
         with self.lock:
             new_height = self.unverified_tx.get(tx_hash)
             if new_height == tx_height:
                 self.unverified_tx.pop(tx_hash, None)
+                self._history_index_dirty.add(tx_hash)
 
     def add_verified_tx(self, tx_hash: str, info: TxMinedInfo):
         # Remove from the unverified map and add to the verified map
         with self.lock:
             self.unverified_tx.pop(tx_hash, None)
             self.db.add_verified_tx(tx_hash, info)
+            self._history_index_dirty.add(tx_hash)
         tx_mined_status = self.get_tx_height(tx_hash)
         self.network.trigger_callback('verified', self, tx_hash, tx_mined_status)
 
@@ -540,6 +650,7 @@ class AddressSynchronizer(Logger):
                         # into unverified_tx with the old height, and if we get
                         # a status update, that will overwrite it.
                         self.unverified_tx[tx_hash] = tx_height
+                        self._history_index_dirty.add(tx_hash)
                         txs.add(tx_hash)
         return txs
 
@@ -689,13 +800,18 @@ class AddressSynchronizer(Logger):
         return received, sent
 
     def get_addr_utxo(self, address):
-        coins, spent = self.get_addr_io(address)
-        for txi in spent:
-            coins.pop(txi)
+        # served from the UTXO index maintained by the db; only heights are looked up here
+        with self.lock, self.transaction_lock:
+            coins = self.db.get_addr_utxos(address)
+            heights = {}
+            for txo in coins:
+                prevout_hash = txo.split(':')[0]
+                if prevout_hash not in heights:
+                    heights[prevout_hash] = self.get_tx_height(prevout_hash).height
         out = {}
-        for txo, v in coins.items():
-            tx_height, value, is_cb = v
+        for txo, (value, is_cb) in coins.items():
             prevout_hash, prevout_n = txo.split(':')
+            tx_height = heights[prevout_hash]
             x = {
                 'address':address,
                 'value':value,
@@ -707,6 +823,23 @@ class AddressSynchronizer(Logger):
             out[txo] = x
         return out
 
+    def check_utxo_index(self) -> List[str]:
+        """Checks the db UTXO index for consistency, both internally and
+        against UTXOs computed from the address histories.
+        Returns a list of discrepancies (empty if consistent).
+        """
+        with self.lock, self.transaction_lock:
+            errors = self.db.check_utxo_index()
+            for addr in self.get_addresses():
+                coins, spent = self.get_addr_io(addr)
+                expected = set(coins) - set(spent)
+                actual = set(self.db.get_addr_utxos(addr))
+                for txo in sorted(expected - actual):
+                    errors.append(f"{addr}: utxo {txo} missing from index")
+                for txo in sorted(actual - expected):
+                    errors.append(f"{addr}: utxo {txo} in index but not in history")
+        return errors
+
     # return the total amount ever received by an address
     def get_addr_received(self, address):
         received, sent = self.get_addr_io(address)
@@ -3,11 +3,11 @@
 # file LICENCE or http://www.opensource.org/licenses/mit-license.php
 
 import hashlib
-from typing import List, Tuple, NamedTuple, Union, Iterable
+from typing import List, Tuple, NamedTuple, Union, Iterable, Dict, Optional, Sequence
 
 from .util import bfh, bh2u, BitcoinException
 from . import constants
-from . import ecc
+from . import ecc, ecc_fast
 from .crypto import hash_160, hmac_oneshot
 from .bitcoin import rev_hex, int_to_hex, EncodeBase58Check, DecodeBase58Check
 from .logging import get_logger
@@ -96,6 +96,40 @@ def _CKD_pub(parent_pubkey: bytes, parent_chaincode: bytes, child_index: bytes)
     return child_pubkey, child_chaincode
 
 
+def CKD_pub_batch(parent_pubkey: bytes, parent_chaincode: bytes,
+                  child_indices: Sequence[int]) -> List[Tuple[bytes, bytes]]:
+    """CKD_pub for many children of the same parent.
+    With libsecp256k1, the EC point additions are done in a single call.
+    """
+    for child_index in child_indices:
+        if child_index < 0: raise ValueError('the bip32 index needs to be non-negative')
+        if child_index & BIP32_PRIME: raise Exception('not possible to derive hardened child from parent pubkey')
+    Is = [hmac_oneshot(parent_chaincode, parent_pubkey + child_index.to_bytes(4, byteorder="big"), hashlib.sha512)
+          for child_index in child_indices]
+    if ecc_fast.is_using_fast_ecc():
+        child_pubkeys = ecc_fast.add_tweaks_to_pubkey(parent_pubkey, [I[0:32] for I in Is])
+    else:
+        parent_point = ecc.ECPubkey(parent_pubkey)
+        child_pubkeys = []
+        for I in Is:
+            try:
+                pubkey = ecc.ECPrivkey(I[0:32]) + parent_point
+            except ecc.InvalidECPointException:
+                pubkey = None
+            if pubkey is None or pubkey.is_at_infinity():
+                child_pubkeys.append(None)
+            else:
+                child_pubkeys.append(pubkey.get_public_key_bytes(compressed=True))
+    result = []
+    for child_index, I, child_pubkey in zip(child_indices, Is, child_pubkeys):
+        if child_pubkey is None:
+            # invalid child; let CKD_pub deal with it
+            result.append(CKD_pub(parent_pubkey, parent_chaincode, child_index))
+        else:
+            result.append((child_pubkey, I[32:]))
+    return result
+
+
 def xprv_header(xtype: str, *, net=None) -> bytes:
     if net is None:
         net = constants.net
@@ -225,11 +259,18 @@ class BIP32Node(NamedTuple):
                          fingerprint=fingerprint,
                          child_number=child_number)
 
-    def subkey_at_public_derivation(self, path: Union[str, Iterable[int]]) -> 'BIP32Node':
+    def subkey_at_public_derivation(self, path: Union[str, Iterable[int]], *,
+                                    cache: Optional[Dict[Tuple[int, ...], 'BIP32Node']] = None) -> 'BIP32Node':
+        """If 'cache' is given, it maps paths (relative to self) to already
+        derived nodes. The longest cached prefix of 'path' is reused, and
+        every node derived along the way is added to the cache.
+        """
         if path is None:
             raise Exception("derivation path must not be None")
         if isinstance(path, str):
             path = convert_bip32_path_to_list_of_uint32(path)
+        if cache is not None:
+            return self._subkey_at_public_derivation_cached(tuple(path), cache)
         if not path:
             return self.convert_to_public()
         depth = self.depth
@@ -248,6 +289,20 @@ class BIP32Node(NamedTuple):
                          fingerprint=fingerprint,
                          child_number=child_number)
 
+    def _subkey_at_public_derivation_cached(self, path: Tuple[int, ...],
+                                            cache: Dict[Tuple[int, ...], 'BIP32Node']) -> 'BIP32Node':
+        for depth in range(len(path), -1, -1):
+            node = cache.get(path[:depth])
+            if node is not None:
+                break
+        else:
+            depth = 0
+            node = cache[()] = self.convert_to_public()
+        for i in range(depth, len(path)):
+            node = node.subkey_at_public_derivation((path[i],))
+            cache[path[:i + 1]] = node
+        return node
+
 
 def xpub_type(x):
     return BIP32Node.from_xkey(x).xtype
@@ -21,28 +21,30 @@
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 import os
+import mmap
 import threading
-from typing import Optional, Dict, Mapping, Sequence
+from multiprocessing.pool import Pool
+from typing import Optional, Dict, Mapping, Sequence, List
 
 from . import util
 from .bitcoin import hash_encode, int_to_hex, rev_hex
 from .crypto import sha256d
 from . import constants
-from .util import bfh, bh2u
+from .util import bfh, bh2u, LRUCache, make_process_pool
 from .simple_config import SimpleConfig
 from .logging import get_logger, Logger
 
-try:
-    import scrypt
-    getPoWHash = lambda x: scrypt.hash(x, x, N=1024, r=1, p=1, buflen=32)
-except ImportError:
-    util.print_msg("Warning: package scrypt not available; synchronization could be very slow")
-    from .scrypt import scrypt_1024_1_1_80 as getPoWHash
+from . import scrypt
+
+POW_BACKEND, getPoWHash = scrypt.select_backend()
+if POW_BACKEND == 'python':
+    util.print_msg("Warning: no fast scrypt implementation available; synchronization could be very slow")
 
 
 _logger = get_logger(__name__)
 
 HEADER_SIZE = 80  # bytes
+HEADER_CACHE_SIZE = 4096  # number of deserialized headers (and hashes) kept per chain
 MAX_TARGET = 0x00000FFFFF000000000000000000000000000000000000000000000000000000
 
 
@@ -92,6 +94,49 @@ def pow_hash_header(header):
     return hash_encode(getPoWHash(bfh(serialize_header(header))))
 
 
+def _pow_hash_raw_headers(data: bytes) -> List[str]:
+    return [hash_encode(getPoWHash(data[i:i+HEADER_SIZE]))
+            for i in range(0, len(data), HEADER_SIZE)]
+
+
+# PoW hashing of chunks can be fanned out to worker processes
+# (see Blockchain.verify_chunk); started on first use, and shut down
+# with the network.
+_pow_pool = None  # type: Optional[Pool]
+_pow_pool_lock = threading.Lock()
+MIN_HEADERS_FOR_PARALLEL_POW = 64
+
+
+def get_pow_pool() -> Pool:
+    global _pow_pool
+    with _pow_pool_lock:
+        if _pow_pool is None:
+            _pow_pool = make_process_pool(os.cpu_count())
+        return _pow_pool
+
+
+def shutdown_pow_pool() -> None:
+    global _pow_pool
+    with _pow_pool_lock:
+        pool, _pow_pool = _pow_pool, None
+    if pool is not None:
+        pool.terminate()
+        pool.join()
+
+
+def pow_hash_raw_headers_parallel(data: bytes, pool: Pool, num_jobs: int = None) -> List[str]:
+    """Returns the PoW hashes of the concatenated raw headers in data,
+    computed in parallel by the processes of pool. Order is preserved.
+    """
+    if num_jobs is None:
+        num_jobs = os.cpu_count() or 1
+    num_headers = len(data) // HEADER_SIZE
+    headers_per_job = max(1, -(-num_headers // num_jobs))
+    job_size = headers_per_job * HEADER_SIZE
+    jobs = [data[i:i+job_size] for i in range(0, num_headers * HEADER_SIZE, job_size)]
+    return [h for job_result in pool.map(_pow_hash_raw_headers, jobs) for h in job_result]
+
+
 # key: blockhash hex at forkpoint
 # the chain at some key is the best chain that includes the given hash
 blockchains = {}  # type: Dict[str, Blockchain]
@@ -110,11 +155,14 @@ def read_blockchains(config: 'SimpleConfig'):
         header_after_cp = best_chain.read_header(constants.net.max_checkpoint()+1)
         if not header_after_cp or not best_chain.can_connect(header_after_cp, check_height=False):
             _logger.info("[blockchain] deleting best chain. cannot connect header after last cp to last cp.")
+            best_chain.close_mmap()
+            best_chain.header_index.delete()
             os.unlink(best_chain.path())
             best_chain.update_size()
     # forks
     fdir = os.path.join(util.get_headers_dir(config), 'forks')
     util.make_dir(fdir)
+    idir = os.path.join(util.get_headers_dir(config), 'index')
     # files are named as: fork2_{forkpoint}_{prev_hash}_{first_hash}
     l = filter(lambda x: x.startswith('fork2_') and '.' not in x, os.listdir(fdir))
     l = sorted(l, key=lambda x: int(x.split('_')[1]))  # sort by forkpoint
@@ -122,6 +170,7 @@ def read_blockchains(config: 'SimpleConfig'):
     def delete_chain(filename, reason):
         _logger.info(f"[blockchain] deleting chain {filename}: {reason}")
         os.unlink(os.path.join(fdir, filename))
+        HeaderIndex(os.path.join(idir, filename)).delete()
 
     def instantiate_chain(filename):
         __, forkpoint, prev_hash, first_hash = filename.split('_')
@@ -163,6 +212,84 @@ def read_blockchains(config: 'SimpleConfig'):
 def get_best_chain() -> 'Blockchain':
     return blockchains[constants.net.GENESIS]
 
+
+class HeaderIndex:
+    """Sidecar file of a headers file, holding one fixed-width record
+    per height: the block hash (32 bytes, internal byte order) and the
+    cumulative chainwork up to and including that block (32 bytes, big-endian).
+    The file is memory-mapped; records are only appended or truncated.
+    Index files live in the 'index' subdirectory of the headers dir,
+    under the same name as the headers file they belong to.
+    """
+
+    RECORD_SIZE = 64
+
+    def __init__(self, path: str):
+        self.path = path
+        self._mmap = None  # type: Optional[mmap.mmap]
+        self._count = 0
+        self._load()
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _load(self) -> None:
+        self.close()
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        self._count = size // self.RECORD_SIZE
+        if size != self._count * self.RECORD_SIZE:  # partial record, e.g. after crash
+            self.truncate(self._count)
+            return
+        if self._count > 0:
+            with open(self.path, 'rb') as f:
+                self._mmap = mmap.mmap(f.fileno(), self._count * self.RECORD_SIZE, access=mmap.ACCESS_READ)
+
+    def close(self) -> None:
+        if self._mmap is None:
+            return
+        try:
+            self._mmap.close()
+        except BufferError:
+            pass
+        self._mmap = None
+
+    def get(self, pos: int) -> (bytes, int):
+        """Returns (block hash, cumulative chainwork) of record at pos."""
+        if not 0 <= pos < self._count:
+            raise IndexError(pos)
+        record = self._mmap[pos * self.RECORD_SIZE : (pos + 1) * self.RECORD_SIZE]
+        return record[:32], int.from_bytes(record[32:], byteorder='big')
+
+    def append(self, records: bytes) -> None:
+        assert len(records) % self.RECORD_SIZE == 0, len(records)
+        self.close()
+        util.make_dir(os.path.dirname(self.path))
+        with open(self.path, 'ab') as f:
+            f.seek(self._count * self.RECORD_SIZE)
+            f.write(records)
+        self._load()
+
+    def truncate(self, count: int) -> None:
+        if count >= self._count and os.path.exists(self.path) \
+                and os.path.getsize(self.path) == self._count * self.RECORD_SIZE:
+            return
+        self.close()
+        if os.path.exists(self.path):
+            with open(self.path, 'rb+') as f:
+                f.truncate(count * self.RECORD_SIZE)
+        self._load()
+
+    def delete(self) -> None:
+        self.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._count = 0
+
+    @classmethod
+    def serialize_record(cls, block_hash: bytes, chainwork: int) -> bytes:
+        return block_hash + chainwork.to_bytes(32, byteorder='big')
+
+
 # block hash -> chain work; up to and including that block
 _CHAINWORK_CACHE = {
     "0000000000000000000000000000000000000000000000000000000000000000": 0,  # virtual block at height -1
@@ -188,6 +315,10 @@ class Blockchain(Logger):
         self._forkpoint_hash = forkpoint_hash  # blockhash at forkpoint. "first hash"
         self._prev_hash = prev_hash  # blockhash immediately before forkpoint
         self.lock = threading.RLock()
+        self._mmap = None  # type: Optional[mmap.mmap]
+        self._header_cache = LRUCache(HEADER_CACHE_SIZE)  # type: Dict[int, dict]
+        self._hash_cache = LRUCache(HEADER_CACHE_SIZE)  # type: Dict[int, str]
+        self.header_index = None  # type: Optional[HeaderIndex]
         self.update_size()
 
     def with_lock(func):
@@ -287,13 +418,125 @@ class Blockchain(Logger):
 
     @with_lock
     def update_size(self) -> None:
+        """Must be called whenever the headers file changes."""
         p = self.path()
         self._size = os.path.getsize(p)//HEADER_SIZE if os.path.exists(p) else 0
+        self._header_cache.clear()
+        self._hash_cache.clear()
+        self.close_mmap()
+        if self._size > 0:
+            with open(p, 'rb') as f:
+                self._mmap = mmap.mmap(f.fileno(), self._size * HEADER_SIZE, access=mmap.ACCESS_READ)
+        self._load_header_index()
+
+    def index_path(self) -> str:
+        return os.path.join(util.get_headers_dir(self.config), 'index', os.path.basename(self.path()))
+
+    def _index_start_height(self) -> int:
+        # The headers in the checkpoint region are not necessarily present,
+        # so that part is not indexed.
+        return max(self.forkpoint, len(self.checkpoints) * 2016)
+
+    @with_lock
+    def _load_header_index(self) -> None:
+        """(Re)opens the header index, and drops records that
+        do not match the headers file (e.g. after a crash).
+        """
+        path = self.index_path()
+        if self.header_index is None or self.header_index.path != path:
+            if self.header_index is not None:
+                self.header_index.close()
+            self.header_index = HeaderIndex(path)
+        index = self.header_index
+        start = self._index_start_height()
+        index.truncate(max(0, min(len(index), self.height() - start + 1)))
+        # records are chained by prev hash, so if one matches, all below do too
+        def record_matches(pos):
+            block_hash, _ = index.get(pos)
+            with self.read_raw_header(start + pos) as h:
+                return block_hash == self._raw_header_hash(h)
+        lo, hi = 0, len(index)  # number of valid records is in [lo, hi]
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if record_matches(mid - 1):
+                lo = mid
+            else:
+                hi = mid - 1
+        index.truncate(lo)
+
+    @classmethod
+    def _raw_header_hash(cls, h: memoryview) -> bytes:
+        h = bytes(h)
+        if h == bytes([0])*HEADER_SIZE:
+            return bytes(32)
+        return sha256d(h)
+
+    @with_lock
+    def _invalidate_header_index(self, height: int) -> None:
+        """Drops index records at and above height."""
+        start = self._index_start_height()
+        self.header_index.truncate(max(0, min(len(self.header_index), height - start)))
+
+    @with_lock
+    def _extend_header_index(self, height: int) -> None:
+        """Makes sure the index covers the headers up to height."""
+        index = self.header_index
+        start = self._index_start_height()
+        height = min(height, self.height())
+        next_height = start + len(index)
+        if next_height > height:
+            return
+        if height - next_height > 2016:
+            self.logger.info(f"building header index from height {next_height} to {height}")
+        if next_height == 0 or constants.net.TESTNET:
+            running_total = 0
+        else:
+            running_total = self.get_chainwork(next_height - 1)
+        while next_height <= height:
+            # append at most one chunk at a time
+            last_height = min(height, next_height // 2016 * 2016 + 2015)
+            work_in_single_header = 0
+            if not constants.net.TESTNET:
+                work_in_single_header = self.chainwork_of_header_at_height(next_height)
+            records = bytearray()
+            for h in range(next_height, last_height + 1):
+                with self.read_raw_header(h) as raw_header:
+                    block_hash = self._raw_header_hash(raw_header)
+                running_total += work_in_single_header
+                records += HeaderIndex.serialize_record(block_hash, running_total)
+            index.append(records)
+            next_height = last_height + 1
+
+    @with_lock
+    def _read_header_index(self, height: int) -> Optional[tuple]:
+        """Returns (block hash, cumulative chainwork) at height from the index,
+        or None if height is not indexed by this chain.
+        """
+        start = self._index_start_height()
+        if not start <= height <= self.height():
+            return None
+        self._extend_header_index(height)
+        return self.header_index.get(height - start)
+
+    @with_lock
+    def close_mmap(self) -> None:
+        """Unmaps the headers file. Needed before it is written to,
+        replaced or deleted, at least on Windows.
+        """
+        if self._mmap is None:
+            return
+        try:
+            self._mmap.close()
+        except BufferError:
+            # a memoryview returned by read_raw_header is still alive;
+            # the mapping will be released when it gets garbage collected
+            pass
+        self._mmap = None
 
     @classmethod
-    def verify_header(cls, header: dict, prev_hash: str, target: int, expected_header_hash: str=None) -> None:
+    def verify_header(cls, header: dict, prev_hash: str, target: int, expected_header_hash: str=None,
+                      *, powhash: str=None) -> None:
         _hash = hash_header(header)
-        _powhash = pow_hash_header(header)
         if expected_header_hash and expected_header_hash != _hash:
             raise Exception("hash mismatches with expected: {} vs {}".format(expected_header_hash, _hash))
         if prev_hash != header.get('prev_block_hash'):
@@ -303,15 +546,29 @@ class Blockchain(Logger):
         bits = cls.target_to_bits(target)
         if bits != header.get('bits'):
             raise Exception("bits mismatch: %s vs %s" % (bits, header.get('bits')))
+        _powhash = powhash if powhash is not None else pow_hash_header(header)
         block_hash_as_num = int.from_bytes(bfh(_powhash), byteorder='big')
         if block_hash_as_num > target:
             raise Exception(f"insufficient proof of work: {block_hash_as_num} vs target {target}")
 
+    def use_parallel_pow(self, num_headers: int) -> bool:
+        if constants.net.TESTNET:  # no PoW check
+            return False
+        if not self.config.get('parallel_pow_verification', False):
+            return False
+        return num_headers >= MIN_HEADERS_FOR_PARALLEL_POW and (os.cpu_count() or 1) > 1
+
     def verify_chunk(self, index: int, data: bytes) -> None:
         num = len(data) // HEADER_SIZE
         start_height = index * 2016
         prev_hash = self.get_hash(start_height - 1)
         target = self.get_target(index-1)
+        # PoW hashes are independent of each other, and dominate the cost;
+        # linkage checks are done sequentially below.
+        if self.use_parallel_pow(num):
+            powhashes = pow_hash_raw_headers_parallel(data[:num*HEADER_SIZE], get_pow_pool())
+        else:
+            powhashes = None
         for i in range(num):
             height = start_height + i
             try:
@@ -320,7 +577,8 @@ class Blockchain(Logger):
                 expected_header_hash = None
             raw_header = data[i*HEADER_SIZE : (i+1)*HEADER_SIZE]
             header = deserialize_header(raw_header, index*2016 + i)
-            self.verify_header(header, prev_hash, target, expected_header_hash)
+            self.verify_header(header, prev_hash, target, expected_header_hash,
+                               powhash=powhashes[i] if powhashes else None)
             prev_hash = hash_header(header)
 
     @with_lock
@@ -355,6 +613,7 @@ class Blockchain(Logger):
             delta_bytes = 0
         truncate = not chunk_within_checkpoint_region
         self.write(chunk, delta_bytes, truncate)
+        self._extend_header_index(self.height())
         self.swap_with_parent()
 
     def swap_with_parent(self) -> None:
@@ -404,6 +663,11 @@ class Blockchain(Logger):
             parent_data = f.read(parent_branch_size*HEADER_SIZE)
         self.write(parent_data, 0)
         parent.write(my_data, (forkpoint - parent.forkpoint)*HEADER_SIZE)
+        self.close_mmap()
+        parent.close_mmap()
+        # our index is empty now; the parent's still covers the common part
+        self.header_index.delete()
+        self.header_index, parent.header_index = parent.header_index, None
         # swap parameters
         self.parent, parent.parent = parent.parent, self  # type: Optional[Blockchain], Optional[Blockchain]
         self.forkpoint, parent.forkpoint = parent.forkpoint, self.forkpoint
@@ -435,6 +699,10 @@ class Blockchain(Logger):
     def write(self, data: bytes, offset: int, truncate: bool=True) -> None:
         filename = self.path()
         self.assert_headers_file_available(filename)
+        self.close_mmap()
+        from_height = self.forkpoint + offset // HEADER_SIZE
+        if truncate or from_height + len(data) // HEADER_SIZE > self._index_start_height():
+            self._invalidate_header_index(from_height)
         with open(filename, 'rb+') as f:
             if truncate and offset != self._size * HEADER_SIZE:
                 f.seek(offset)
@@ -453,8 +721,30 @@ class Blockchain(Logger):
         assert delta == self.size(), (delta, self.size())
         assert len(data) == HEADER_SIZE
         self.write(data, delta*HEADER_SIZE)
+        self._extend_header_index(self.height())
         self.swap_with_parent()
 
+    @with_lock
+    def read_raw_header(self, height: int) -> Optional[memoryview]:
+        """Returns the serialized header at height, without copying it
+        out of the memory-mapped headers file.
+        Note: the returned view must not be kept around, as it pins the mapping.
+        """
+        if height < 0:
+            return
+        if height < self.forkpoint:
+            return self.parent.read_raw_header(height)
+        if height > self.height():
+            return
+        delta = height - self.forkpoint
+        if self._mmap is None:
+            self.assert_headers_file_available(self.path())
+            raise Exception('headers file is not mapped')
+        h = memoryview(self._mmap)[delta * HEADER_SIZE : (delta + 1) * HEADER_SIZE]
+        if len(h) < HEADER_SIZE:
+            raise Exception('Expected to read a full header. This was only {} bytes'.format(len(h)))
+        return h
+
     @with_lock
     def read_header(self, height: int) -> Optional[dict]:
         if height < 0:
@@ -463,17 +753,38 @@ class Blockchain(Logger):
             return self.parent.read_header(height)
         if height > self.height():
             return
-        delta = height - self.forkpoint
-        name = self.path()
-        self.assert_headers_file_available(name)
-        with open(name, 'rb') as f:
-            f.seek(delta * HEADER_SIZE)
-            h = f.read(HEADER_SIZE)
-            if len(h) < HEADER_SIZE:
-                raise Exception('Expected to read a full header. This was only {} bytes'.format(len(h)))
-        if h == bytes([0])*HEADER_SIZE:
+        header = self._header_cache.get(height)
+        if header is None:
+            with self.read_raw_header(height) as h:
+                h = bytes(h)
+            if h == bytes([0])*HEADER_SIZE:
+                return None
+            header = deserialize_header(h, height)
+            self._header_cache[height] = header
+        # callers might modify the dict
+        return dict(header)
+
+    @with_lock
+    def _read_header_hash(self, height: int) -> Optional[str]:
+        if height < 0:
+            return None
+        if height < self.forkpoint:
+            return self.parent._read_header_hash(height)
+        if not 0 <= height <= self.height():
             return None
-        return deserialize_header(h, height)
+        header_hash = self._hash_cache.get(height)
+        if header_hash is None:
+            record = self._read_header_index(height)
+            if record is not None:
+                block_hash = record[0]
+            else:
+                with self.read_raw_header(height) as h:
+                    block_hash = self._raw_header_hash(h)
+            if block_hash == bytes(32):
+                return None
+            header_hash = hash_encode(block_hash)
+            self._hash_cache[height] = header_hash
+        return header_hash
 
     def header_at_tip(self) -> Optional[dict]:
         """Return latest header."""
@@ -495,10 +806,10 @@ class Blockchain(Logger):
             h, t, _ = self.checkpoints[index]
             return h
         else:
-            header = self.read_header(height)
-            if header is None:
+            header_hash = self._read_header_hash(height)
+            if header_hash is None:
                 raise MissingHeader(height)
-            return hash_header(header)
+            return header_hash
 
     def get_timestamp(self, height):
         if height < len(self.checkpoints) * 2016 and (height+1) % 2016 == 0:
@@ -569,6 +880,11 @@ class Blockchain(Logger):
             # On testnet/regtest, difficulty works somewhat different.
             # It's out of scope to properly implement that.
             return height
+        if height < self.forkpoint:
+            return self.parent.get_chainwork(height)
+        record = self._read_header_index(height)
+        if record is not None:
+            return record[1]
         last_retarget = height // 2016 * 2016 - 1
         cached_height = last_retarget
         while _CHAINWORK_CACHE.get(self.get_hash(cached_height)) is None:
@@ -22,9 +22,11 @@
 # ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
+import bisect
+import time
 from collections import defaultdict
 from math import floor, log10
-from typing import NamedTuple, List, Callable
+from typing import NamedTuple, List, Callable, Optional, Sequence
 from decimal import Decimal
 
 from .bitcoin import sha256, COIN, TYPE_ADDRESS, is_address
@@ -83,20 +85,88 @@ class Bucket(NamedTuple):
 
 class ScoredCandidate(NamedTuple):
     penalty: float
-    tx: Transaction
     buckets: List[Bucket]
+    change: List[TxOutput]  # change outputs of the resulting tx
+
+
+class SelectionTotals:
+    """Running totals over a selection of buckets. Buckets can be added
+    and removed in constant time, and the weight of the resulting tx can
+    be computed without going over the selected buckets.
+    """
+    __slots__ = ('value', 'effective_value', 'weight', 'num_witness_buckets', 'num_legacy_coins')
+
+    def __init__(self):
+        self.value = 0
+        self.effective_value = 0
+        self.weight = 0
+        self.num_witness_buckets = 0
+        self.num_legacy_coins = 0  # coins in buckets without witness
+
+    @classmethod
+    def from_buckets(cls, buckets: Sequence[Bucket]) -> 'SelectionTotals':
+        totals = cls()
+        for bucket in buckets:
+            totals.add(bucket)
+        return totals
+
+    def add(self, bucket: Bucket) -> None:
+        self.value += bucket.value
+        self.effective_value += bucket.effective_value
+        self.weight += bucket.weight
+        if bucket.witness:
+            self.num_witness_buckets += 1
+        else:
+            self.num_legacy_coins += len(bucket.coins)
+
+    def remove(self, bucket: Bucket) -> None:
+        self.value -= bucket.value
+        self.effective_value -= bucket.effective_value
+        self.weight -= bucket.weight
+        if bucket.witness:
+            self.num_witness_buckets -= 1
+        else:
+            self.num_legacy_coins -= len(bucket.coins)
+
+    def __add__(self, other: 'SelectionTotals') -> 'SelectionTotals':
+        totals = SelectionTotals()
+        for name in self.__slots__:
+            setattr(totals, name, getattr(self, name) + getattr(other, name))
+        return totals
+
+    def tx_weight(self, *, base_weight: int) -> int:
+        """Return the total weight of the tx spending the selected buckets.
+        base_weight is the weight of the tx that includes the fixed (non-change)
+        outputs and potentially some fixed inputs. Note that the change outputs
+        at this point are not yet known so they are NOT accounted for.
+        """
+        total_weight = base_weight + self.weight
+        if self.num_witness_buckets:
+            total_weight += 2  # marker and flag
+            # non-segwit inputs were previously assumed to have
+            # a witness of '' instead of '00' (hex)
+            # note that mixed legacy/segwit buckets are already ok
+            total_weight += self.num_legacy_coins
+        return total_weight
+
+
+class ChangelessRange(NamedTuple):
+    """Range of sums of bucket effective values for which the tx pays
+    its fee and needs no change output (the leftover would be dust)."""
+    min_effective_value: int
+    max_effective_value: int
 
 
 def strip_unneeded(bkts, sufficient_funds):
     '''Remove buckets that are unnecessary in achieving the spend amount'''
-    if sufficient_funds([], bucket_value_sum=0):
+    totals = SelectionTotals()
+    if sufficient_funds(totals):
         # none of the buckets are needed
         return []
     bkts = sorted(bkts, key=lambda bkt: bkt.value, reverse=True)
-    bucket_value_sum = 0
     for i in range(len(bkts)):
-        bucket_value_sum += (bkts[i]).value
-        if sufficient_funds(bkts[:i+1], bucket_value_sum=bucket_value_sum):
+        totals.add(bkts[i])
+        if sufficient_funds(totals):
             return bkts[:i+1]
     raise Exception("keeping all buckets is still not enough")
 
@@ -107,6 +177,10 @@ class CoinChooserBase(Logger):
 
     def __init__(self):
         Logger.__init__(self)
+        # set by make_tx
+        self.changeless_range = None  # type: Optional[ChangelessRange]
+        # number of Transaction objects built, for profiling
+        self.num_txs_constructed = 0
 
     def keys(self, coins):
         raise NotImplementedError
@@ -148,19 +222,18 @@ class CoinChooserBase(Logger):
 
         return list(map(make_Bucket, buckets.keys(), buckets.values()))
 
-    def penalty_func(self, base_tx, *, tx_from_buckets) -> Callable[[List[Bucket]], ScoredCandidate]:
+    def penalty_func(self, base_tx, *, change_from_buckets) -> Callable[[List[Bucket]], ScoredCandidate]:
         raise NotImplementedError
 
-    def _change_amounts(self, tx, count, fee_estimator_numchange) -> List[int]:
+    def _change_amounts(self, output_amounts, fee, count, fee_estimator_numchange) -> List[int]:
         # Break change up if bigger than max_change
-        output_amounts = [o.value for o in tx.outputs()]
         # Don't split change of less than 0.02 BTC
         max_change = max(max(output_amounts) * 1.25, 0.02 * COIN)
 
         # Use N change outputs
         for n in range(1, count + 1):
             # How much is left if we add this many change outputs?
-            change_amount = max(0, tx.get_fee() - fee_estimator_numchange(n))
+            change_amount = max(0, fee - fee_estimator_numchange(n))
             if change_amount // n <= max_change:
                 break
 
@@ -205,8 +278,8 @@ class CoinChooserBase(Logger):
 
         return amounts
 
-    def _change_outputs(self, tx, change_addrs, fee_estimator_numchange, dust_threshold):
-        amounts = self._change_amounts(tx, len(change_addrs), fee_estimator_numchange)
+    def _change_outputs(self, output_amounts, fee, change_addrs, fee_estimator_numchange, dust_threshold):
+        amounts = self._change_amounts(output_amounts, fee, len(change_addrs), fee_estimator_numchange)
         assert min(amounts) >= 0
         assert len(change_addrs) >= len(amounts)
         assert all([isinstance(amt, int) for amt in amounts])
@@ -217,17 +290,21 @@ class CoinChooserBase(Logger):
                   for addr, amount in zip(change_addrs, amounts)]
         return change
 
-    def _construct_tx_from_selected_buckets(self, *, buckets, base_tx, change_addrs,
-                                            fee_estimator_w, dust_threshold, base_weight):
-        # make a copy of base_tx so it won't get mutated
-        tx = Transaction.from_io(base_tx.inputs()[:], base_tx.outputs()[:])
-
-        tx.add_inputs([coin for b in buckets for coin in b.coins])
-        tx_weight = self._get_tx_weight(buckets, base_weight=base_weight)
+    def _change_from_selected_buckets(self, *, buckets, base_tx, change_addrs,
+                                      fee_estimator_w, dust_threshold, base_weight) -> List[TxOutput]:
+        """Returns the change outputs of the tx spending base_tx and the
+        coins in buckets. The tx itself is not constructed.
+        """
+        totals = SelectionTotals.from_buckets(buckets)
+        tx_weight = totals.tx_weight(base_weight=base_weight)
+        fee = base_tx.input_value() + totals.value - base_tx.output_value()
 
         # change is sent back to sending address unless specified
         if not change_addrs:
-            change_addrs = [tx.inputs()[0]['address']]
+            # the first input, as sorted by BIP69_sort
+            first_input = min(base_tx.inputs() + [coin for b in buckets for coin in b.coins],
+                              key=lambda i: (i['prevout_hash'], i['prevout_n']))
+            change_addrs = [first_input['address']]
             # note: this is not necessarily the final "first input address"
             # because the inputs had not been sorted at this point
             assert is_address(change_addrs[0])
@@ -235,30 +312,12 @@ class CoinChooserBase(Logger):
         # This takes a count of change outputs and returns a tx fee
         output_weight = 4 * Transaction.estimated_output_size(change_addrs[0])
         fee_estimator_numchange = lambda count: fee_estimator_w(tx_weight + count * output_weight)
-        change = self._change_outputs(tx, change_addrs, fee_estimator_numchange, dust_threshold)
-        tx.add_outputs(change)
-
-        return tx, change
+        output_amounts = [o.value for o in base_tx.outputs()]
+        return self._change_outputs(output_amounts, fee, change_addrs, fee_estimator_numchange, dust_threshold)
 
-    def _get_tx_weight(self, buckets, *, base_weight) -> int:
-        """Given a collection of buckets, return the total weight of the
-        resulting transaction.
-        base_weight is the weight of the tx that includes the fixed (non-change)
-        outputs and potentially some fixed inputs. Note that the change outputs
-        at this point are not yet known so they are NOT accounted for.
-        """
-        total_weight = base_weight + sum(bucket.weight for bucket in buckets)
-        is_segwit_tx = any(bucket.witness for bucket in buckets)
-        if is_segwit_tx:
-            total_weight += 2  # marker and flag
-            # non-segwit inputs were previously assumed to have
-            # a witness of '' instead of '00' (hex)
-            # note that mixed legacy/segwit buckets are already ok
-            num_legacy_inputs = sum((not bucket.witness) * len(bucket.coins)
-                                    for bucket in buckets)
-            total_weight += num_legacy_inputs
-
-        return total_weight
+    def _construct_tx(self, inputs, outputs) -> Transaction:
+        self.num_txs_constructed += 1
+        return Transaction.from_io(inputs, outputs)
 
     def make_tx(self, coins, inputs, outputs, change_addrs, fee_estimator_vb,
                 dust_threshold):
@@ -279,13 +338,13 @@ class CoinChooserBase(Logger):
         self.p = PRNG(''.join(sorted(utxos)))
 
         # Copy the outputs so when adding change we don't modify "outputs"
-        base_tx = Transaction.from_io(inputs[:], outputs[:])
+        base_tx = self._construct_tx(inputs[:], outputs[:])
         input_value = base_tx.input_value()
 
         # Weight of the transaction with no inputs and no change
         # Note: this will use legacy tx serialization as the need for "segwit"
         # would be detected from inputs. The only side effect should be that the
-        # marker and flag are excluded, which is compensated in get_tx_weight()
+        # marker and flag are excluded, which is compensated in SelectionTotals.tx_weight()
         # FIXME calculation will be off by this (2 wu) in case of RBF batching
         base_weight = base_tx.estimated_weight()
         spent_amount = base_tx.output_value()
@@ -293,25 +352,22 @@ class CoinChooserBase(Logger):
         def fee_estimator_w(weight):
             return fee_estimator_vb(Transaction.virtual_size_from_weight(weight))
 
-        def sufficient_funds(buckets, *, bucket_value_sum):
-            '''Given a list of buckets, return True if it has enough
-            value to pay for the transaction'''
-            # assert bucket_value_sum == sum(bucket.value for bucket in buckets)  # expensive!
-            total_input = input_value + bucket_value_sum
+        def sufficient_funds(totals: SelectionTotals):
+            '''Given the totals of a selection of buckets, return True
+            if it has enough value to pay for the transaction'''
+            total_input = input_value + totals.value
             if total_input < spent_amount:  # shortcut for performance
                 return False
-            # note re performance: so far this was constant time
-            # what follows is linear in len(buckets)
-            total_weight = self._get_tx_weight(buckets, base_weight=base_weight)
+            total_weight = totals.tx_weight(base_weight=base_weight)
             return total_input >= spent_amount + fee_estimator_w(total_weight)
 
-        def tx_from_buckets(buckets):
-            return self._construct_tx_from_selected_buckets(buckets=buckets,
-                                                            base_tx=base_tx,
-                                                            change_addrs=change_addrs,
-                                                            fee_estimator_w=fee_estimator_w,
-                                                            dust_threshold=dust_threshold,
-                                                            base_weight=base_weight)
+        def change_from_buckets(buckets):
+            return self._change_from_selected_buckets(buckets=buckets,
+                                                      base_tx=base_tx,
+                                                      change_addrs=change_addrs,
+                                                      fee_estimator_w=fee_estimator_w,
+                                                      dust_threshold=dust_threshold,
+                                                      base_weight=base_weight)
 
         # Collect the coins into buckets
         all_buckets = self.bucketize_coins(coins, fee_estimator_vb=fee_estimator_vb)
@@ -320,13 +376,33 @@ class CoinChooserBase(Logger):
         # instead of per-coin, as each bucket should be either fully spent or not at all.
         # (e.g. CoinChooserPrivacy ensures that same-address coins go into one bucket)
         all_buckets = list(filter(lambda b: b.effective_value > 0, all_buckets))
+
+        # For choosers looking for changeless solutions (see CoinChooserBnB).
+        # Adding buckets adds their fees, as effective values are net of them.
+        # A change output is only added if what is left after paying for it
+        # is at least dust_threshold.
+        change_addr = change_addrs[0] if change_addrs else coins[0]['address'] if coins else None
+        if change_addr:
+            # assume the segwit marker and flag if any bucket may need them
+            weight = base_weight + 2 * any(b.witness for b in all_buckets)
+            base_fee = fee_estimator_w(weight)
+            change_weight = 4 * Transaction.estimated_output_size(change_addr)
+            change_fee = fee_estimator_w(weight + change_weight) - base_fee
+            min_effective_value = spent_amount - input_value + base_fee
+            self.changeless_range = ChangelessRange(min_effective_value,
+                                                    min_effective_value + change_fee + dust_threshold - 1)
+        else:
+            self.changeless_range = None
         # Choose a subset of the buckets
         scored_candidate = self.choose_buckets(all_buckets, sufficient_funds,
-                                               self.penalty_func(base_tx, tx_from_buckets=tx_from_buckets))
-        tx = scored_candidate.tx
+                                               self.penalty_func(base_tx, change_from_buckets=change_from_buckets))
+        # only now build the tx, for the winning candidate
+        tx = self._construct_tx(base_tx.inputs() + [coin for b in scored_candidate.buckets for coin in b.coins],
+                                base_tx.outputs() + scored_candidate.change)
 
         self.logger.info(f"using {len(tx.inputs())} inputs")
         self.logger.info(f"using buckets: {[bucket.desc for bucket in scored_candidate.buckets]}")
+        self.logger.info(f"constructed {self.num_txs_constructed} transactions")
 
         return tx
 
@@ -346,7 +422,7 @@ class CoinChooserRandom(CoinChooserBase):
 
         # Add all singletons
         for n, bucket in enumerate(buckets):
-            if sufficient_funds([bucket], bucket_value_sum=bucket.value):
+            if sufficient_funds(SelectionTotals.from_buckets([bucket])):
                 candidates.add((n, ))
 
         # And now some random ones
@@ -356,13 +432,10 @@ class CoinChooserRandom(CoinChooserBase):
             # Get a random permutation of the buckets, and
             # incrementally combine buckets until sufficient
             self.p.shuffle(permutation)
-            bkts = []
-            bucket_value_sum = 0
+            totals = SelectionTotals()
             for count, index in enumerate(permutation):
-                bucket = buckets[index]
-                bkts.append(bucket)
-                bucket_value_sum += bucket.value
-                if sufficient_funds(bkts, bucket_value_sum=bucket_value_sum):
+                totals.add(buckets[index])
+                if sufficient_funds(totals):
                     candidates.add(tuple(sorted(permutation[:count + 1])))
                     break
             else:
@@ -390,20 +463,19 @@ class CoinChooserRandom(CoinChooserBase):
 
         bucket_sets = [conf_buckets, unconf_buckets, other_buckets]
         already_selected_buckets = []
-        already_selected_buckets_value_sum = 0
+        already_selected_totals = SelectionTotals()
 
         for bkts_choose_from in bucket_sets:
             try:
-                def sfunds(bkts, *, bucket_value_sum):
-                    bucket_value_sum += already_selected_buckets_value_sum
-                    return sufficient_funds(already_selected_buckets + bkts,
-                                            bucket_value_sum=bucket_value_sum)
+                def sfunds(totals):
+                    return sufficient_funds(already_selected_totals + totals)
 
                 candidates = self.bucket_candidates_any(bkts_choose_from, sfunds)
                 break
             except NotEnoughFunds:
                 already_selected_buckets += bkts_choose_from
-                already_selected_buckets_value_sum += sum(bucket.value for bucket in bkts_choose_from)
+                for bucket in bkts_choose_from:
+                    already_selected_totals.add(bucket)
         else:
             raise NotEnoughFunds()
 
@@ -434,14 +506,14 @@ class CoinChooserPrivacy(CoinChooserRandom):
     def keys(self, coins):
         return [coin['address'] for coin in coins]
 
-    def penalty_func(self, base_tx, *, tx_from_buckets):
+    def penalty_func(self, base_tx, *, change_from_buckets):
         min_change = min(o.value for o in base_tx.outputs()) * 0.75
         max_change = max(o.value for o in base_tx.outputs()) * 1.33
 
         def penalty(buckets) -> ScoredCandidate:
             # Penalize using many buckets (~inputs)
             badness = len(buckets) - 1
-            tx, change_outputs = tx_from_buckets(buckets)
+            change_outputs = change_from_buckets(buckets)
             change = sum(o.value for o in change_outputs)
             # Penalize change not roughly in output range
             if change == 0:
@@ -455,13 +527,103 @@ class CoinChooserPrivacy(CoinChooserRandom):
                 badness += (change - max_change) / (max_change + 10000)
                 # Penalize large change; 5 BTC excess ~= using 1 more input
                 badness += change / (COIN * 5)
-            return ScoredCandidate(badness, tx, buckets)
+            return ScoredCandidate(badness, buckets, change_outputs)
 
         return penalty
 
 
+def branch_and_bound(values: Sequence[int], min_sum: int, max_sum: int, *,
+                     max_tries: int, deadline: float = None) -> Optional[List[int]]:
+    """Depth-first search for a subset of 'values' (sorted in decreasing
+    order) whose sum is within [min_sum, max_sum]. Returns the indices of
+    the subset with the smallest sum found, or None.
+    The search stops after max_tries steps or at time.monotonic() deadline.
+    """
+    n = len(values)
+    remaining = [0] * (n + 1)  # remaining[i] == sum(values[i:])
+    for i in reversed(range(n)):
+        remaining[i] = remaining[i + 1] + values[i]
+    negated_values = [-v for v in values]  # ascending, for bisect
+    selected = []  # type: List[int]
+    current_sum = 0
+    best, best_sum = None, None
+    i = 0
+    for tries in range(max_tries):
+        if current_sum + remaining[i] < min_sum or current_sum > max_sum:
+            backtrack = True
+        elif current_sum >= min_sum:
+            if best_sum is None or current_sum < best_sum:
+                best, best_sum = selected[:], current_sum
+                if best_sum == min_sum:
+                    break
+            backtrack = True
+        else:
+            backtrack = i == n
+            if not backtrack and current_sum + values[i] > max_sum:
+                # skip the values that would overshoot
+                i = bisect.bisect_left(negated_values, current_sum - max_sum, i)
+                continue
+        if backtrack:
+            if not selected:
+                break  # search space exhausted
+            # exclude the last selected value instead, and the values
+            # equal to it, as including those was just explored
+            j = selected.pop()
+            current_sum -= values[j]
+            i = j + 1
+            while i < n and values[i] == values[j]:
+                i += 1
+        else:
+            selected.append(i)
+            current_sum += values[i]
+            i += 1
+        if deadline is not None and tries % 1000 == 0 and time.monotonic() > deadline:
+            break
+    return best
+
+
+class CoinChooserBnB(CoinChooserPrivacy):
+    """Looks for a set of coins that pays for the transaction without
+    needing a change output, using a bounded branch-and-bound search.
+    Coins sent to the same address are still spent together.
+    If no such set is found, falls back to the Privacy coin chooser.
+    """
+
+    max_tries = 100000
+    time_limit = 1.0  # seconds
+
+    def choose_buckets(self, buckets, sufficient_funds, penalty_func):
+        if self.changeless_range is not None:
+            conf_buckets = [bkt for bkt in buckets if bkt.min_height > 0]
+            # prefer confirmed coins, like bucket_candidates_prefer_confirmed
+            for bkts in ([conf_buckets, buckets] if len(conf_buckets) < len(buckets) else [buckets]):
+                selection = self._search_changeless(bkts, sufficient_funds)
+                if selection is not None:
+                    self.logger.info(f"found changeless solution with {len(selection)} buckets "
+                                     f"out of {len(buckets)}")
+                    return penalty_func(selection)
+        self.logger.info("no changeless solution found, falling back")
+        return super().choose_buckets(buckets, sufficient_funds, penalty_func)
+
+    def _search_changeless(self, buckets, sufficient_funds) -> Optional[List[Bucket]]:
+        # sort by effective value, largest first; ties broken by desc, for determinism
+        buckets = sorted(buckets, key=lambda b: (-b.effective_value, b.desc))
+        min_value, max_value = self.changeless_range
+        indices = branch_and_bound([b.effective_value for b in buckets], min_value, max_value,
+                                   max_tries=self.max_tries,
+                                   deadline=time.monotonic() + self.time_limit)
+        if indices is None:
+            return None
+        selection = [buckets[i] for i in indices]
+        # effective values only approximate the fee (e.g. segwit marker)
+        if not sufficient_funds(SelectionTotals.from_buckets(selection)):
+            return None
+        return selection
+
+
 COIN_CHOOSERS = {
     'Privacy': CoinChooserPrivacy,
+    'BranchAndBound': CoinChooserBnB,
 }
 
 def get_name(config):
@@ -475,3 +637,4 @@ def get_coin_chooser(config):
     coinchooser = klass()
     coinchooser.enable_output_value_rounding = config.get('coin_chooser_output_rounding', False)
     return coinchooser
+
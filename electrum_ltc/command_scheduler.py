@@ -0,0 +1,185 @@
+# Electrum - lightweight Bitcoin client
+# Copyright (C) 2019 The Electrum developers
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import asyncio
+import time
+from collections import deque
+from concurrent.futures import Executor
+from functools import partial
+from typing import Dict, Callable, Optional, Deque, Tuple, TYPE_CHECKING
+
+from .logging import Logger
+
+if TYPE_CHECKING:
+    from .commands import Command
+    from .wallet import Abstract_Wallet
+
+
+def _call_with_event_loop(loop, func):
+    # commands may create asyncio objects, from the executor thread
+    asyncio.set_event_loop(loop)
+    return func()
+
+
+class ReadWriteLock:
+    """asyncio lock held either by any number of readers, or by one writer.
+    Waiters are served in order: new readers queue behind a waiting
+    writer, so that a stream of reads cannot starve a write.
+    Must be used from a single event loop.
+    """
+
+    def __init__(self):
+        self._num_readers = 0
+        self._has_writer = False
+        self._waiters = deque()  # type: Deque[Tuple[bool, asyncio.Future]]
+
+    async def acquire_read(self):
+        if not self._has_writer and not self._waiters:
+            self._num_readers += 1
+        else:
+            await self._wait(is_writer=False)
+
+    async def acquire_write(self):
+        if not self._has_writer and not self._num_readers and not self._waiters:
+            self._has_writer = True
+        else:
+            await self._wait(is_writer=True)
+
+    def release_read(self):
+        assert self._num_readers > 0
+        self._num_readers -= 1
+        self._wake_up()
+
+    def release_write(self):
+        assert self._has_writer
+        self._has_writer = False
+        self._wake_up()
+
+    async def _wait(self, *, is_writer: bool):
+        fut = asyncio.get_event_loop().create_future()
+        waiter = (is_writer, fut)
+        self._waiters.append(waiter)
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                # the lock was granted just before the cancellation
+                self.release_write() if is_writer else self.release_read()
+            else:
+                self._waiters.remove(waiter)
+                self._wake_up()
+            raise
+
+    def _wake_up(self):
+        # grant the lock to the first waiter, and to the readers right behind it
+        while self._waiters and not self._has_writer:
+            is_writer, fut = self._waiters[0]
+            if is_writer:
+                if self._num_readers:
+                    break
+                self._has_writer = True
+            else:
+                self._num_readers += 1
+            self._waiters.popleft()
+            fut.set_result(None)
+
+
+class WalletQueueStats:
+    """Queueing metrics for the commands run against one wallet."""
+
+    def __init__(self):
+        self.num_commands = 0  # completed
+        self.num_waiting = 0
+        self.num_running = 0
+        self.total_wait_time = 0.0
+        self.max_wait_time = 0.0
+        self.total_run_time = 0.0
+
+    def as_dict(self) -> dict:
+        n = self.num_commands
+        return {
+            'commands': n,
+            'waiting': self.num_waiting,
+            'running': self.num_running,
+            'avg_wait_ms': round(1000 * self.total_wait_time / n, 3) if n else 0,
+            'max_wait_ms': round(1000 * self.max_wait_time, 3),
+            'avg_run_ms': round(1000 * self.total_run_time / n, 3) if n else 0,
+        }
+
+
+class CommandScheduler(Logger):
+    """Runs commands on an executor, with one read/write lock per wallet:
+    read-only commands against a wallet run concurrently, other commands
+    have the wallet to themselves. Commands against different wallets
+    do not wait for each other. The locks are waited for on the event
+    loop, so that queued commands do not hold executor threads.
+    """
+
+    def __init__(self, *, executor: Executor):
+        Logger.__init__(self)
+        self.executor = executor
+        self._locks = {}  # type: Dict[Abstract_Wallet, ReadWriteLock]
+        self._stats = {}  # type: Dict[str, WalletQueueStats]
+
+    async def run(self, wallet: Optional['Abstract_Wallet'], cmd: 'Command', func: Callable, *args, **kwargs):
+        loop = asyncio.get_event_loop()
+        call = partial(_call_with_event_loop, loop, partial(func, *args, **kwargs))
+        if wallet is None:
+            return await loop.run_in_executor(self.executor, call)
+        lock = self._locks.get(wallet)
+        if lock is None:
+            lock = self._locks[wallet] = ReadWriteLock()
+        stats = self._stats.setdefault(wallet.storage.path, WalletQueueStats())
+        acquire, release = ((lock.acquire_read, lock.release_read) if cmd.is_read_only
+                            else (lock.acquire_write, lock.release_write))
+        t0 = time.monotonic()
+        stats.num_waiting += 1
+        try:
+            await acquire()
+        finally:
+            stats.num_waiting -= 1
+        t1 = time.monotonic()
+        stats.num_running += 1
+
+        def on_done(fut):
+            # release only once the command is done, even if we were cancelled
+            stats.num_running -= 1
+            stats.num_commands += 1
+            stats.total_wait_time += t1 - t0
+            stats.max_wait_time = max(stats.max_wait_time, t1 - t0)
+            stats.total_run_time += time.monotonic() - t1
+            release()
+
+        fut = loop.run_in_executor(self.executor, call)
+        fut.add_done_callback(on_done)
+        if t1 - t0 > 1:
+            self.logger.info(f'{cmd.name} waited {t1 - t0:.3f}s for wallet {wallet.basename()}')
+        return await asyncio.shield(fut)
+
+    def forget_wallet(self, wallet: 'Abstract_Wallet'):
+        self._locks.pop(wallet, None)
+        self._stats.pop(wallet.storage.path, None)
+
+    def get_stats(self) -> Dict[str, dict]:
+        """Queueing metrics, per wallet path."""
+        return {path: stats.as_dict() for path, stats in self._stats.items()}
@@ -45,6 +45,7 @@ from .paymentrequest import PR_PAID, PR_UNPAID, PR_UNKNOWN, PR_EXPIRED
 from .synchronizer import Notifier
 from .wallet import Abstract_Wallet, create_new_wallet, restore_wallet_from_text
 from .address_synchronizer import TX_HEIGHT_LOCAL
+from .storage import WalletStorage
 
 if TYPE_CHECKING:
     from .network import Network
@@ -65,6 +66,8 @@ class Command:
         self.requires_network = 'n' in s
         self.requires_wallet = 'w' in s
         self.requires_password = 'p' in s
+        # read-only commands do not modify the wallet, and can run concurrently
+        self.is_read_only = 'r' in s
         self.description = func.__doc__
         self.help = self.description.split('.')[0] if self.description else None
         varnames = func.__code__.co_varnames[1:func.__code__.co_argcount]
@@ -148,7 +151,8 @@ class Commands:
         }
 
     @command('')
-    def restore(self, text, passphrase=None, password=None, encrypt_file=True):
+    def restore(self, text, passphrase=None, password=None, encrypt_file=True,
+                gap_limit=None, num_processes=None):
         """Restore a wallet from text. Text can be a seed phrase, a master
         public key, a master private key, a list of Litecoin addresses
         or Litecoin private keys.
@@ -159,12 +163,27 @@ class Commands:
                                      passphrase=passphrase,
                                      password=password,
                                      encrypt_file=encrypt_file,
-                                     network=self.network)
+                                     network=self.network,
+                                     gap_limit=gap_limit,
+                                     num_processes=num_processes)
         return {
             'path': d['wallet'].storage.path,
             'msg': d['msg'],
         }
 
+    @command('')
+    def convertwallet(self, backend='sqlite'):
+        """Convert the wallet file to another storage backend: 'sqlite' for
+        indexed SQLite tables, or 'json'. The wallet must not be loaded. The
+        original file is kept next to the converted one."""
+        storage = WalletStorage(self.config.get_wallet_path())
+        backup_path = storage.convert_db(backend)
+        return {
+            'path': storage.path,
+            'backend': backend,
+            'backup': backup_path,
+        }
+
     @command('wp')
     def password(self, password=None, new_password=None):
         """Change wallet password. """
@@ -175,7 +194,7 @@ class Commands:
         self.wallet.storage.write()
         return {'password':self.wallet.has_password()}
 
-    @command('w')
+    @command('wr')
     def get(self, key):
         """Return item from wallet storage"""
         return self.wallet.storage.get(key)
@@ -217,7 +236,7 @@ class Commands:
         sh = bitcoin.address_to_scripthash(address)
         return self.network.run_from_another_thread(self.network.get_history_for_scripthash(sh))
 
-    @command('w')
+    @command('wr')
     def listunspent(self):
         """List unspent outputs. Returns the list of unspent transaction
         outputs in your wallet."""
@@ -227,6 +246,12 @@ class Commands:
             i["value"] = str(Decimal(v)/COIN) if v is not None else None
         return l
 
+    @command('wr')
+    def checkutxoindex(self):
+        """Check the consistency of the wallet UTXO index. Returns a list
+        of discrepancies, empty if the index is consistent."""
+        return self.wallet.check_utxo_index()
+
     @command('n')
     def getaddressunspent(self, address):
         """Returns the UTXO list of any address. Note: This
@@ -308,7 +333,7 @@ class Commands:
         """Unfreeze address. Unfreeze the funds at one of your wallet\'s address"""
         return self.wallet.set_frozen_state_of_addresses([address], False)
 
-    @command('wp')
+    @command('wpr')
     def getprivatekeys(self, address, password=None):
         """Get private keys of addresses. You may pass a single wallet address, or a list of wallet addresses."""
         if isinstance(address, str):
@@ -318,7 +343,7 @@ class Commands:
         domain = address
         return [self.wallet.export_private_key(address, password)[0] for address in domain]
 
-    @command('w')
+    @command('wr')
     def ismine(self, address):
         """Check if address is in wallet. Return true if and only address is in wallet"""
         return self.wallet.is_mine(address)
@@ -333,12 +358,12 @@ class Commands:
         """Check that an address is valid. """
         return is_address(address)
 
-    @command('w')
+    @command('wr')
     def getpubkeys(self, address):
         """Return the public keys for a wallet address. """
         return self.wallet.get_public_keys(address)
 
-    @command('w')
+    @command('wr')
     def getbalance(self):
         """Return the balance of your wallet. """
         c, u, x = self.wallet.get_balance()
@@ -377,12 +402,12 @@ class Commands:
         from .version import ELECTRUM_VERSION
         return ELECTRUM_VERSION
 
-    @command('w')
+    @command('wr')
     def getmpk(self):
         """Get master public key. Return your wallet\'s master public key"""
         return self.wallet.get_master_public_key()
 
-    @command('wp')
+    @command('wpr')
     def getmasterprivate(self, password=None):
         """Get master private key. Return your wallet\'s master private key"""
         return str(self.wallet.keystore.get_master_private_key(password))
@@ -396,7 +421,7 @@ class Commands:
             raise Exception('xkey should be a master public/private key')
         return node._replace(xtype=xtype).to_xkey()
 
-    @command('wp')
+    @command('wpr')
     def getseed(self, password=None):
         """Get seed phrase. Print the generation seed of your wallet."""
         s = self.wallet.get_seed(password)
@@ -435,7 +460,7 @@ class Commands:
         tx = sweep(privkeys, self.network, self.config, destination, tx_fee, imax)
         return tx.as_dict() if tx else None
 
-    @command('wp')
+    @command('wpr')
     def signmessage(self, address, message, password=None):
         """Sign a message with a key. Use quotes if your message contains
         whitespaces"""
@@ -487,7 +512,7 @@ class Commands:
         tx = self._mktx(outputs, tx_fee, change_addr, domain, nocheck, unsigned, rbf, password, locktime)
         return tx.as_dict()
 
-    @command('w')
+    @command('wr')
     def history(self, year=None, show_addresses=False, show_fiat=False, show_fees=False,
                 from_height=None, to_height=None):
         """Wallet history. Returns the transaction history of your wallet."""
@@ -515,17 +540,17 @@ class Commands:
         transaction ID"""
         self.wallet.set_label(key, label)
 
-    @command('w')
+    @command('wr')
     def listcontacts(self):
         """Show your list of contacts"""
         return self.wallet.contacts
 
-    @command('w')
+    @command('wr')
     def getalias(self, key):
         """Retrieve alias. Lookup in your list of contacts, and for an OpenAlias DNS record."""
         return self.wallet.contacts.resolve(key)
 
-    @command('w')
+    @command('wr')
     def searchcontacts(self, query):
         """Search through contacts, return matching entries. """
         results = {}
@@ -534,7 +559,7 @@ class Commands:
                 results[key] = value
         return results
 
-    @command('w')
+    @command('wr')
     def listaddresses(self, receiving=False, change=False, labels=False, frozen=False, unused=False, funded=False, balance=False):
         """List wallet addresses. Returns the list of all addresses in your wallet. Use optional arguments to filter the results."""
         out = []
@@ -586,7 +611,7 @@ class Commands:
         encrypted = public_key.encrypt_message(message)
         return encrypted.decode('utf-8')
 
-    @command('wp')
+    @command('wpr')
     def decrypt(self, pubkey, encrypted, password=None) -> str:
         """Decrypt a message encrypted with a public key."""
         if not is_hex_str(pubkey):
@@ -607,7 +632,7 @@ class Commands:
         out['status'] = pr_str[out.get('status', PR_UNKNOWN)]
         return out
 
-    @command('w')
+    @command('wr')
     def getrequest(self, key):
         """Return a payment request"""
         r = self.wallet.get_payment_request(key, self.config)
@@ -620,7 +645,7 @@ class Commands:
     #    """<Not implemented>"""
     #    pass
 
-    @command('w')
+    @command('wr')
     def listrequests(self, pending=False, expired=False, paid=False):
         """List the payment requests you made."""
         out = self.wallet.get_sorted_requests(self.config)
@@ -702,7 +727,7 @@ class Commands:
         self.network.run_from_another_thread(self._notifier.start_watching_queue.put((address, URL)))
         return True
 
-    @command('wn')
+    @command('wnr')
     def is_synchronized(self):
         """ return wallet synchronization status """
         return self.wallet.is_up_to_date()
@@ -743,7 +768,7 @@ class Commands:
             self.wallet.remove_transaction(tx_hash)
         self.wallet.storage.write()
 
-    @command('wn')
+    @command('wnr')
     def get_tx_status(self, txid):
         """Returns some information regarding the tx. For now, only confirmations.
         The transaction must be related to the wallet.
@@ -830,6 +855,9 @@ command_options = {
     'fee_level':   (None, "Float between 0.0 and 1.0, representing fee slider position"),
     'from_height': (None, "Only show transactions that confirmed after given block height"),
     'to_height':   (None, "Only show transactions that confirmed before given block height"),
+    'backend':     (None, "Wallet storage backend: 'sqlite' or 'json'"),
+    'gap_limit':   (None, "Number of unused addresses to look ahead for"),
+    'num_processes': (None, "Derive addresses in this many worker processes (for large gap limits)"),
 }
 
 
@@ -843,6 +871,8 @@ arg_types = {
     'year': int,
     'from_height': int,
     'to_height': int,
+    'gap_limit': int,
+    'num_processes': int,
     'tx': tx_from_str,
     'pubkeys': json_loads,
     'jsontx': json_loads,
@@ -33,7 +33,8 @@ from typing import Dict, Optional, Tuple
 
 import jsonrpclib
 
-from .jsonrpc import VerifyingJSONRPCServer
+from .jsonrpc import AuthenticatedJSONRPCServer
+from .command_scheduler import CommandScheduler
 from .version import ELECTRUM_VERSION
 from .network import Network
 from .util import (json_decode, DaemonThread, to_string,
@@ -145,6 +146,7 @@ class Daemon(DaemonThread):
         self.wallets = {}  # type: Dict[str, Abstract_Wallet]
         # Setup JSONRPC server
         self.server = None
+        self.scheduler = None  # type: Optional[CommandScheduler]
         if listen_jsonrpc:
             self.init_server(config, fd)
         self.start()
@@ -153,26 +155,42 @@ class Daemon(DaemonThread):
         host = config.get('rpchost', '127.0.0.1')
         port = config.get('rpcport', 0)
         rpc_user, rpc_password = get_rpc_credentials(config)
+        server = AuthenticatedJSONRPCServer(rpc_user=rpc_user, rpc_password=rpc_password,
+                                            max_workers=config.get('rpcthreads', 8))
         try:
-            server = VerifyingJSONRPCServer((host, port), logRequests=False,
-                                            rpc_user=rpc_user, rpc_password=rpc_password)
+            sockname = asyncio.run_coroutine_threadsafe(server.start(host, port), self.asyncio_loop).result()
         except Exception as e:
             self.logger.error(f'cannot initialize RPC server on host {host}: {repr(e)}')
+            server.executor.shutdown(wait=False)
             self.server = None
             os.close(fd)
             return
-        os.write(fd, bytes(repr((server.socket.getsockname(), time.time())), 'utf8'))
+        os.write(fd, bytes(repr((sockname, time.time())), 'utf8'))
         os.close(fd)
         self.server = server
-        server.timeout = 0.1
+        # commands against a wallet are run with its lock, see CommandScheduler
+        self.scheduler = CommandScheduler(executor=server.executor)
         server.register_function(self.ping, 'ping')
         server.register_function(self.run_gui, 'gui')
         server.register_function(self.run_daemon, 'daemon')
         self.cmd_runner = Commands(self.config, None, self.network)
         for cmdname in known_commands:
-            server.register_function(getattr(self.cmd_runner, cmdname), cmdname)
+            server.register_function(self._scheduled_command(cmdname), cmdname)
         server.register_function(self.run_cmdline, 'run_cmdline')
 
+    def _scheduled_command(self, cmdname):
+        cmd = known_commands[cmdname]
+        async def run_command(*args, **kwargs):
+            error = self._check_wallet_not_loaded(cmd, self.config)
+            if error:
+                raise Exception(error)
+            # runs against the wallet loaded last; the command must not see
+            # another wallet if one is loaded before it runs
+            wallet = self.cmd_runner.wallet
+            func = getattr(Commands(self.config, wallet, self.network), cmdname)
+            return await self.scheduler.run(wallet, cmd, func, *args, **kwargs)
+        return run_command
+
     def ping(self):
         return True
 
@@ -210,6 +228,7 @@ class Daemon(DaemonThread):
                     'blockchain_height': self.network.get_local_height(),
                     'server_height': self.network.get_server_height(),
                     'spv_nodes': len(self.network.get_interfaces()),
+                    'spv': self.network.get_status_value('spv'),
                     'connected': self.network.is_connected(),
                     'auto_connect': net_params.auto_connect,
                     'version': ELECTRUM_VERSION,
@@ -217,6 +236,7 @@ class Daemon(DaemonThread):
                                 for k, w in self.wallets.items()},
                     'current_wallet': current_wallet_path,
                     'fee_per_kb': self.config.fee_per_kb(),
+                    'command_queues': self.scheduler.get_stats() if self.scheduler else {},
                 }
             else:
                 response = "Daemon offline"
@@ -245,7 +265,9 @@ class Daemon(DaemonThread):
         if path in self.wallets:
             wallet = self.wallets[path]
             return wallet
-        storage = WalletStorage(path, manual_upgrades=True)
+        # 'wallet_journal': None keeps each wallet's current storage mode
+        storage = WalletStorage(path, manual_upgrades=True,
+                                use_journal=self.config.get('wallet_journal'))
         if not storage.file_exists():
             return
         if storage.is_encrypted():
@@ -283,12 +305,24 @@ class Daemon(DaemonThread):
         path = standardize_path(path)
         wallet = self.wallets.pop(path, None)
         if not wallet: return
+        if self.scheduler:
+            self.scheduler.forget_wallet(wallet)
         wallet.stop_threads()
 
-    def run_cmdline(self, config_options):
-        asyncio.set_event_loop(self.asyncio_loop)
-        password = config_options.get('password')
-        new_password = config_options.get('new_password')
+    async def run_cmdline(self, config_options):
+        # SimpleConfig reads the config file; keep it off the event loop
+        loop = asyncio.get_event_loop()
+        prepared = await loop.run_in_executor(self.scheduler.executor, self._prepare_cmdline, config_options)
+        if isinstance(prepared, dict):
+            return prepared  # error
+        wallet, cmd, func, args, kwargs = prepared
+        try:
+            result = await self.scheduler.run(wallet, cmd, func, *args, **kwargs)
+        except TypeError as e:
+            raise Exception("Wrapping TypeError to prevent JSONRPC-Pelix from hiding traceback") from e
+        return result
+
+    def _prepare_cmdline(self, config_options):
         config = SimpleConfig(config_options)
         # FIXME this is ugly...
         config.fee_estimates = self.network.config.fee_estimates.copy()
@@ -303,6 +337,9 @@ class Daemon(DaemonThread):
                 return {'error': 'Wallet "%s" is not loaded. Use "electrum-ltc daemon load_wallet"'%os.path.basename(path) }
         else:
             wallet = None
+            error = self._check_wallet_not_loaded(cmd, config)
+            if error:
+                return {'error': error}
         # arguments passed to function
         args = map(lambda x: config.get(x), cmd.params)
         # decode json arguments
@@ -313,15 +350,23 @@ class Daemon(DaemonThread):
             kwargs[x] = (config_options.get(x) if x in ['password', 'new_password'] else config.get(x))
         cmd_runner = Commands(config, wallet, self.network)
         func = getattr(cmd_runner, cmd.name)
-        try:
-            result = func(*args, **kwargs)
-        except TypeError as e:
-            raise Exception("Wrapping TypeError to prevent JSONRPC-Pelix from hiding traceback") from e
-        return result
+        return wallet, cmd, func, args, kwargs
+
+    def _check_wallet_not_loaded(self, cmd, config) -> Optional[str]:
+        """convertwallet replaces the wallet file; a loaded wallet would
+        write over the converted file. Returns an error message, if any."""
+        if cmd.name != 'convertwallet':
+            return None
+        path = standardize_path(config.get_wallet_path())
+        if path in self.wallets:
+            return 'Wallet "%s" is loaded. Use "electrum-ltc daemon close_wallet" first' % os.path.basename(path)
+        return None
 
     def run(self):
         while self.is_running():
-            self.server.handle_request() if self.server else time.sleep(0.1)
+            time.sleep(0.1)
+        if self.server:
+            asyncio.run_coroutine_threadsafe(self.server.stop(), self.asyncio_loop).result()
         # stop network/wallets
         for k, wallet in self.wallets.items():
             wallet.stop_threads()
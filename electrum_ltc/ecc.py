@@ -23,9 +23,12 @@
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import os
 import base64
 import hashlib
-from typing import Union, Tuple
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Union, Tuple, Sequence, List
 
 import ecdsa
 from ecdsa.ecdsa import curve_secp256k1, generator_secp256k1
@@ -36,6 +39,7 @@ from ecdsa.util import string_to_number, number_to_string
 from .util import bfh, bh2u, assert_bytes, to_bytes, InvalidPassword, profiler
 from .crypto import (sha256d, aes_encrypt_with_iv, aes_decrypt_with_iv, hmac_oneshot)
 from .ecc_fast import do_monkey_patching_of_python_ecdsa_internals_with_libsecp256k1
+from . import ecc_fast
 from . import msqr
 from . import constants
 from .logging import get_logger
@@ -448,6 +452,67 @@ class ECPrivkey(ECPubkey):
         return aes_decrypt_with_iv(key_e, iv, ciphertext)
 
 
+# a batch is split across threads only if each gets at least this many items
+BATCH_MIN_ITEMS_PER_THREAD = 64
+
+
+def _run_batch(func, items: Sequence, num_threads: int = None) -> list:
+    """Applies func (which takes and returns a list) to items, split into
+    chunks across a thread pool."""
+    if num_threads is None:
+        num_threads = min(os.cpu_count() or 1, len(items) // BATCH_MIN_ITEMS_PER_THREAD)
+    if num_threads <= 1:
+        return func(items)
+    chunk_size = -(-len(items) // num_threads)
+    chunks = [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)]
+    with ThreadPoolExecutor(max_workers=num_threads, thread_name_prefix='ecc batch') as pool:
+        return list(itertools.chain.from_iterable(pool.map(func, chunks)))
+
+
+def sign_transaction_hashes(items: Sequence[Tuple[bytes, bytes]], *,
+                            num_threads: int = None) -> List[bytes]:
+    """Batch version of ECPrivkey.sign_transaction.
+
+    items is a list of (secret bytes, hashed preimage) pairs; returns
+    their DER signatures, in order. With libsecp256k1 the batch is signed
+    without going through python-ecdsa, in a thread pool if num_threads
+    (default: based on batch size and CPU count) is more than one.
+    """
+    for secret, msg_hash in items:
+        assert_bytes(secret, msg_hash)
+        if len(secret) != 32 or not is_secret_within_curve_range(secret):
+            raise InvalidECPointException('Invalid secret scalar')
+        if len(msg_hash) != 32:
+            raise Exception('unexpected size for hash: {}'.format(len(msg_hash)))
+    if not ecc_fast.is_using_fast_ecc():
+        return [ECPrivkey(secret).sign_transaction(msg_hash) for secret, msg_hash in items]
+    return _run_batch(ecc_fast.sign_digests, list(items), num_threads)
+
+
+def _verify_message_hash_python(pubkey: bytes, msg_hash: bytes, sig_string: bytes) -> bool:
+    try:
+        ECPubkey(pubkey).verify_message_hash(sig_string, msg_hash)
+    except Exception:
+        return False
+    return True
+
+
+def verify_message_hashes(items: Sequence[Tuple[bytes, bytes, bytes]], *,
+                          num_threads: int = None) -> List[bool]:
+    """Batch version of ECPubkey.verify_message_hash.
+
+    items is a list of (pubkey bytes, msg_hash, sig_string) triples;
+    returns whether each signature is valid, in order, instead of
+    raising. With libsecp256k1 the batch is verified without going
+    through python-ecdsa, optionally in a thread pool as with
+    sign_transaction_hashes.
+    """
+    if not ecc_fast.is_using_fast_ecc():
+        return [_verify_message_hash_python(*item) for item in items]
+    return _run_batch(ecc_fast.verify_digests, list(items), num_threads)
+
+
 def construct_sig65(sig_string: bytes, recid: int, is_compressed: bool) -> bytes:
     comp = 4 if is_compressed else 0
     return bytes([27 + recid + comp]) + sig_string
+
@@ -5,6 +5,7 @@ import os
 import sys
 import traceback
 import ctypes
+from typing import Sequence, Tuple, List, Optional
 from ctypes.util import find_library
 from ctypes import (
     byref, c_byte, c_int, c_uint, c_char_p, c_size_t, c_void_p, create_string_buffer, CFUNCTYPE, POINTER
@@ -84,6 +85,12 @@ def load_library():
         secp256k1.secp256k1_ec_pubkey_tweak_mul.argtypes = [c_void_p, c_char_p, c_char_p]
         secp256k1.secp256k1_ec_pubkey_tweak_mul.restype = c_int
 
+        secp256k1.secp256k1_ecdsa_signature_serialize_der.argtypes = [c_void_p, c_char_p, c_void_p, c_char_p]
+        secp256k1.secp256k1_ecdsa_signature_serialize_der.restype = c_int
+
+        secp256k1.secp256k1_ec_pubkey_tweak_add.argtypes = [c_void_p, c_char_p, c_char_p]
+        secp256k1.secp256k1_ec_pubkey_tweak_add.restype = c_int
+
         secp256k1.ctx = secp256k1.secp256k1_context_create(SECP256K1_CONTEXT_SIGN | SECP256K1_CONTEXT_VERIFY)
         r = secp256k1.secp256k1_context_randomize(secp256k1.ctx, os.urandom(32))
         if r:
@@ -216,6 +223,86 @@ def is_using_fast_ecc():
     return _patched_functions.monkey_patching_active
 
 
+def sign_digests(items: Sequence[Tuple[bytes, bytes]]) -> List[bytes]:
+    """Signs each (32 byte secret, 32 byte digest) pair with libsecp256k1,
+    returning DER signatures (low S, RFC6979 nonces, as with the patched
+    python-ecdsa). Each signature is verified before being returned.
+
+    The shared context is only read, and ctypes releases the GIL during
+    the calls, so this can run in several threads at once.
+    """
+    ctx = _libsecp256k1.ctx
+    ecdsa_sign = _libsecp256k1.secp256k1_ecdsa_sign
+    ecdsa_verify = _libsecp256k1.secp256k1_ecdsa_verify
+    pubkey_create = _libsecp256k1.secp256k1_ec_pubkey_create
+    serialize_der = _libsecp256k1.secp256k1_ecdsa_signature_serialize_der
+    sig = create_string_buffer(64)
+    pubkey = create_string_buffer(64)
+    der = create_string_buffer(72)
+    der_len = c_size_t()
+    result = []
+    for secret, digest in items:
+        if not ecdsa_sign(ctx, sig, digest, secret, None, None):
+            raise Exception('secp256k1_ecdsa_sign failed')
+        if not (pubkey_create(ctx, pubkey, secret) and ecdsa_verify(ctx, sig, digest, pubkey)):
+            raise Exception('Sanity check verifying our own signature failed.')
+        der_len.value = len(der)
+        serialize_der(ctx, der, byref(der_len), sig)
+        result.append(der.raw[:der_len.value])
+    return result
+
+
+def verify_digests(items: Sequence[Tuple[bytes, bytes, bytes]]) -> List[bool]:
+    """Verifies each (serialized pubkey, 32 byte digest, 64 byte r||s
+    signature) triple with libsecp256k1. High S signatures are accepted,
+    as with the patched python-ecdsa. Thread-safe like sign_digests.
+    """
+    ctx = _libsecp256k1.ctx
+    parse_compact = _libsecp256k1.secp256k1_ecdsa_signature_parse_compact
+    normalize = _libsecp256k1.secp256k1_ecdsa_signature_normalize
+    pubkey_parse = _libsecp256k1.secp256k1_ec_pubkey_parse
+    ecdsa_verify = _libsecp256k1.secp256k1_ecdsa_verify
+    sig = create_string_buffer(64)
+    pubkey = create_string_buffer(64)
+    result = []
+    for pubkey_bytes, digest, sig_string in items:
+        if len(sig_string) != 64 or len(digest) != 32 \
+                or not parse_compact(ctx, sig, sig_string) \
+                or not pubkey_parse(ctx, pubkey, pubkey_bytes, len(pubkey_bytes)):
+            result.append(False)
+            continue
+        normalize(ctx, sig, sig)
+        result.append(1 == ecdsa_verify(ctx, sig, digest, pubkey))
+    return result
+
+
+def add_tweaks_to_pubkey(pubkey_bytes: bytes, tweaks: Sequence[bytes]) -> List[Optional[bytes]]:
+    """Computes pubkey + tweak*G for each 32 byte tweak with libsecp256k1,
+    returning compressed serialized pubkeys. The parent pubkey is only
+    parsed once. The result is None where the tweak is not below the curve
+    order, or the sum is the point at infinity.
+    """
+    ctx = _libsecp256k1.ctx
+    tweak_add = _libsecp256k1.secp256k1_ec_pubkey_tweak_add
+    serialize = _libsecp256k1.secp256k1_ec_pubkey_serialize
+    parent = create_string_buffer(64)
+    if not _libsecp256k1.secp256k1_ec_pubkey_parse(ctx, parent, pubkey_bytes, len(pubkey_bytes)):
+        raise Exception('public key could not be parsed or is invalid')
+    child = create_string_buffer(64)
+    serialized = create_string_buffer(33)
+    serialized_len = c_size_t()
+    result = []
+    for tweak in tweaks:
+        ctypes.memmove(child, parent, 64)
+        if not tweak_add(ctx, child, tweak):
+            result.append(None)
+            continue
+        serialized_len.value = 33
+        serialize(ctx, serialized, byref(serialized_len), child, SECP256K1_EC_COMPRESSED)
+        result.append(serialized.raw)
+    return result
+
+
 try:
     _libsecp256k1 = load_library()
 except:
@@ -518,7 +518,7 @@ class ElectrumWindow(App):
         # connect callbacks
         if self.network:
             interests = ['wallet_updated', 'network_updated', 'blockchain_updated',
-                         'status', 'new_transaction', 'verified']
+                         'status', 'new_transactions', 'verified']
             self.network.register_callback(self.on_network_event, interests)
             self.network.register_callback(self.on_fee, ['fee'])
             self.network.register_callback(self.on_fee_histogram, ['fee_histogram'])
@@ -718,7 +718,7 @@ class ElectrumWindow(App):
             self._trigger_update_wallet()
         elif event == 'status':
             self._trigger_update_status()
-        elif event == 'new_transaction':
+        elif event == 'new_transactions':
             self._trigger_update_wallet()
         elif event == 'verified':
             self._trigger_update_wallet()
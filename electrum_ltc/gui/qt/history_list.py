@@ -224,8 +224,9 @@ class HistoryModel(QAbstractItemModel, Logger):
         self.dataChanged.emit(topLeft, bottomRight, [Qt.DisplayRole])
 
     def get_domain(self):
-        '''Overridden in address_dialog.py'''
-        return self.parent.wallet.get_addresses()
+        '''Overridden in address_dialog.py.
+        None means the whole wallet, which is served from the history index.'''
+        return None
 
     @profiler
     def refresh(self, reason: str):
@@ -216,7 +216,7 @@ class ElectrumWindow(QMainWindow, MessageBoxMixin, Logger):
         if self.network:
             self.network_signal.connect(self.on_network_qt)
             interests = ['wallet_updated', 'network_updated', 'blockchain_updated',
-                         'new_transaction', 'status',
+                         'new_transactions', 'status',
                          'banner', 'verified', 'fee', 'fee_histogram']
             # To avoid leaking references to "self" that prevent the
             # window from being GC-ed when closed, callbacks should be
@@ -359,10 +359,11 @@ class ElectrumWindow(QMainWindow, MessageBoxMixin, Logger):
         elif event == 'blockchain_updated':
             # to update number of confirmations in history
             self.need_update.set()
-        elif event == 'new_transaction':
-            wallet, tx = args
+        elif event == 'new_transactions':
+            wallet, txs = args
             if wallet == self.wallet:
-                self.tx_notification_queue.put(tx)
+                for tx in txs:
+                    self.tx_notification_queue.put(tx)
         elif event in ['status', 'banner', 'verified', 'fee', 'fee_histogram']:
             # Handle in GUI thread
             self.network_signal.emit(event, args)
@@ -29,7 +29,7 @@ import sys
 import traceback
 import asyncio
 import socket
-from typing import Tuple, Union, List, TYPE_CHECKING, Optional
+from typing import Tuple, Union, List, TYPE_CHECKING, Optional, Sequence
 from collections import defaultdict
 from ipaddress import IPv4Network, IPv6Network, ip_address
 import itertools
@@ -83,6 +83,13 @@ class NotificationSession(RPCSession):
         self._msg_counter = itertools.count(start=1)
         self.interface = None  # type: Optional[Interface]
         self.cost_hard_limit = 0  # disable aiorpcx resource limits
+        # see send_request_coalesced
+        self.batch_window = 0.005  # seconds
+        self.max_batch_size = 100
+        self._pending_requests = []  # type: List[Tuple[str, list, asyncio.Future]]
+        self._flush_handle = None  # type: Optional[asyncio.TimerHandle]
+        self.num_coalesced_requests = 0
+        self.num_coalesced_batches = 0
 
     async def handle_request(self, request):
         self.maybe_log(f"--> {request}")
@@ -122,6 +129,86 @@ class NotificationSession(RPCSession):
             self.maybe_log(f"--> {response} (id: {msg_id})")
             return response
 
+    async def send_request_batch(self, requests: Sequence[Tuple[str, list]], *, timeout=None) -> list:
+        """Sends (method, params) pairs to the server as a single JSON-RPC batch.
+        Returns the results in the same order. If the server returned an error
+        for a request, its item is the corresponding CodeMessageError instance.
+        The timeout applies to the whole batch, and defaults to the session's.
+        """
+        if timeout is None:
+            timeout = self.sent_request_timeout
+        msg_id = next(self._msg_counter)
+        self.maybe_log(f"<-- batch of {len(requests)} requests (id: {msg_id})")
+
+        async def send_batch():
+            async with self.send_batch() as batch:
+                for method, params in requests:
+                    batch.add_request(method, params)
+            return list(batch.results)
+
+        try:
+            results = await asyncio.wait_for(send_batch(), timeout)
+        except (TaskTimeout, asyncio.TimeoutError) as e:
+            raise RequestTimedOut(f'request timed out: batch of {len(requests)} (id: {msg_id})') from e
+        self.maybe_log(f"--> {results} (id: {msg_id})")
+        return results
+
+    async def send_request_coalesced(self, method: str, params: list, *, timeout=None):
+        """Like send_request, but the request is held back for up to
+        batch_window seconds, and sent in a single JSON-RPC batch together
+        with the other requests coalesced in the meantime (at most
+        max_batch_size). The timeout applies to this request only, and
+        defaults to the session's (see NetworkTimeout).
+        """
+        if timeout is None:
+            timeout = self.sent_request_timeout
+        loop = asyncio.get_event_loop()
+        fut = loop.create_future()
+        self._pending_requests.append((method, params, fut))
+        if len(self._pending_requests) >= self.max_batch_size:
+            self._flush_pending_requests()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.batch_window, self._flush_pending_requests)
+        try:
+            return await asyncio.wait_for(fut, timeout)
+        except asyncio.TimeoutError as e:
+            raise RequestTimedOut(f'request timed out: {method} {params}') from e
+
+    def _flush_pending_requests(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        requests, self._pending_requests = self._pending_requests, []
+        # requests that timed out before being sent are dropped
+        requests = [r for r in requests if not r[2].done()]
+        if requests:
+            asyncio.ensure_future(self._send_pending_requests(requests))
+
+    async def _send_pending_requests(self, requests: List[Tuple[str, list, asyncio.Future]]):
+        futures = [fut for method, params, fut in requests]
+        self.num_coalesced_requests += len(requests)
+        self.num_coalesced_batches += 1
+        try:
+            if len(requests) == 1:
+                method, params, fut = requests[0]
+                results = [await self.send_request(method, params)]
+            else:
+                results = await self.send_request_batch([(method, params) for method, params, fut in requests])
+        except asyncio.CancelledError:
+            for fut in futures:
+                fut.cancel()
+            raise
+        except BaseException as e:
+            results = [e] * len(futures)
+        # demultiplex; futures are done already if their request timed out
+        for fut, result in zip(futures, results):
+            if fut.done():
+                continue
+            if isinstance(result, BaseException):
+                fut.set_exception(result)
+            else:
+                fut.set_result(result)
+
     def set_default_timeout(self, timeout):
         self.sent_request_timeout = timeout
         self.max_send_delay = timeout
@@ -138,6 +225,39 @@ class NotificationSession(RPCSession):
             self.cache[key] = result
         await queue.put(params + [result])
 
+    async def subscribe_batch(self, method: str, params_list: Sequence[List], queue: asyncio.Queue, *,
+                              timeout=None):
+        """Like subscribe, for many subscriptions at once. Those that are
+        not cached are requested in a single JSON-RPC batch. If the server
+        returns an error for any of them, or the batch times out, the first
+        such error is raised and none of them is subscribed to.
+        """
+        keys = [self.get_hashable_key_for_rpc_call(method, params) for params in params_list]
+        to_request = [(key, params) for key, params in zip(keys, params_list) if key not in self.cache]
+        # registered before sending: a notification may be handled before we get the results
+        for key in keys:
+            self.subscriptions[key].append(queue)
+        results = []
+        try:
+            if to_request:
+                results = await self.send_request_batch([(method, params) for key, params in to_request],
+                                                        timeout=timeout)
+                for result in results:
+                    if isinstance(result, Exception):
+                        raise result
+        except BaseException:
+            for key in keys:
+                self.subscriptions[key].remove(queue)
+                if not self.subscriptions[key]:
+                    del self.subscriptions[key]
+                    self.cache.pop(key, None)
+            raise
+        for (key, params), result in zip(to_request, results):
+            # unless a notification already brought a newer status
+            self.cache.setdefault(key, result)
+        for key, params in zip(keys, params_list):
+            await queue.put(params + [self.cache[key]])
+
     def unsubscribe(self, queue):
         """Unsubscribe a callback to free object references to enable GC."""
         # note: we can't unsubscribe from the server, so we keep receiving
@@ -447,6 +567,8 @@ class Interface(Logger):
             self.session = session  # type: NotificationSession
             self.session.interface = self
             self.session.set_default_timeout(self.network.get_network_timeout_seconds(NetworkTimeout.Generic))
+            self.session.batch_window = self.network.config.get('request_batch_window_ms', 5) / 1000
+            self.session.max_batch_size = self.network.config.get('request_batch_size', 100)
             try:
                 ver = await session.send_request('server.version', [self.client_name(), version.PROTOCOL_VERSION])
             except aiorpcx.jsonrpc.RPCError as e:
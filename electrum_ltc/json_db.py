@@ -26,12 +26,14 @@ import os
 import ast
 import json
 import copy
+import time
 import threading
 from collections import defaultdict
-from typing import Dict, Optional
+from contextlib import contextmanager
+from typing import Dict, Optional, List, Tuple, Sequence
 
 from . import util, bitcoin
-from .util import profiler, WalletFileException, multisig_type, TxMinedInfo
+from .util import profiler, WalletFileException, multisig_type, TxMinedInfo, LRUCache
 from .keystore import bip44_derivation
 from .transaction import Transaction
 from .logging import Logger
@@ -43,6 +45,20 @@ NEW_SEED_VERSION = 11       # electrum versions >= 2.0
 FINAL_SEED_VERSION = 18     # electrum >= 2.7 will set this to prevent
                             # old versions from overwriting new format
 
+# names of JsonDB methods decorated with @modifier; these are what the
+# storage journal records and replays
+JOURNALED_METHODS = set()
+
+# converts JSON-decoded journal arguments back to what the modifiers expect
+JOURNAL_ARG_DECODERS = {
+    'add_transaction': lambda tx_hash, tx: (tx_hash, Transaction(tx)),
+    'add_verified_tx': lambda txid, info: (txid, TxMinedInfo(*info)),
+}
+
+# max number of deserialized Transaction objects kept in memory;
+# the rest stay as raw hex and are parsed on access
+TX_CACHE_SIZE = 1000
+
 
 class JsonDBJsonEncoder(util.MyEncoder):
     def default(self, obj):
@@ -60,6 +76,13 @@ class JsonDB(Logger):
         self._modified = False
         self.manual_upgrades = manual_upgrades
         self._called_after_upgrade_tasks = False
+        self.load_timings = {}  # type: Dict[str, float]  # load phase -> seconds
+        self._load_phase_stack = []  # type: List[float]
+        self._tx_cache = LRUCache(maxsize=TX_CACHE_SIZE)  # type: Dict[str, Transaction]
+        # serialized modifier calls not yet written to the storage journal.
+        # None means journaling is disabled (or broken), see WalletStorage
+        self._journal_ops = None  # type: Optional[List[str]]
+        self._modifier_depth = 0
         if raw:  # loading existing db
             self.load_data(raw)
         else:  # creating new db
@@ -74,10 +97,23 @@ class JsonDB(Logger):
         return self._modified
 
     def modifier(func):
+        JOURNALED_METHODS.add(func.__name__)
         def wrapper(self, *args, **kwargs):
             with self.lock:
                 self._modified = True
-                return func(self, *args, **kwargs)
+                self._modifier_depth += 1
+                try:
+                    result = func(self, *args, **kwargs)
+                except BaseException:
+                    # a partially applied call cannot be replayed
+                    self._journal_ops = None
+                    raise
+                finally:
+                    self._modifier_depth -= 1
+                if self._journal_ops is not None and self._modifier_depth == 0:
+                    op = json.dumps([func.__name__, args, kwargs], cls=JsonDBJsonEncoder)
+                    self._journal_ops.append(op)
+                return result
         return wrapper
 
     def locked(func):
@@ -115,11 +151,99 @@ class JsonDB(Logger):
     def commit(self):
         pass
 
+    def enable_journal(self):
+        """Start recording modifier calls; any pending ones are dropped.
+        Called by the storage once the file on disk reflects the current state.
+        """
+        with self.lock:
+            self._journal_ops = []
+
+    def disable_journal(self):
+        with self.lock:
+            self._journal_ops = None
+
+    def pop_journal_ops(self) -> Optional[List[str]]:
+        """Returns the modifier calls recorded since the last call, or None
+        if they cannot be used and the whole db needs to be written.
+        """
+        with self.lock:
+            ops = self._journal_ops
+            if ops is not None:
+                self._journal_ops = []
+            return ops
+
+    def set_journal_id(self, journal_id: Optional[str]):
+        """Tags the data with the id of the journal that continues it.
+        Not an user modification, so the db is not marked as modified.
+        """
+        with self.lock:
+            if journal_id is None:
+                self.data.pop('journal_id', None)
+            else:
+                self.data['journal_id'] = journal_id
+
+    def replay_journal(self, ops: Sequence[str]):
+        if not ops:
+            return
+        with self.lock:
+            if not self._called_after_upgrade_tasks:
+                raise WalletFileException('cannot replay journal on a db that requires upgrade')
+            journal_ops = self._journal_ops
+            self._journal_ops = None
+            try:
+                self.load_addresses(self.get('wallet_type'))
+                for op in ops:
+                    name, args, kwargs = json.loads(op)
+                    if name not in JOURNALED_METHODS:
+                        raise WalletFileException(f'unknown journal operation: {name}')
+                    decoder = JOURNAL_ARG_DECODERS.get(name)
+                    if decoder:
+                        args = decoder(*args)
+                    getattr(self, name)(*args, **kwargs)
+            finally:
+                self._journal_ops = journal_ops
+
+    @contextmanager
+    def load_phase(self, name: str):
+        """Accumulates the time spent in a phase of wallet loading into self.load_timings.
+        Time spent in nested phases is only attributed to the innermost one.
+        """
+        t0 = time.monotonic()
+        self._load_phase_stack.append(0.0)
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - t0
+            nested = self._load_phase_stack.pop()
+            self.load_timings[name] = self.load_timings.get(name, 0) + elapsed - nested
+            if self._load_phase_stack:
+                self._load_phase_stack[-1] += elapsed
+
+    def get_load_timings_report(self) -> str:
+        total = sum(self.load_timings.values())
+        phases = ', '.join(f'{name} {t:.3f}s' for name, t in self.load_timings.items())
+        return f'{total:.3f}s ({phases})'
+
     @locked
     def dump(self):
         return json.dumps(self.data, indent=4, sort_keys=True, cls=JsonDBJsonEncoder)
 
     def load_data(self, s):
+        with self.load_phase('parse_json'):
+            self._parse_data(s)
+        if not isinstance(self.data, dict):
+            raise WalletFileException("Malformed wallet file (not dict)")
+
+        if not self.manual_upgrades and self.requires_split():
+            raise WalletFileException("This wallet has multiple accounts and must be split")
+
+        if not self.requires_upgrade():
+            self._after_upgrade_tasks()
+        elif not self.manual_upgrades:
+            with self.load_phase('upgrade'):
+                self.upgrade()
+
+    def _parse_data(self, s):
         try:
             self.data = json.loads(s)
         except:
@@ -137,16 +261,6 @@ class JsonDB(Logger):
                     self.logger.info(f'Failed to convert label to json format: {key}')
                     continue
                 self.data[key] = value
-        if not isinstance(self.data, dict):
-            raise WalletFileException("Malformed wallet file (not dict)")
-
-        if not self.manual_upgrades and self.requires_split():
-            raise WalletFileException("This wallet has multiple accounts and must be split")
-
-        if not self.requires_upgrade():
-            self._after_upgrade_tasks()
-        elif not self.manual_upgrades:
-            self.upgrade()
 
     def requires_split(self):
         d = self.get('accounts', {})
@@ -541,7 +655,11 @@ class JsonDB(Logger):
         if addr not in d:
             # note that as this is a set, we can ignore "duplicates"
             d[addr] = set()
-        d[addr].add((ser, v))
+        elif not isinstance(d[addr], set):
+            d[addr] = set(tuple(x) for x in d[addr])
+        if (ser, v) not in d[addr]:
+            d[addr].add((ser, v))
+            self._utxo_index_add_spend(addr, ser)
 
     @modifier
     def add_txo_addr(self, tx_hash, addr, n, v, is_coinbase):
@@ -551,7 +669,10 @@ class JsonDB(Logger):
         if addr not in d:
             # note that as this is a set, we can ignore "duplicates"
             d[addr] = set()
+        elif not isinstance(d[addr], set):
+            d[addr] = set(tuple(x) for x in d[addr])
         d[addr].add((n, v, is_coinbase))
+        self._utxo_index_add_txo(tx_hash, addr, n, v, is_coinbase)
 
     @locked
     def list_txi(self):
@@ -563,11 +684,101 @@ class JsonDB(Logger):
 
     @modifier
     def remove_txi(self, tx_hash):
-        self.txi.pop(tx_hash, None)
+        d = self.txi.pop(tx_hash, None) or {}
+        for addr, lst in d.items():
+            for ser, v in lst:
+                self._utxo_index_remove_spend(addr, ser)
 
     @modifier
     def remove_txo(self, tx_hash):
-        self.txo.pop(tx_hash, None)
+        d = self.txo.pop(tx_hash, None) or {}
+        for addr, lst in d.items():
+            for n, v, is_cb in lst:
+                self._utxo_index_remove_txo(tx_hash, addr, n)
+
+    # The UTXO index is derived from txi/txo and kept in memory only:
+    #   _utxos:         address -> outpoint -> (value, is_coinbase), unspent outputs
+    #   _txo_index:     outpoint -> (address, value, is_coinbase), all outputs in txo
+    #   _txi_refcount:  outpoint -> number of txi entries spending it
+    # An output is unspent iff it is in txo and no txi entry refers to it.
+    # Heights are not stored; they change with SPV and are looked up by the caller.
+
+    def _build_utxo_index(self):
+        txo_index = {}
+        txi_refcount = defaultdict(int)
+        utxos = defaultdict(dict)
+        for tx_hash, d in self.txo.items():
+            for addr, lst in d.items():
+                for n, v, is_cb in lst:
+                    txo_index[tx_hash + ':%d' % n] = (addr, v, is_cb)
+        for d in self.txi.values():
+            for addr, lst in d.items():
+                for ser, v in lst:
+                    txi_refcount[ser] += 1
+        for ser, (addr, v, is_cb) in txo_index.items():
+            if ser not in txi_refcount:
+                utxos[addr][ser] = (v, is_cb)
+        return txo_index, txi_refcount, utxos
+
+    def _load_utxo_index(self):
+        self._txo_index, self._txi_refcount, self._utxos = self._build_utxo_index()
+
+    def _utxo_index_add_txo(self, tx_hash, addr, n, v, is_cb):
+        ser = tx_hash + ':%d' % n
+        self._txo_index[ser] = (addr, v, is_cb)
+        if ser not in self._txi_refcount:
+            self._utxos[addr][ser] = (v, is_cb)
+
+    def _utxo_index_remove_txo(self, tx_hash, addr, n):
+        ser = tx_hash + ':%d' % n
+        self._txo_index.pop(ser, None)
+        self._utxos[addr].pop(ser, None)
+        if not self._utxos[addr]:
+            self._utxos.pop(addr)
+
+    def _utxo_index_add_spend(self, addr, ser):
+        self._txi_refcount[ser] += 1
+        self._utxos[addr].pop(ser, None)
+        if not self._utxos[addr]:
+            self._utxos.pop(addr)
+
+    def _utxo_index_remove_spend(self, addr, ser):
+        self._txi_refcount[ser] -= 1
+        if self._txi_refcount[ser] > 0:
+            return
+        self._txi_refcount.pop(ser)
+        txo = self._txo_index.get(ser)
+        if txo is not None:
+            txo_addr, v, is_cb = txo
+            self._utxos[txo_addr][ser] = (v, is_cb)
+
+    @locked
+    def get_addr_utxos(self, address) -> Dict[str, Tuple[int, bool]]:
+        """Returns outpoint -> (value, is_coinbase) for the unspent outputs of address."""
+        return dict(self._utxos.get(address, {}))
+
+    @locked
+    def check_utxo_index(self) -> List[str]:
+        """Compares the UTXO index against one rebuilt from txi/txo.
+        Returns a list of human-readable discrepancies (empty if consistent).
+        """
+        txo_index, txi_refcount, utxos = self._build_utxo_index()
+        errors = []
+        for addr in sorted(set(utxos) | set(self._utxos)):
+            expected = utxos.get(addr, {})
+            actual = self._utxos.get(addr, {})
+            for ser in sorted(set(expected) - set(actual)):
+                errors.append(f"{addr}: missing utxo {ser}")
+            for ser in sorted(set(actual) - set(expected)):
+                errors.append(f"{addr}: spurious utxo {ser}")
+            for ser in sorted(set(expected) & set(actual)):
+                if expected[ser] != actual[ser]:
+                    errors.append(f"{addr}: utxo {ser} is {actual[ser]}, expected {expected[ser]}")
+        if txo_index != self._txo_index:
+            errors.append("txo index differs")
+        if dict(txi_refcount) != dict(self._txi_refcount):
+            errors.append("txi refcounts differ")
+        return errors
 
     @locked
     def list_spent_outpoints(self):
@@ -602,15 +813,28 @@ class JsonDB(Logger):
     @modifier
     def add_transaction(self, tx_hash: str, tx: Transaction) -> None:
         assert isinstance(tx, Transaction)
-        self.transactions[tx_hash] = tx
+        self.transactions[tx_hash] = str(tx)
+        self._tx_cache[tx_hash] = tx
 
     @modifier
     def remove_transaction(self, tx_hash) -> Optional[Transaction]:
-        return self.transactions.pop(tx_hash, None)
+        tx = self._tx_cache.pop(tx_hash, None)
+        raw = self.transactions.pop(tx_hash, None)
+        if tx is None and raw is not None:
+            tx = Transaction(raw)
+        return tx
 
     @locked
     def get_transaction(self, tx_hash: str) -> Optional[Transaction]:
-        return self.transactions.get(tx_hash)
+        tx = self._tx_cache.get(tx_hash)
+        if tx is None:
+            raw = self.transactions.get(tx_hash)
+            if raw is None:
+                return None
+            # transactions are stored as raw hex and only deserialized on access
+            tx = Transaction(raw)
+            self._tx_cache[tx_hash] = tx
+        return tx
 
     @locked
     def list_transactions(self):
@@ -632,6 +856,12 @@ class JsonDB(Logger):
     def set_addr_history(self, addr, hist):
         self.history[addr] = hist
 
+    @modifier
+    def set_empty_addr_histories(self, addrs):
+        """Sets an empty history for each address that has none."""
+        for addr in addrs:
+            self.history.setdefault(addr, [])
+
     @modifier
     def remove_addr_history(self, addr):
         self.history.pop(addr, None)
@@ -710,6 +940,18 @@ class JsonDB(Logger):
         self._addr_to_addr_index[addr] = (False, len(self.receiving_addresses))
         self.receiving_addresses.append(addr)
 
+    @modifier
+    def add_change_addresses(self, addrs):
+        for addr in addrs:
+            self._addr_to_addr_index[addr] = (True, len(self.change_addresses))
+            self.change_addresses.append(addr)
+
+    @modifier
+    def add_receiving_addresses(self, addrs):
+        for addr in addrs:
+            self._addr_to_addr_index[addr] = (False, len(self.receiving_addresses))
+            self.receiving_addresses.append(addr)
+
     @locked
     def get_address_index(self, address):
         return self._addr_to_addr_index.get(address)
@@ -756,38 +998,38 @@ class JsonDB(Logger):
         # references in self.data
         self.txi = self.get_data_ref('txi')  # txid -> address -> list of (prev_outpoint, value)
         self.txo = self.get_data_ref('txo')  # txid -> address -> list of (output_index, value, is_coinbase)
-        self.transactions = self.get_data_ref('transactions')   # type: Dict[str, Transaction]
+        self.transactions = self.get_data_ref('transactions')   # type: Dict[str, str]  # txid -> raw hex
         self.spent_outpoints = self.get_data_ref('spent_outpoints')
         self.history = self.get_data_ref('addr_history')  # address -> list of (txid, height)
         self.verified_tx = self.get_data_ref('verified_tx3')  # txid -> (height, timestamp, txpos, header_hash)
         self.tx_fees = self.get_data_ref('tx_fees')
-        # convert raw hex transactions to Transaction objects
-        for tx_hash, raw_tx in self.transactions.items():
-            self.transactions[tx_hash] = Transaction(raw_tx)
-        # convert list to set
-        for t in self.txi, self.txo:
-            for d in t.values():
-                for addr, lst in d.items():
-                    d[addr] = set([tuple(x) for x in lst])
-        # remove unreferenced tx
-        for tx_hash in list(self.transactions.keys()):
-            if not self.get_txi(tx_hash) and not self.get_txo(tx_hash):
-                self.logger.info(f"removing unreferenced tx: {tx_hash}")
-                self.transactions.pop(tx_hash)
-        # remove unreferenced outpoints
-        for prevout_hash in self.spent_outpoints.keys():
-            d = self.spent_outpoints[prevout_hash]
-            for prevout_n, spending_txid in list(d.items()):
-                if spending_txid not in self.transactions:
-                    self.logger.info("removing unreferenced spent outpoint")
-                    d.pop(prevout_n)
+        # deserialized Transaction objects, see get_transaction
+        self._tx_cache = LRUCache(maxsize=TX_CACHE_SIZE)  # type: Dict[str, Transaction]
+        # note: txi/txo lists are converted to sets lazily, when they are modified
+        with self.load_phase('cleanup'):
+            # remove unreferenced tx
+            for tx_hash in list(self.transactions.keys()):
+                if not self.get_txi(tx_hash) and not self.get_txo(tx_hash):
+                    self.logger.info(f"removing unreferenced tx: {tx_hash}")
+                    self.transactions.pop(tx_hash)
+            # remove unreferenced outpoints
+            for prevout_hash in self.spent_outpoints.keys():
+                d = self.spent_outpoints[prevout_hash]
+                for prevout_n, spending_txid in list(d.items()):
+                    if spending_txid not in self.transactions:
+                        self.logger.info("removing unreferenced spent outpoint")
+                        d.pop(prevout_n)
+        with self.load_phase('utxo_index'):
+            self._load_utxo_index()
 
     @modifier
     def clear_history(self):
         self.txi.clear()
         self.txo.clear()
+        self._load_utxo_index()
         self.spent_outpoints.clear()
         self.transactions.clear()
+        self._tx_cache.clear()
         self.history.clear()
         self.verified_tx.clear()
         self.tx_fees.clear()
@@ -23,10 +23,14 @@
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import asyncio
+import json
 from base64 import b64decode
-import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Callable, Dict, Optional, Tuple
 
-from jsonrpclib.SimpleJSONRPCServer import SimpleJSONRPCServer, SimpleJSONRPCRequestHandler
+from aiohttp import web
 
 from . import util
 from .logging import Logger
@@ -47,35 +51,54 @@ class RPCAuthUnsupportedType(Exception):
         return 'Authentication failed (only basic auth is supported)'
 
 
-# based on http://acooke.org/cute/BasicHTTPA0.html by andrew cooke
-class VerifyingJSONRPCServer(SimpleJSONRPCServer, Logger):
+# JSON-RPC 2.0 error codes
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INTERNAL_ERROR = -32603
 
-    def __init__(self, *args, rpc_user, rpc_password, **kargs):
+
+class AuthenticatedJSONRPCServer(Logger):
+    """JSON-RPC 2.0 server over HTTP, running on an asyncio event loop.
+
+    Requests must use HTTP basic auth, unless rpc_password is ''.
+    Batch requests are supported, and connections are kept alive.
+    Coroutine functions are run on the event loop; other functions
+    are run on a bounded thread pool, so that a slow command neither
+    blocks the event loop nor the requests that come after it.
+    """
+
+    def __init__(self, *, rpc_user, rpc_password, max_workers: int = 8,
+                 keepalive_timeout: float = 75.0):
         Logger.__init__(self)
         self.rpc_user = rpc_user
         self.rpc_password = rpc_password
-
-        class VerifyingRequestHandler(SimpleJSONRPCRequestHandler):
-            def parse_request(myself):
-                # first, call the original implementation which returns
-                # True if all OK so far
-                if SimpleJSONRPCRequestHandler.parse_request(myself):
-                    # Do not authenticate OPTIONS-requests
-                    if myself.command.strip() == 'OPTIONS':
-                        return True
-                    try:
-                        self.authenticate(myself.headers)
-                        return True
-                    except (RPCAuthCredentialsInvalid, RPCAuthCredentialsMissing,
-                            RPCAuthUnsupportedType) as e:
-                        myself.send_error(401, repr(e))
-                    except BaseException as e:
-                        self.logger.exception('')
-                        myself.send_error(500, repr(e))
-                return False
-
-        SimpleJSONRPCServer.__init__(
-            self, requestHandler=VerifyingRequestHandler, *args, **kargs)
+        self.keepalive_timeout = keepalive_timeout
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='jsonrpc')
+        self._functions = {}  # type: Dict[str, Callable]
+        self._runner = None  # type: Optional[web.AppRunner]
+
+    def register_function(self, f: Callable, name: str = None):
+        name = name or f.__name__
+        assert name not in self._functions, f'name collision for {name}'
+        self._functions[name] = f
+
+    async def start(self, host: str, port: int) -> Tuple[str, int]:
+        """Starts listening, returns the (host, port) of the socket."""
+        app = web.Application()
+        # jsonrpclib posts to /RPC2 by default, other clients to /
+        app.router.add_route('POST', '/{path:.*}', self.handle)
+        app.router.add_route('OPTIONS', '/{path:.*}', self.handle_options)
+        self._runner = web.AppRunner(app, access_log=None, keepalive_timeout=self.keepalive_timeout)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        return site._server.sockets[0].getsockname()[:2]
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+        self.executor.shutdown(wait=False)
 
     def authenticate(self, headers):
         if self.rpc_password == '':
@@ -95,5 +118,68 @@ class VerifyingJSONRPCServer(SimpleJSONRPCServer, Logger):
         (username, _, password) = credentials.partition(':')
         if not (util.constant_time_compare(username, self.rpc_user)
                 and util.constant_time_compare(password, self.rpc_password)):
-            time.sleep(0.050)
             raise RPCAuthCredentialsInvalid()
+
+    async def handle_options(self, request: web.Request) -> web.Response:
+        # Do not authenticate OPTIONS-requests
+        return web.Response()
+
+    async def handle(self, request: web.Request) -> web.Response:
+        try:
+            self.authenticate(request.headers)
+        except RPCAuthCredentialsInvalid as e:
+            await asyncio.sleep(0.050)
+            return web.Response(status=401, text=repr(e))
+        except (RPCAuthCredentialsMissing, RPCAuthUnsupportedType) as e:
+            return web.Response(status=401, text=repr(e))
+        except BaseException as e:
+            self.logger.exception('')
+            return web.Response(status=500, text=repr(e))
+        try:
+            data = json.loads(await request.text())
+        except ValueError as e:
+            return self._json_response(self._error(None, PARSE_ERROR, f'Parse error: {e}'))
+        if isinstance(data, list):
+            if not data:
+                return self._json_response(self._error(None, INVALID_REQUEST, 'Invalid Request'))
+            responses = await asyncio.gather(*[self._handle_single(x) for x in data])
+            responses = [x for x in responses if x is not None]
+            # a batch of notifications gets no response
+            return self._json_response(responses) if responses else web.Response()
+        response = await self._handle_single(data)
+        return self._json_response(response) if response is not None else web.Response()
+
+    async def _handle_single(self, req) -> Optional[dict]:
+        if not isinstance(req, dict) or not isinstance(req.get('method'), str):
+            return self._error(None, INVALID_REQUEST, 'Invalid Request')
+        response = await self._call(req.get('id'), req['method'], req.get('params', []))
+        # notifications get no response
+        return response if 'id' in req else None
+
+    async def _call(self, _id, method: str, params) -> dict:
+        f = self._functions.get(method)
+        if f is None:
+            return self._error(_id, METHOD_NOT_FOUND, f'Method not found: {method}')
+        if isinstance(params, dict):
+            call = partial(f, **params)
+        elif isinstance(params, list):
+            call = partial(f, *params)
+        else:
+            return self._error(_id, INVALID_REQUEST, 'Invalid Request')
+        try:
+            if asyncio.iscoroutinefunction(f):
+                result = await call()
+            else:
+                result = await asyncio.get_event_loop().run_in_executor(self.executor, call)
+        except Exception as e:
+            self.logger.exception(f'error while executing RPC {method}')
+            return self._error(_id, INTERNAL_ERROR, f'Server error: {repr(e)}')
+        return {'jsonrpc': '2.0', 'id': _id, 'result': result}
+
+    @staticmethod
+    def _error(_id, code: int, message: str) -> dict:
+        return {'jsonrpc': '2.0', 'id': _id, 'error': {'code': code, 'message': message}}
+
+    @staticmethod
+    def _json_response(response) -> web.Response:
+        return web.json_response(response, dumps=partial(json.dumps, cls=util.MyEncoder))
@@ -26,7 +26,8 @@
 
 from unicodedata import normalize
 import hashlib
-from typing import Tuple
+import random
+from typing import Tuple, Dict, Optional, List
 
 from . import bitcoin, ecc, constants, bip32
 from .bitcoin import (deserialize_privkey, serialize_privkey,
@@ -37,7 +38,7 @@ from .ecc import string_to_number, number_to_string
 from .crypto import (pw_decode, pw_encode, sha256, sha256d, PW_HASH_VERSION_LATEST,
                      SUPPORTED_PW_HASH_VERSIONS, UnsupportedPasswordHashVersion)
 from .util import (InvalidPassword, WalletFileException,
-                   BitcoinException, bh2u, bfh, inv_dict)
+                   BitcoinException, bh2u, bfh, inv_dict, LRUCache)
 from .mnemonic import Mnemonic, load_wordlist, seed_type, is_seed
 from .plugin import run_hook
 from .logging import Logger
@@ -255,31 +256,125 @@ class Deterministic_KeyStore(Software_KeyStore):
             return ''
 
 
+# max number of derived pubkeys each keystore keeps in memory
+PUBKEY_CACHE_SIZE = 200_000
+# number of persisted pubkeys re-derived when loading a cache from disk
+PUBKEY_CACHE_CHECK_SAMPLES = 10
+XPUB_DERIVATION_CACHE_SIZE = 2_000
+
+_xpub_derivation_cache = LRUCache(maxsize=XPUB_DERIVATION_CACHE_SIZE)  # type: Dict[Tuple[str, Tuple[int, ...]], str]
+
+
 class Xpub:
 
     def __init__(self):
         self.xpub = None
-        self.xpub_receive = None
-        self.xpub_change = None
+        self._reset_derivation_cache()
+
+    def _reset_derivation_cache(self):
+        # branch nodes (m/0, m/1), keyed by path relative to the xpub
+        self._node_cache = {}  # type: Dict[Tuple[int, ...], BIP32Node]
+        # leaf pubkeys, keyed by (for_change, n)
+        self._pubkey_cache = LRUCache(maxsize=PUBKEY_CACHE_SIZE)  # type: Dict[Tuple[int, int], str]
+        self._derivation_cache_xpub = self.xpub
+
+    def _check_derivation_cache(self):
+        # the xpub is a plain attribute that may be replaced (e.g. add_xprv)
+        if self._derivation_cache_xpub != self.xpub:
+            self._reset_derivation_cache()
 
     def get_master_public_key(self):
         return self.xpub
 
-    def derive_pubkey(self, for_change, n):
-        xpub = self.xpub_change if for_change else self.xpub_receive
-        if xpub is None:
+    def get_branch_node(self, for_change) -> BIP32Node:
+        self._check_derivation_cache()
+        path = (int(for_change),)
+        node = self._node_cache.get(path)
+        if node is None:
             rootnode = BIP32Node.from_xkey(self.xpub)
-            xpub = rootnode.subkey_at_public_derivation((for_change,)).to_xpub()
-            if for_change:
-                self.xpub_change = xpub
-            else:
-                self.xpub_receive = xpub
-        return self.get_pubkey_from_xpub(xpub, (n,))
+            node = rootnode.subkey_at_public_derivation(path, cache=self._node_cache)
+        return node
+
+    def derive_pubkey(self, for_change, n):
+        self._check_derivation_cache()
+        for_change = int(for_change)
+        key = (for_change, n)
+        pubkey = self._pubkey_cache.get(key)
+        if pubkey is None:
+            pubkey = self._derive_pubkey(for_change, n)
+            self._pubkey_cache[key] = pubkey
+        return pubkey
+
+    def derive_pubkeys_range(self, for_change, start, stop) -> List[str]:
+        """Returns the pubkeys at indices start..stop-1 of a branch,
+        deriving the ones not in the cache in a single batch.
+        """
+        self._check_derivation_cache()
+        for_change = int(for_change)
+        pubkeys = [self._pubkey_cache.get((for_change, n)) for n in range(start, stop)]
+        missing = [n for n, pubkey in zip(range(start, stop), pubkeys) if pubkey is None]
+        if missing:
+            branch = self.get_branch_node(for_change)
+            derived = bip32.CKD_pub_batch(branch.eckey.get_public_key_bytes(compressed=True),
+                                          branch.chaincode, missing)
+            for n, (pubkey, chaincode) in zip(missing, derived):
+                pubkey = pubkeys[n - start] = bh2u(pubkey)
+                self._pubkey_cache[(for_change, n)] = pubkey
+        return pubkeys
+
+    def add_pubkeys_to_cache(self, for_change, start, pubkeys):
+        """Caches pubkeys derived elsewhere, e.g. in worker processes."""
+        self._check_derivation_cache()
+        for n, pubkey in enumerate(pubkeys, start):
+            self._pubkey_cache[(int(for_change), n)] = pubkey
+
+    def _derive_pubkey(self, for_change, n):
+        branch = self.get_branch_node(for_change)
+        pubkey, chaincode = bip32.CKD_pub(branch.eckey.get_public_key_bytes(compressed=True),
+                                          branch.chaincode, n)
+        return bh2u(pubkey)
+
+    def dump_pubkey_cache(self) -> Dict[str, list]:
+        """Returns the cached pubkeys in a compact JSON-serialisable form:
+        one list per branch, indexed by address index, with None for gaps.
+        """
+        self._check_derivation_cache()
+        d = {}
+        for (for_change, n), pubkey in self._pubkey_cache.items():
+            l = d.setdefault(str(for_change), [])
+            if len(l) <= n:
+                l.extend([None] * (n + 1 - len(l)))
+            l[n] = pubkey
+        return d
+
+    def load_pubkey_cache(self, d: Optional[Dict[str, list]]) -> None:
+        """Fills the cache from the output of dump_pubkey_cache.
+        A few entries are re-derived; if any of them is wrong,
+        the persisted data is discarded.
+        """
+        self._check_derivation_cache()
+        if not d:
+            return
+        items = [((int(for_change), n), pubkey)
+                 for for_change, l in d.items()
+                 for n, pubkey in enumerate(l) if pubkey]
+        sample = random.sample(items, min(len(items), PUBKEY_CACHE_CHECK_SAMPLES))
+        for (for_change, n), pubkey in sample:
+            if self._derive_pubkey(for_change, n) != pubkey:
+                self.logger.warning('persisted pubkey cache does not match xpub; discarding it')
+                return
+        for key, pubkey in items:
+            self._pubkey_cache[key] = pubkey
 
     @classmethod
     def get_pubkey_from_xpub(self, xpub, sequence):
-        node = BIP32Node.from_xkey(xpub).subkey_at_public_derivation(sequence)
-        return node.eckey.get_public_key_hex(compressed=True)
+        key = (xpub, tuple(sequence))
+        pubkey = _xpub_derivation_cache.get(key)
+        if pubkey is None:
+            node = BIP32Node.from_xkey(xpub).subkey_at_public_derivation(sequence)
+            pubkey = node.eckey.get_public_key_hex(compressed=True)
+            _xpub_derivation_cache[key] = pubkey
+        return pubkey
 
     def get_xpubkey(self, c, i):
         def encode_path_int(path_int) -> str:
@@ -457,6 +552,9 @@ class Old_KeyStore(Deterministic_KeyStore):
     def derive_pubkey(self, for_change, n):
         return self.get_pubkey_from_mpk(self.mpk, for_change, n)
 
+    def derive_pubkeys_range(self, for_change, start, stop) -> List[str]:
+        return [self.derive_pubkey(for_change, n) for n in range(start, stop)]
+
     def get_private_key_from_stretched_exponent(self, for_change, n, secexp):
         secexp = (secexp + self.get_sequence(self.mpk, for_change, n)) % ecc.CURVE_ORDER
         pk = number_to_string(secexp, ecc.CURVE_ORDER)
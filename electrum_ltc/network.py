@@ -32,7 +32,7 @@ import json
 import sys
 import ipaddress
 import asyncio
-from typing import NamedTuple, Optional, Sequence, List, Dict, Tuple
+from typing import NamedTuple, Optional, Sequence, List, Dict, Tuple, Set, TYPE_CHECKING
 import traceback
 
 import dns
@@ -59,6 +59,9 @@ from .simple_config import SimpleConfig
 from .i18n import _
 from .logging import get_logger, Logger
 
+if TYPE_CHECKING:
+    from .verifier import SPV
+
 
 _logger = get_logger(__name__)
 
@@ -292,6 +295,9 @@ class Network(Logger):
         # Dump network messages (all interfaces).  Set at runtime from the console.
         self.debug = False
 
+        # verifiers of the loaded wallets, for status reporting
+        self.spv_verifiers = set()  # type: Set[SPV]
+
         self._set_status('disconnected')
 
     def run_from_another_thread(self, coro):
@@ -447,6 +453,10 @@ class Network(Logger):
             value = self.config.mempool_fees
         elif key == 'servers':
             value = self.get_servers()
+        elif key == 'spv':
+            stats = [spv.get_stats() for spv in list(self.spv_verifiers)]
+            value = {k: sum(x[k] for x in stats)
+                     for k in ('proofs_verified', 'proofs_per_second', 'outstanding')}
         else:
             raise Exception('unexpected trigger key {}'.format(key))
         return value
@@ -802,6 +812,7 @@ class Network(Logger):
         filename = b.path()
         length = HEADER_SIZE * len(constants.net.CHECKPOINTS) * 2016
         if not os.path.exists(filename) or os.path.getsize(filename) < length:
+            b.close_mmap()
             with open(filename, 'wb') as f:
                 if length > 0:
                     f.seek(length-1)
@@ -856,7 +867,25 @@ class Network(Logger):
             raise Exception(f"{repr(tx_hash)} is not a txid")
         if not is_non_negative_integer(tx_height):
             raise Exception(f"{repr(tx_height)} is not a block height")
-        return await self.interface.session.send_request('blockchain.transaction.get_merkle', [tx_hash, tx_height])
+        return await self.interface.session.send_request_coalesced('blockchain.transaction.get_merkle', [tx_hash, tx_height])
+
+    @best_effort_reliable
+    async def get_merkle_for_transactions(self, txs: Sequence[Tuple[str, int]]) -> list:
+        """Requests merkle proofs for (tx_hash, tx_height) pairs in a single batch.
+        Returns the proofs in the same order; proofs the server returned an error
+        for are UntrustedServerReturnedError instances instead.
+        """
+        for tx_hash, tx_height in txs:
+            if not is_hash256_str(tx_hash):
+                raise Exception(f"{repr(tx_hash)} is not a txid")
+            if not is_non_negative_integer(tx_height):
+                raise Exception(f"{repr(tx_height)} is not a block height")
+        requests = [('blockchain.transaction.get_merkle', [tx_hash, tx_height]) for tx_hash, tx_height in txs]
+        timeout = self.get_network_timeout_seconds(NetworkTimeout.Generic)
+        results = await self.interface.session.send_request_batch(requests, timeout=timeout)
+        return [UntrustedServerReturnedError(original_exception=res)
+                if isinstance(res, aiorpcx.jsonrpc.CodeMessageError) else res
+                for res in results]
 
     @best_effort_reliable
     async def broadcast_transaction(self, tx, *, timeout=None) -> None:
@@ -1029,15 +1058,31 @@ class Network(Logger):
     async def get_transaction(self, tx_hash: str, *, timeout=None) -> str:
         if not is_hash256_str(tx_hash):
             raise Exception(f"{repr(tx_hash)} is not a txid")
-        return await self.interface.session.send_request('blockchain.transaction.get', [tx_hash],
-                                                         timeout=timeout)
+        return await self.interface.session.send_request_coalesced('blockchain.transaction.get', [tx_hash],
+                                                                   timeout=timeout)
+
+    @best_effort_reliable
+    async def get_transactions(self, tx_hashes: Sequence[str]) -> list:
+        """Requests raw transactions in a single batch. Returns them in the
+        same order; txs the server returned an error for are
+        UntrustedServerReturnedError instances instead.
+        """
+        for tx_hash in tx_hashes:
+            if not is_hash256_str(tx_hash):
+                raise Exception(f"{repr(tx_hash)} is not a txid")
+        requests = [('blockchain.transaction.get', [tx_hash]) for tx_hash in tx_hashes]
+        timeout = self.get_network_timeout_seconds(NetworkTimeout.Generic)
+        results = await self.interface.session.send_request_batch(requests, timeout=timeout)
+        return [UntrustedServerReturnedError(original_exception=res)
+                if isinstance(res, aiorpcx.jsonrpc.CodeMessageError) else res
+                for res in results]
 
     @best_effort_reliable
     @catch_server_exceptions
     async def get_history_for_scripthash(self, sh: str) -> List[dict]:
         if not is_hash256_str(sh):
             raise Exception(f"{repr(sh)} is not a scripthash")
-        return await self.interface.session.send_request('blockchain.scripthash.get_history', [sh])
+        return await self.interface.session.send_request_coalesced('blockchain.scripthash.get_history', [sh])
 
     @best_effort_reliable
     @catch_server_exceptions
@@ -1170,6 +1215,7 @@ class Network(Logger):
         try:
             fut.result(timeout=2)
         except (asyncio.TimeoutError, asyncio.CancelledError): pass
+        blockchain.shutdown_pow_pool()
 
     async def _ensure_there_is_a_main_interface(self):
         if self.is_connected():
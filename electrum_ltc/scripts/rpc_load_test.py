@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+#
+# Load test for the JSON-RPC interface of a running daemon.
+# Reports requests per second and latency percentiles, e.g.:
+#   rpc_load_test.py -n 5000 -c 50 ping
+#   rpc_load_test.py -n 1000 -c 20 -b 10 listunspent  (after 'daemon load_wallet')
+
+import argparse
+import ast
+import asyncio
+import json
+import time
+
+import aiohttp
+
+from electrum_ltc.daemon import get_lockfile
+from electrum_ltc.simple_config import SimpleConfig
+from electrum_ltc.util import print_msg
+
+
+parser = argparse.ArgumentParser(description='Load test the JSON-RPC interface of a running daemon.')
+parser.add_argument('method', nargs='?', default='ping', help='RPC method to call (default: ping)')
+parser.add_argument('params', nargs='?', default='[]', help='JSON list or object of parameters')
+parser.add_argument('-n', '--requests', type=int, default=1000, help='total number of requests')
+parser.add_argument('-c', '--concurrency', type=int, default=10, help='number of concurrent clients')
+parser.add_argument('-b', '--batch', type=int, default=1, help='calls per JSON-RPC batch request')
+parser.add_argument('-D', '--dir', dest='electrum_path', help='electrum directory')
+parser.add_argument('--testnet', action='store_true', help='use testnet')
+args = parser.parse_args()
+
+config_options = {'testnet': args.testnet}
+if args.electrum_path:
+    config_options['electrum_path'] = args.electrum_path
+config = SimpleConfig(config_options)
+with open(get_lockfile(config)) as f:
+    (host, port), create_time = ast.literal_eval(f.read())
+rpc_user, rpc_password = config.get('rpcuser'), config.get('rpcpassword')
+auth = aiohttp.BasicAuth(rpc_user, rpc_password) if rpc_password else None
+url = 'http://%s:%d/' % (host, port)
+params = json.loads(args.params)
+
+
+async def client(session, num_requests, latencies, errors):
+    for i in range(num_requests):
+        calls = [{'jsonrpc': '2.0', 'id': i, 'method': args.method, 'params': params}
+                 for i in range(args.batch)]
+        payload = calls if args.batch > 1 else calls[0]
+        t0 = time.monotonic()
+        try:
+            async with session.post(url, json=payload, auth=auth) as response:
+                response.raise_for_status()
+                result = await response.json()
+        except Exception as e:
+            errors.append(repr(e))
+            continue
+        latencies.append(time.monotonic() - t0)
+        for r in (result if isinstance(result, list) else [result]):
+            if 'error' in r:
+                errors.append(r['error'])
+
+
+async def main():
+    latencies, errors = [], []
+    # connections are kept alive, one per client
+    connector = aiohttp.TCPConnector(limit=args.concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        t0 = time.monotonic()
+        per_client = [args.requests // args.concurrency + (i < args.requests % args.concurrency)
+                      for i in range(args.concurrency)]
+        await asyncio.gather(*[client(session, n, latencies, errors) for n in per_client])
+        elapsed = time.monotonic() - t0
+    latencies.sort()
+
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p / 100))] * 1000 if latencies else 0
+
+    print_msg(f'{args.method}: {args.requests} requests of {args.batch} calls, '
+              f'{args.concurrency} concurrent clients, {elapsed:.2f} s')
+    print_msg(f'requests/s: {len(latencies) / elapsed:.1f}, calls/s: {len(latencies) * args.batch / elapsed:.1f}')
+    print_msg(f'latency (ms): p50 {percentile(50):.1f}, p90 {percentile(90):.1f}, '
+              f'p99 {percentile(99):.1f}, max {percentile(100):.1f}')
+    if errors:
+        print_msg(f'{len(errors)} errors, first: {errors[0]}')
+
+
+asyncio.get_event_loop().run_until_complete(main())
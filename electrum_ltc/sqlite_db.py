@@ -0,0 +1,472 @@
+#!/usr/bin/env python
+#
+# Electrum - lightweight Bitcoin client
+# Copyright (C) 2015 Thomas Voegtlin
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import os
+import json
+import copy
+import sqlite3
+import threading
+from typing import Dict, Optional, List, Tuple
+
+from .util import WalletFileException, TxMinedInfo, LRUCache
+from .transaction import Transaction
+from .logging import Logger
+from .json_db import JsonDB, JsonDBJsonEncoder, FINAL_SEED_VERSION, TX_CACHE_SIZE
+
+
+SQLITE_MAGIC = b'SQLite format 3\x00'
+
+# keys of JsonDB.data that are stored in their own tables;
+# everything else is kept in memory and persisted in the 'kv' table
+TABLE_KEYS = ('txi', 'txo', 'transactions', 'spent_outpoints', 'addr_history',
+              'verified_tx3', 'tx_fees', 'addresses')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS transactions (txid TEXT PRIMARY KEY, raw TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS txi (tx_hash TEXT, addr TEXT, ser TEXT, value INTEGER,
+                                PRIMARY KEY (tx_hash, addr, ser));
+CREATE INDEX IF NOT EXISTS txi_ser ON txi (ser);
+CREATE TABLE IF NOT EXISTS txo (tx_hash TEXT, addr TEXT, n INTEGER, value INTEGER, is_coinbase INTEGER,
+                                PRIMARY KEY (tx_hash, addr, n));
+CREATE INDEX IF NOT EXISTS txo_addr ON txo (addr);
+CREATE TABLE IF NOT EXISTS spent_outpoints (prevout_hash TEXT, prevout_n TEXT, tx_hash TEXT,
+                                            PRIMARY KEY (prevout_hash, prevout_n));
+CREATE TABLE IF NOT EXISTS addr_history (addr TEXT PRIMARY KEY, history TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS verified_tx (txid TEXT PRIMARY KEY, height INTEGER, timestamp INTEGER,
+                                        txpos INTEGER, header_hash TEXT);
+CREATE TABLE IF NOT EXISTS tx_fees (txid TEXT PRIMARY KEY, fee INTEGER);
+CREATE TABLE IF NOT EXISTS addresses (is_change INTEGER, idx INTEGER, addr TEXT UNIQUE,
+                                      PRIMARY KEY (is_change, idx));
+CREATE TABLE IF NOT EXISTS imported_addresses (addr TEXT PRIMARY KEY, data TEXT NOT NULL);
+'''
+
+
+def is_sqlite_file(path: str) -> bool:
+    with open(path, 'rb') as f:
+        return f.read(len(SQLITE_MAGIC)) == SQLITE_MAGIC
+
+
+class SqliteDB(JsonDB):
+    """JsonDB backed by an SQLite file, for wallets with large histories.
+
+    Wallet history (txi, txo, transactions, ...) and addresses live in indexed
+    tables and are only read when needed. The remaining, small, items of
+    JsonDB.data are kept in memory and persisted as JSON rows in the 'kv' table.
+    Changes are written in an SQLite transaction committed by commit(), which
+    WalletStorage.write() calls instead of dumping the db.
+    SQLite wallets do not support storage encryption.
+    """
+
+    locked = JsonDB.locked
+    modifier = JsonDB.modifier
+
+    def __init__(self, path: str, *, manual_upgrades=False):
+        Logger.__init__(self)
+        self.lock = threading.RLock()
+        self.path = path
+        self._modified = False
+        self.manual_upgrades = manual_upgrades
+        self.load_timings = {}  # type: Dict[str, float]
+        self._load_phase_stack = []  # type: List[float]
+        self._tx_cache = LRUCache(maxsize=TX_CACHE_SIZE)  # type: Dict[str, Transaction]
+        self._journal_ops = None
+        self._modifier_depth = 0
+        with self.load_phase('sqlite_open'):
+            self.conn = sqlite3.connect(path, check_same_thread=False)
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.executescript(SCHEMA)
+            self.data = {key: json.loads(value)
+                         for key, value in self.conn.execute('SELECT key, value FROM kv')}
+        if self.get('seed_version') is None:
+            self.put('seed_version', FINAL_SEED_VERSION)
+        if self.requires_upgrade():
+            raise WalletFileException('SQLite wallets must be at the latest wallet format version')
+        self._called_after_upgrade_tasks = True
+        with self.load_phase('sqlite_history'):
+            self._history_addrs = set(addr for addr, in self.conn.execute('SELECT addr FROM addr_history'))
+
+    @classmethod
+    def create_from_json_db(cls, path: str, db: JsonDB) -> 'SqliteDB':
+        """Creates a new SQLite wallet file at path, with the contents of db."""
+        if os.path.exists(path):
+            raise WalletFileException(f'file already exists: {path}')
+        data = json.loads(db.dump())
+        data.pop('journal_id', None)
+        wallet_type = data.get('wallet_type')
+        conn = sqlite3.connect(path)
+        try:
+            conn.executescript(SCHEMA)
+            conn.executemany('INSERT INTO kv VALUES (?, ?)',
+                             ((k, json.dumps(v, cls=JsonDBJsonEncoder)) for k, v in data.items()
+                              if k not in TABLE_KEYS))
+            conn.executemany('INSERT INTO transactions VALUES (?, ?)',
+                             data.get('transactions', {}).items())
+            conn.executemany('INSERT OR IGNORE INTO txi VALUES (?, ?, ?, ?)',
+                             ((tx_hash, addr, ser, v)
+                              for tx_hash, d in data.get('txi', {}).items()
+                              for addr, lst in d.items()
+                              for ser, v in lst))
+            conn.executemany('INSERT OR IGNORE INTO txo VALUES (?, ?, ?, ?, ?)',
+                             ((tx_hash, addr, n, v, is_cb)
+                              for tx_hash, d in data.get('txo', {}).items()
+                              for addr, lst in d.items()
+                              for n, v, is_cb in lst))
+            conn.executemany('INSERT INTO spent_outpoints VALUES (?, ?, ?)',
+                             ((prevout_hash, prevout_n, tx_hash)
+                              for prevout_hash, d in data.get('spent_outpoints', {}).items()
+                              for prevout_n, tx_hash in d.items()))
+            conn.executemany('INSERT INTO addr_history VALUES (?, ?)',
+                             ((addr, json.dumps(hist)) for addr, hist in data.get('addr_history', {}).items()))
+            conn.executemany('INSERT INTO verified_tx VALUES (?, ?, ?, ?, ?)',
+                             ((txid, *info) for txid, info in data.get('verified_tx3', {}).items()))
+            conn.executemany('INSERT INTO tx_fees VALUES (?, ?)', data.get('tx_fees', {}).items())
+            addresses = data.get('addresses', {})
+            if wallet_type == 'imported':
+                conn.executemany('INSERT INTO imported_addresses VALUES (?, ?)',
+                                 ((addr, json.dumps(d)) for addr, d in addresses.items()))
+            else:
+                for is_change, name in ((0, 'receiving'), (1, 'change')):
+                    conn.executemany('INSERT INTO addresses VALUES (?, ?, ?)',
+                                     ((is_change, i, addr) for i, addr in enumerate(addresses.get(name, []))))
+            conn.commit()
+        finally:
+            conn.close()
+        return cls(path)
+
+    def close(self):
+        with self.lock:
+            self.conn.commit()
+            self.conn.close()
+
+    def commit(self):
+        with self.lock:
+            self.conn.commit()
+
+    def _kv_put(self, key, value):
+        if value is None:
+            self.conn.execute('DELETE FROM kv WHERE key=?', (key,))
+        else:
+            self.conn.execute('INSERT OR REPLACE INTO kv VALUES (?, ?)',
+                              (key, json.dumps(value, cls=JsonDBJsonEncoder)))
+
+    @modifier
+    def put(self, key, value):
+        if key in TABLE_KEYS:
+            raise WalletFileException(f'{key} cannot be put in an SQLite wallet')
+        changed = super().put(key, value)
+        if changed:
+            self._kv_put(key, value)
+        return changed
+
+    def set_journal_id(self, journal_id):
+        pass
+
+    @locked
+    def dump(self):
+        data = copy.deepcopy(self.data)
+        q = self.conn.execute
+        data['transactions'] = dict(q('SELECT txid, raw FROM transactions'))
+        for name in ('txi', 'txo'):
+            d = {}
+            for row in q(f'SELECT * FROM {name}'):
+                d.setdefault(row[0], {}).setdefault(row[1], []).append(list(row[2:]))
+            data[name] = d
+        for txo_lists in data['txo'].values():
+            for lst in txo_lists.values():
+                for x in lst:
+                    x[2] = bool(x[2])
+        data['spent_outpoints'] = {}
+        for prevout_hash, prevout_n, tx_hash in q('SELECT * FROM spent_outpoints'):
+            data['spent_outpoints'].setdefault(prevout_hash, {})[prevout_n] = tx_hash
+        data['addr_history'] = {addr: json.loads(h) for addr, h in q('SELECT * FROM addr_history')}
+        data['verified_tx3'] = {row[0]: list(row[1:]) for row in q('SELECT * FROM verified_tx')}
+        data['tx_fees'] = dict(q('SELECT * FROM tx_fees'))
+        if self.get('wallet_type') == 'imported':
+            data['addresses'] = {addr: json.loads(d) for addr, d in q('SELECT * FROM imported_addresses')}
+        else:
+            data['addresses'] = {
+                'receiving': [addr for addr, in q('SELECT addr FROM addresses WHERE is_change=0 ORDER BY idx')],
+                'change': [addr for addr, in q('SELECT addr FROM addresses WHERE is_change=1 ORDER BY idx')],
+            }
+        return json.dumps(data, indent=4, sort_keys=True, cls=JsonDBJsonEncoder)
+
+    def upgrade(self):
+        raise WalletFileException('SQLite wallets cannot be upgraded')
+
+    def requires_split(self):
+        return False
+
+    # history
+
+    @locked
+    def get_txi(self, tx_hash):
+        return [addr for addr, in self.conn.execute(
+            'SELECT DISTINCT addr FROM txi WHERE tx_hash=?', (tx_hash,))]
+
+    @locked
+    def get_txo(self, tx_hash):
+        return [addr for addr, in self.conn.execute(
+            'SELECT DISTINCT addr FROM txo WHERE tx_hash=?', (tx_hash,))]
+
+    @locked
+    def get_txi_addr(self, tx_hash, address):
+        return list(self.conn.execute(
+            'SELECT ser, value FROM txi WHERE tx_hash=? AND addr=?', (tx_hash, address)))
+
+    @locked
+    def get_txo_addr(self, tx_hash, address):
+        return [(n, v, bool(is_cb)) for n, v, is_cb in self.conn.execute(
+            'SELECT n, value, is_coinbase FROM txo WHERE tx_hash=? AND addr=?', (tx_hash, address))]
+
+    @modifier
+    def add_txi_addr(self, tx_hash, addr, ser, v):
+        self.conn.execute('INSERT OR IGNORE INTO txi VALUES (?, ?, ?, ?)', (tx_hash, addr, ser, v))
+
+    @modifier
+    def add_txo_addr(self, tx_hash, addr, n, v, is_coinbase):
+        self.conn.execute('INSERT OR IGNORE INTO txo VALUES (?, ?, ?, ?, ?)', (tx_hash, addr, n, v, is_coinbase))
+
+    @locked
+    def list_txi(self):
+        return [tx_hash for tx_hash, in self.conn.execute('SELECT DISTINCT tx_hash FROM txi')]
+
+    @locked
+    def list_txo(self):
+        return [tx_hash for tx_hash, in self.conn.execute('SELECT DISTINCT tx_hash FROM txo')]
+
+    @modifier
+    def remove_txi(self, tx_hash):
+        self.conn.execute('DELETE FROM txi WHERE tx_hash=?', (tx_hash,))
+
+    @modifier
+    def remove_txo(self, tx_hash):
+        self.conn.execute('DELETE FROM txo WHERE tx_hash=?', (tx_hash,))
+
+    @locked
+    def get_addr_utxos(self, address) -> Dict[str, Tuple[int, bool]]:
+        rows = self.conn.execute(
+            "SELECT tx_hash, n, value, is_coinbase FROM txo WHERE addr=? AND NOT EXISTS "
+            "(SELECT 1 FROM txi WHERE txi.ser = txo.tx_hash || ':' || txo.n AND txi.addr = txo.addr)",
+            (address,))
+        return {tx_hash + ':%d' % n: (v, bool(is_cb)) for tx_hash, n, v, is_cb in rows}
+
+    def check_utxo_index(self) -> List[str]:
+        # UTXOs are queried from the txi/txo tables; there is no separate index
+        return []
+
+    @locked
+    def list_spent_outpoints(self):
+        return list(self.conn.execute('SELECT prevout_hash, prevout_n FROM spent_outpoints'))
+
+    @locked
+    def get_spent_outpoints(self, prevout_hash):
+        return [n for n, in self.conn.execute(
+            'SELECT prevout_n FROM spent_outpoints WHERE prevout_hash=?', (prevout_hash,))]
+
+    @locked
+    def get_spent_outpoint(self, prevout_hash, prevout_n):
+        row = self.conn.execute('SELECT tx_hash FROM spent_outpoints WHERE prevout_hash=? AND prevout_n=?',
+                                (prevout_hash, str(prevout_n))).fetchone()
+        return row[0] if row else None
+
+    @modifier
+    def remove_spent_outpoint(self, prevout_hash, prevout_n):
+        self.conn.execute('DELETE FROM spent_outpoints WHERE prevout_hash=? AND prevout_n=?',
+                          (prevout_hash, str(prevout_n)))
+
+    @modifier
+    def set_spent_outpoint(self, prevout_hash, prevout_n, tx_hash):
+        self.conn.execute('INSERT OR REPLACE INTO spent_outpoints VALUES (?, ?, ?)',
+                          (prevout_hash, str(prevout_n), tx_hash))
+
+    @modifier
+    def add_transaction(self, tx_hash: str, tx: Transaction) -> None:
+        assert isinstance(tx, Transaction)
+        self.conn.execute('INSERT OR REPLACE INTO transactions VALUES (?, ?)', (tx_hash, str(tx)))
+        self._tx_cache[tx_hash] = tx
+
+    @modifier
+    def remove_transaction(self, tx_hash) -> Optional[Transaction]:
+        tx = self.get_transaction(tx_hash)
+        self._tx_cache.pop(tx_hash, None)
+        self.conn.execute('DELETE FROM transactions WHERE txid=?', (tx_hash,))
+        return tx
+
+    @locked
+    def get_transaction(self, tx_hash: str) -> Optional[Transaction]:
+        tx = self._tx_cache.get(tx_hash)
+        if tx is None:
+            row = self.conn.execute('SELECT raw FROM transactions WHERE txid=?', (tx_hash,)).fetchone()
+            if row is None:
+                return None
+            tx = Transaction(row[0])
+            self._tx_cache[tx_hash] = tx
+        return tx
+
+    @locked
+    def list_transactions(self):
+        return [txid for txid, in self.conn.execute('SELECT txid FROM transactions')]
+
+    @locked
+    def get_history(self):
+        return list(self._history_addrs)
+
+    def is_addr_in_history(self, addr):
+        # does not mean history is non-empty!
+        return addr in self._history_addrs
+
+    @locked
+    def get_addr_history(self, addr):
+        row = self.conn.execute('SELECT history FROM addr_history WHERE addr=?', (addr,)).fetchone()
+        return json.loads(row[0]) if row else []
+
+    @modifier
+    def set_addr_history(self, addr, hist):
+        self.conn.execute('INSERT OR REPLACE INTO addr_history VALUES (?, ?)', (addr, json.dumps(hist)))
+        self._history_addrs.add(addr)
+
+    @modifier
+    def set_empty_addr_histories(self, addrs):
+        self.conn.executemany('INSERT OR IGNORE INTO addr_history VALUES (?, ?)', ((addr, '[]') for addr in addrs))
+        self._history_addrs.update(addrs)
+
+    @modifier
+    def remove_addr_history(self, addr):
+        self.conn.execute('DELETE FROM addr_history WHERE addr=?', (addr,))
+        self._history_addrs.discard(addr)
+
+    @locked
+    def list_verified_tx(self):
+        return [txid for txid, in self.conn.execute('SELECT txid FROM verified_tx')]
+
+    @locked
+    def get_verified_tx(self, txid):
+        row = self.conn.execute('SELECT height, timestamp, txpos, header_hash FROM verified_tx WHERE txid=?',
+                                (txid,)).fetchone()
+        if row is None:
+            return None
+        height, timestamp, txpos, header_hash = row
+        return TxMinedInfo(height=height,
+                           conf=None,
+                           timestamp=timestamp,
+                           txpos=txpos,
+                           header_hash=header_hash)
+
+    @modifier
+    def add_verified_tx(self, txid, info):
+        self.conn.execute('INSERT OR REPLACE INTO verified_tx VALUES (?, ?, ?, ?, ?)',
+                          (txid, info.height, info.timestamp, info.txpos, info.header_hash))
+
+    @modifier
+    def remove_verified_tx(self, txid):
+        self.conn.execute('DELETE FROM verified_tx WHERE txid=?', (txid,))
+
+    @locked
+    def is_in_verified_tx(self, txid):
+        return self.conn.execute('SELECT 1 FROM verified_tx WHERE txid=?', (txid,)).fetchone() is not None
+
+    @modifier
+    def update_tx_fees(self, d):
+        self.conn.executemany('INSERT OR REPLACE INTO tx_fees VALUES (?, ?)', d.items())
+
+    @locked
+    def get_tx_fee(self, txid):
+        row = self.conn.execute('SELECT fee FROM tx_fees WHERE txid=?', (txid,)).fetchone()
+        return row[0] if row else None
+
+    @modifier
+    def remove_tx_fee(self, txid):
+        self.conn.execute('DELETE FROM tx_fees WHERE txid=?', (txid,))
+
+    def get_data_ref(self, name):
+        if name in TABLE_KEYS:
+            raise WalletFileException(f'{name} is stored in a table')
+        return super().get_data_ref(name)
+
+    # addresses
+
+    @modifier
+    def add_change_address(self, addr):
+        self.conn.execute('INSERT INTO addresses VALUES (1, ?, ?)', (len(self.change_addresses), addr))
+        self._addr_to_addr_index[addr] = (True, len(self.change_addresses))
+        self.change_addresses.append(addr)
+
+    @modifier
+    def add_receiving_address(self, addr):
+        self.conn.execute('INSERT INTO addresses VALUES (0, ?, ?)', (len(self.receiving_addresses), addr))
+        self._addr_to_addr_index[addr] = (False, len(self.receiving_addresses))
+        self.receiving_addresses.append(addr)
+
+    @modifier
+    def add_change_addresses(self, addrs):
+        start = len(self.change_addresses)
+        self.conn.executemany('INSERT INTO addresses VALUES (1, ?, ?)', enumerate(addrs, start))
+        for i, addr in enumerate(addrs, start):
+            self._addr_to_addr_index[addr] = (True, i)
+        self.change_addresses.extend(addrs)
+
+    @modifier
+    def add_receiving_addresses(self, addrs):
+        start = len(self.receiving_addresses)
+        self.conn.executemany('INSERT INTO addresses VALUES (0, ?, ?)', enumerate(addrs, start))
+        for i, addr in enumerate(addrs, start):
+            self._addr_to_addr_index[addr] = (False, i)
+        self.receiving_addresses.extend(addrs)
+
+    @modifier
+    def add_imported_address(self, addr, d):
+        self.conn.execute('INSERT OR REPLACE INTO imported_addresses VALUES (?, ?)', (addr, json.dumps(d)))
+        self.imported_addresses[addr] = d
+
+    @modifier
+    def remove_imported_address(self, addr):
+        self.imported_addresses.pop(addr)
+        self.conn.execute('DELETE FROM imported_addresses WHERE addr=?', (addr,))
+
+    def load_addresses(self, wallet_type):
+        """ called from Abstract_Wallet.__init__ """
+        with self.lock:
+            if wallet_type == 'imported':
+                self.imported_addresses = {
+                    addr: json.loads(d) for addr, d in self.conn.execute('SELECT * FROM imported_addresses')}
+                return
+            self.receiving_addresses = [addr for addr, in self.conn.execute(
+                'SELECT addr FROM addresses WHERE is_change=0 ORDER BY idx')]
+            self.change_addresses = [addr for addr, in self.conn.execute(
+                'SELECT addr FROM addresses WHERE is_change=1 ORDER BY idx')]
+            self._addr_to_addr_index = {}  # key: address, value: (is_change, index)
+            for i, addr in enumerate(self.receiving_addresses):
+                self._addr_to_addr_index[addr] = (False, i)
+            for i, addr in enumerate(self.change_addresses):
+                self._addr_to_addr_index[addr] = (True, i)
+
+    @modifier
+    def clear_history(self):
+        for table in ('txi', 'txo', 'spent_outpoints', 'transactions',
+                      'addr_history', 'verified_tx', 'tx_fees'):
+            self.conn.execute(f'DELETE FROM {table}')
+        self._tx_cache.clear()
+        self._history_addrs.clear()
+
@@ -28,12 +28,17 @@ import stat
 import hashlib
 import base64
 import zlib
+import json
+import shutil
+import struct
+from typing import Optional, List, Tuple
 
 from . import ecc
-from .util import profiler, InvalidPassword, WalletFileException, bfh, standardize_path
+from .util import profiler, InvalidPassword, WalletFileException, bfh, bh2u, standardize_path
 from .plugin import run_hook, plugin_loaders
 
 from .json_db import JsonDB
+from .sqlite_db import SqliteDB, is_sqlite_file
 from .logging import Logger
 
 
@@ -45,26 +50,126 @@ def get_derivation_used_for_hw_device_encryption():
 # storage encryption version
 STO_EV_PLAINTEXT, STO_EV_USER_PW, STO_EV_XPUB_PW = range(0, 3)
 
+# the journal is compacted into the wallet file once it is larger than
+# both this and the wallet file itself
+JOURNAL_MIN_COMPACTION_SIZE = 1_000_000
+
+
+class WalletJournal:
+    """Append-only file of framed records, used by WalletStorage to save
+    JsonDB modifications without rewriting the whole wallet file.
+
+    Each record is a 4-byte length and a 4-byte crc32 (big-endian), followed
+    by the payload. The first record is a JSON header with the id of this
+    journal and of the journal it continues (if any). A torn or corrupted
+    record, e.g. from a crash mid-write, ends the journal.
+    """
+
+    RECORD_HEADER = struct.Struct('>II')
+
+    def __init__(self, path: str):
+        self.path = path
+        self.journal_id = None  # type: Optional[str]
+        self.parent_id = None  # type: Optional[str]
+        self._file = None
+
+    @classmethod
+    def create(cls, path: str, journal_id: str, parent_id: Optional[str]) -> 'WalletJournal':
+        journal = cls(path)
+        header = json.dumps({'id': journal_id, 'parent': parent_id}).encode('utf8')
+        temp_path = "%s.tmp.%s" % (path, os.getpid())
+        with open(temp_path, 'wb') as f:
+            f.write(cls._frame(header))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+        journal.journal_id = journal_id
+        journal.parent_id = parent_id
+        return journal
+
+    @classmethod
+    def _frame(cls, payload: bytes) -> bytes:
+        return cls.RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+    def read(self) -> List[bytes]:
+        """Reads the header and returns the payloads of the valid records after it."""
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        records = []
+        pos = 0
+        while pos + self.RECORD_HEADER.size <= len(data):
+            length, crc = self.RECORD_HEADER.unpack_from(data, pos)
+            payload = data[pos + self.RECORD_HEADER.size:pos + self.RECORD_HEADER.size + length]
+            if len(payload) != length or zlib.crc32(payload) != crc:
+                break
+            records.append(payload)
+            pos += self.RECORD_HEADER.size + length
+        if not records:
+            raise WalletFileException(f'journal has no valid header: {self.path}')
+        header = json.loads(records[0].decode('utf8'))
+        self.journal_id = header['id']
+        self.parent_id = header['parent']
+        self._valid_size = pos
+        return records[1:]
+
+    def open_for_append(self):
+        self.read()
+        self._file = open(self.path, 'r+b')
+        # drop a torn record left by a crash, so that new ones are readable
+        self._file.truncate(self._valid_size)
+        self._file.seek(self._valid_size)
+
+    def append(self, payloads: List[bytes]):
+        self._file.write(b''.join(self._frame(x) for x in payloads))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def size(self) -> int:
+        return self._file.tell()
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+
 
 
 class WalletStorage(Logger):
 
-    def __init__(self, path, *, manual_upgrades=False):
+    def __init__(self, path, *, manual_upgrades=False, use_journal=None):
         Logger.__init__(self)
         self.lock = threading.RLock()
         self.path = standardize_path(path)
         self._file_exists = self.path and os.path.exists(self.path)
+        # incremental storage: modifications are appended to a journal, see WalletJournal.
+        # by default, a wallet keeps using a journal if it already has one
+        self.journal_path = self.path + '.journal'
+        self._next_journal_path = self.path + '.journal.next'
+        if use_journal is None:
+            use_journal = os.path.exists(self.journal_path)
+        self.use_journal = use_journal
+        self._journal = None  # type: Optional[WalletJournal]
+        self._journal_lock = threading.Lock()
+        self._compaction_thread = None  # type: Optional[threading.Thread]
+        self._needs_full_write = True
 
         DB_Class = JsonDB
         self.logger.info(f"wallet path {self.path}")
         self.pubkey = None
         # TODO we should test r/w permissions here (whether file exists or not)
-        if self.file_exists():
+        if self.file_exists() and is_sqlite_file(self.path):
+            self.raw = None
+            self._encryption_version = STO_EV_PLAINTEXT
+            self.use_journal = False
+            self.db = SqliteDB(self.path, manual_upgrades=manual_upgrades)
+            self.load_plugins()
+        elif self.file_exists():
             with open(self.path, "r", encoding='utf-8') as f:
                 self.raw = f.read()
             self._encryption_version = self._init_encryption_version()
             if not self.is_encrypted():
                 self.db = DB_Class(self.raw, manual_upgrades=manual_upgrades)
+                self._load_journal()
                 self.load_plugins()
         else:
             self._encryption_version = STO_EV_PLAINTEXT
@@ -95,7 +200,58 @@ class WalletStorage(Logger):
         if not self.db.modified():
             return
         self.db.commit()
-        s = self.encrypt_before_writing(self.db.dump())
+        if self.is_sqlite():
+            # SqliteDB writes in place; commit() made the changes durable
+            self.db.set_modified(False)
+            return
+        if self.use_journal and self._journal and not self._needs_full_write:
+            with self.db.lock:
+                ops = self.db.pop_journal_ops()
+                if ops is not None:
+                    self.db.set_modified(False)
+            if ops is not None:
+                try:
+                    self._append_to_journal(ops)
+                except BaseException:
+                    self._needs_full_write = True
+                    self.db.set_modified(True)
+                    raise
+                return
+        self._write_full()
+
+    def _write_full(self):
+        self.wait_for_compaction()
+        journal_id = bh2u(os.urandom(16)) if self.use_journal else None
+        # other threads modify the db without holding self.lock: whatever
+        # they change after the dump must be recorded for the new journal
+        with self.db.lock:
+            self.db.set_journal_id(journal_id)
+            s = self.db.dump()
+            if self.use_journal:
+                self.db.enable_journal()
+            else:
+                self.db.disable_journal()
+            self.db.set_modified(False)
+        try:
+            self._write_file(self.encrypt_before_writing(s))
+        except BaseException:
+            self._needs_full_write = True
+            self.db.set_modified(True)
+            raise
+        with self._journal_lock:
+            if self._journal:
+                self._journal.close()
+                self._journal = None
+            if os.path.exists(self._next_journal_path):
+                os.unlink(self._next_journal_path)
+            if self.use_journal:
+                self._journal = WalletJournal.create(self.journal_path, journal_id, None)
+                self._journal.open_for_append()
+            elif os.path.exists(self.journal_path):
+                os.unlink(self.journal_path)
+        self._needs_full_write = False
+
+    def _write_file(self, s: str):
         temp_path = "%s.tmp.%s" % (self.path, os.getpid())
         with open(temp_path, "w", encoding='utf-8') as f:
             f.write(s)
@@ -109,11 +265,160 @@ class WalletStorage(Logger):
         os.chmod(self.path, mode)
         self._file_exists = True
         self.logger.info(f"saved {self.path}")
-        self.db.set_modified(False)
+
+    def _append_to_journal(self, ops: List[str]):
+        if not ops:
+            return
+        journal_size = self._append_ops(ops)
+        if journal_size > max(JOURNAL_MIN_COMPACTION_SIZE, os.path.getsize(self.path)):
+            self._start_compaction()
+
+    def _append_ops(self, ops: List[str]) -> int:
+        """Appends ops to the current journal, returns its size."""
+        payloads = [self._encrypt_journal_record(op) for op in ops]
+        with self._journal_lock:
+            if payloads:
+                self._journal.append(payloads)
+            return self._journal.size()
+
+    def _start_compaction(self):
+        """Folds the journal into the wallet file, in a background thread.
+
+        New modifications go to a second journal that continues the snapshot
+        being written. Until the wallet file is replaced, the old journal still
+        matches it; afterwards the new journal does. Either way, a crash leaves
+        a state that _load_journal can recover.
+        """
+        if self._compaction_thread and self._compaction_thread.is_alive():
+            return
+        old_journal_id = self._journal.journal_id
+        journal_id = bh2u(os.urandom(16))
+        # the ops recorded since _write popped them are in the snapshot,
+        # so they belong to the old journal, not to the one continuing it
+        with self.db.lock:
+            ops = self.db.pop_journal_ops()
+            if ops is None:
+                self._needs_full_write = True
+                return
+            self.db.set_journal_id(journal_id)
+            snapshot = self.db.dump()
+        self._append_ops(ops)
+        with self._journal_lock:
+            self._journal.close()
+            self._journal = WalletJournal.create(self._next_journal_path, journal_id, old_journal_id)
+            self._journal.open_for_append()
+        # set_password waits for us, so the encryption settings cannot change meanwhile
+        def compact():
+            try:
+                self._write_file(self.encrypt_before_writing(snapshot))
+                with self._journal_lock:
+                    self._journal.close()
+                    os.replace(self._next_journal_path, self.journal_path)
+                    self._journal.path = self.journal_path
+                    self._journal.open_for_append()
+            except Exception:
+                self.logger.exception(f"compacting journal of {self.path} failed")
+                self._needs_full_write = True
+                return
+            self.logger.info(f"compacted journal of {self.path}")
+        self._compaction_thread = threading.Thread(target=compact, name='wallet journal compaction')
+        self._compaction_thread.start()
+
+    def wait_for_compaction(self):
+        if self._compaction_thread:
+            self._compaction_thread.join()
+            self._compaction_thread = None
+
+    def _load_journal(self, ec_key=None):
+        """Replays the journal(s) continuing the wallet file, if any.
+
+        A journal is replayed if it is the one the wallet file is tagged with,
+        or continues the journal just replayed. Anything else is left over from
+        an interrupted compaction or full write, and is discarded.
+        """
+        journal_id = self.db.get('journal_id')
+        clean = True
+        for path in (self.journal_path, self._next_journal_path):
+            if not os.path.exists(path):
+                continue
+            journal = WalletJournal(path)
+            records = journal.read()
+            if journal_id is not None and journal_id in (journal.journal_id, journal.parent_id):
+                ops = [self._decrypt_journal_record(x, ec_key) for x in records]
+                with self.db.load_phase('journal'):
+                    self.db.replay_journal(ops)
+                self.logger.info(f"replayed {len(ops)} journal records from {path}")
+                clean = clean and path == self.journal_path and journal.journal_id == journal_id
+                journal_id = journal.journal_id
+            else:
+                clean = False
+        if self.use_journal and clean and os.path.exists(self.journal_path):
+            self._journal = WalletJournal(self.journal_path)
+            self._journal.open_for_append()
+            self._needs_full_write = False
+            self.db.enable_journal()
+        elif os.path.exists(self.journal_path) or os.path.exists(self._next_journal_path):
+            # consolidate at the next write
+            self._needs_full_write = True
+            self.db.set_modified(True)
+
+    def _encrypt_journal_record(self, op: str) -> bytes:
+        s = op.encode('utf8')
+        if self.pubkey:
+            enc_magic = self._get_encryption_magic()
+            s = ecc.ECPubkey(bfh(self.pubkey)).encrypt_message(zlib.compress(s), enc_magic)
+        return s
+
+    def _decrypt_journal_record(self, record: bytes, ec_key) -> str:
+        if ec_key:
+            record = zlib.decompress(ec_key.decrypt_message(record, self._get_encryption_magic()))
+        return record.decode('utf8')
 
     def file_exists(self):
         return self._file_exists
 
+    def is_sqlite(self):
+        return isinstance(getattr(self, 'db', None), SqliteDB)
+
+    def convert_db(self, backend: str) -> Optional[str]:
+        """Rewrites the wallet file using another db backend, 'json' or 'sqlite'.
+        The original file is kept next to it; its path is returned
+        (None if the wallet already uses that backend).
+        This storage must not be used afterwards.
+        """
+        if backend not in ('json', 'sqlite'):
+            raise ValueError(f'unknown wallet db backend: {backend}')
+        if backend == ('sqlite' if self.is_sqlite() else 'json'):
+            return None
+        if not self.file_exists():
+            raise WalletFileException('wallet file does not exist')
+        if self.is_encrypted():
+            raise WalletFileException('SQLite wallets do not support storage encryption. '
+                                      'Remove the storage password first.')
+        if not self.is_ready_to_be_used_by_wallet():
+            raise WalletFileException('wallet needs to be upgraded first')
+        with self.lock:
+            self.write()
+            self.wait_for_compaction()
+            temp_path = "%s.tmp.%s" % (self.path, os.getpid())
+            if backend == 'sqlite':
+                SqliteDB.create_from_json_db(temp_path, self.db).close()
+                backup_path = self.path + '.json_backup'
+            else:
+                with open(temp_path, "w", encoding='utf-8') as f:
+                    f.write(self.db.dump())
+                    f.flush()
+                    os.fsync(f.fileno())
+                self.db.close()
+                backup_path = self.path + '.sqlite_backup'
+            shutil.copy2(self.path, backup_path)
+            os.replace(temp_path, self.path)
+            for path in (self.journal_path, self._next_journal_path):
+                if os.path.exists(path):
+                    os.unlink(path)
+        self.logger.info(f"converted {self.path} to {backend}, original kept at {backup_path}")
+        return backup_path
+
     def is_past_initial_decryption(self):
         """Return if storage is in a usable state for normal operations.
 
@@ -184,6 +489,7 @@ class WalletStorage(Logger):
         self.pubkey = ec_key.get_public_key_hex()
         s = s.decode('utf8')
         self.db = JsonDB(s, manual_upgrades=True)
+        self._load_journal(ec_key)
         self.load_plugins()
 
     def encrypt_before_writing(self, plaintext: str) -> str:
@@ -209,8 +515,11 @@ class WalletStorage(Logger):
 
     def set_password(self, password, enc_version=None):
         """Set a password to be used for encrypting this storage."""
+        self.wait_for_compaction()
         if enc_version is None:
             enc_version = self._encryption_version
+        if password and enc_version != STO_EV_PLAINTEXT and self.is_sqlite():
+            raise WalletFileException('SQLite wallets do not support storage encryption')
         if password and enc_version != STO_EV_PLAINTEXT:
             ec_key = self.get_eckey_from_password(password)
             self.pubkey = ec_key.get_public_key_hex()
@@ -218,7 +527,8 @@ class WalletStorage(Logger):
         else:
             self.pubkey = None
             self._encryption_version = STO_EV_PLAINTEXT
-        # make sure next storage.write() saves changes
+        # make sure next storage.write() saves changes, re-encrypting everything
+        self._needs_full_write = True
         self.db.set_modified(True)
 
     def requires_upgrade(self):
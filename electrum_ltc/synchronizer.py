@@ -28,14 +28,14 @@ from typing import Dict, List, TYPE_CHECKING, Tuple
 from collections import defaultdict
 import logging
 
-from aiorpcx import TaskGroup, run_in_thread, RPCError
+from aiorpcx import run_in_thread, RPCError
 
 from .transaction import Transaction
 from .util import bh2u, make_aiohttp_session, NetworkJobOnDefaultServer
 from .bitcoin import address_to_scripthash, is_address
 from .network import UntrustedServerReturnedError
 from .logging import Logger
-from .interface import GracefulDisconnect
+from .interface import GracefulDisconnect, NetworkTimeout
 
 if TYPE_CHECKING:
     from .network import Network
@@ -60,6 +60,10 @@ class SynchronizerBase(NetworkJobOnDefaultServer):
     """
     def __init__(self, network: 'Network'):
         self.asyncio_loop = network.asyncio_loop
+        # subscriptions are sent in JSON-RPC batches,
+        # with a bounded number of batches in flight
+        self.subscription_batch_size = network.config.get('subscription_batch_size', 100)
+        self.max_subscription_batches_in_flight = network.config.get('subscription_max_batches_in_flight', 4)
         NetworkJobOnDefaultServer.__init__(self, network)
         self._reset_request_counters()
 
@@ -67,6 +71,7 @@ class SynchronizerBase(NetworkJobOnDefaultServer):
         super()._reset()
         self.requested_addrs = set()
         self.scripthash_to_address = {}
+        self._known_scripthashes = {}  # addr -> scripthash, precomputed
         self._processed_some_notifications = False  # so that we don't miss them
         self._reset_request_counters()
         # Queues
@@ -90,10 +95,28 @@ class SynchronizerBase(NetworkJobOnDefaultServer):
     def add(self, addr):
         asyncio.run_coroutine_threadsafe(self._add_address(addr), self.asyncio_loop)
 
+    def add_addresses(self, addrs, *, scripthashes=None):
+        asyncio.run_coroutine_threadsafe(self._add_addresses(list(addrs), scripthashes), self.asyncio_loop)
+
+    async def _add_addresses(self, addrs, scripthashes=None):
+        if scripthashes is None:
+            for addr in addrs:
+                await self._add_address(addr)
+            return
+        # addresses derived by the wallet itself, with their scripthashes
+        for addr, h in zip(addrs, scripthashes):
+            if addr in self.requested_addrs:
+                continue
+            self.requested_addrs.add(addr)
+            self._known_scripthashes[addr] = h
+            self._requests_sent += 1
+            await self.add_queue.put(addr)
+
     async def _add_address(self, addr: str):
         if not is_address(addr): raise ValueError(f"invalid bitcoin address {addr}")
         if addr in self.requested_addrs: return
         self.requested_addrs.add(addr)
+        self._requests_sent += 1
         await self.add_queue.put(addr)
 
     async def _on_address_status(self, addr, status):
@@ -101,22 +124,38 @@ class SynchronizerBase(NetworkJobOnDefaultServer):
         raise NotImplementedError()  # implemented by subclasses
 
     async def send_subscriptions(self):
-        async def subscribe_to_address(addr):
-            h = address_to_scripthash(addr)
-            self.scripthash_to_address[h] = addr
-            self._requests_sent += 1
+        """Takes the queued addresses in batches, as many as are waiting,
+        and subscribes to each batch in a single request. Waiting for a
+        free slot before taking a batch lets the next one fill up meanwhile.
+        After a reconnection, main() queues the addresses again.
+        """
+        slots = asyncio.Semaphore(self.max_subscription_batches_in_flight)
+        while True:
+            await slots.acquire()
+            batch = [await self.add_queue.get()]
+            while len(batch) < self.subscription_batch_size and not self.add_queue.empty():
+                batch.append(self.add_queue.get_nowait())
+            await self.group.spawn(self._subscribe_to_addresses(batch, slots))
+
+    async def _subscribe_to_addresses(self, addrs: List[str], slots: asyncio.Semaphore):
+        timeout = self.network.get_network_timeout_seconds(NetworkTimeout.Generic)
+        try:
+            hashes = []
+            for addr in addrs:
+                h = self._known_scripthashes.pop(addr, None) or address_to_scripthash(addr)
+                self.scripthash_to_address[h] = addr
+                hashes.append(h)
             try:
-                await self.session.subscribe('blockchain.scripthash.subscribe', [h], self.status_queue)
+                await self.session.subscribe_batch('blockchain.scripthash.subscribe', [[h] for h in hashes],
+                                                   self.status_queue, timeout=timeout)
             except RPCError as e:
                 if e.message == 'history too large':  # no unique error code
                     raise GracefulDisconnect(e, log_level=logging.ERROR) from e
                 raise
-            self._requests_answered += 1
-            self.requested_addrs.remove(addr)
-
-        while True:
-            addr = await self.add_queue.get()
-            await self.group.spawn(subscribe_to_address, addr)
+            self._requests_answered += len(addrs)
+            self.requested_addrs.difference_update(addrs)
+        finally:
+            slots.release()
 
     async def handle_status(self):
         while True:
@@ -140,6 +179,11 @@ class Synchronizer(SynchronizerBase):
     we don't have the full history of, and requests binary transaction
     data of any transactions the wallet doesn't have.
     '''
+    # missing transactions are fetched in batches of up to tx_batch_size,
+    # with at most max_tx_batches_in_flight batches outstanding
+    tx_batch_size = 100
+    max_tx_batches_in_flight = 4
+
     def __init__(self, wallet: 'AddressSynchronizer'):
         self.wallet = wallet
         SynchronizerBase.__init__(self, wallet.network)
@@ -148,6 +192,7 @@ class Synchronizer(SynchronizerBase):
         super()._reset()
         self.requested_tx = {}
         self.requested_histories = set()
+        self.tx_queue = asyncio.Queue()  # (tx_hash, allow_server_not_finding_tx)
 
     def diagnostic_name(self):
         return self.wallet.diagnostic_name()
@@ -192,53 +237,80 @@ class Synchronizer(SynchronizerBase):
 
     async def _request_missing_txs(self, hist, *, allow_server_not_finding_tx=False):
         # "hist" is a list of [tx_hash, tx_height] lists
-        transaction_hashes = []
+        # the txs are queued for _fetch_transactions
         for tx_hash, tx_height in hist:
             if tx_hash in self.requested_tx:
                 continue
             if self.wallet.db.get_transaction(tx_hash):
                 continue
-            transaction_hashes.append(tx_hash)
             self.requested_tx[tx_hash] = tx_height
+            await self.tx_queue.put((tx_hash, allow_server_not_finding_tx))
+
+    async def _fetch_transactions(self):
+        """Takes the queued txs in batches, as many as are waiting, and
+        fetches each batch in a single request. Waiting for a free slot
+        before taking a batch lets the next one fill up meanwhile.
+        """
+        slots = asyncio.Semaphore(self.max_tx_batches_in_flight)
+        while True:
+            await slots.acquire()
+            batch = [await self.tx_queue.get()]
+            while len(batch) < self.tx_batch_size and not self.tx_queue.empty():
+                batch.append(self.tx_queue.get_nowait())
+            await self.group.spawn(self._get_transactions(batch, slots))
 
-        if not transaction_hashes: return
-        async with TaskGroup() as group:
-            for tx_hash in transaction_hashes:
-                await group.spawn(self._get_transaction(tx_hash, allow_server_not_finding_tx=allow_server_not_finding_tx))
-
-    async def _get_transaction(self, tx_hash, *, allow_server_not_finding_tx=False):
-        self._requests_sent += 1
+    async def _get_transactions(self, batch: List[Tuple[str, bool]], slots: asyncio.Semaphore):
         try:
-            result = await self.network.get_transaction(tx_hash)
-        except UntrustedServerReturnedError as e:
-            # most likely, "No such mempool or blockchain transaction"
-            if allow_server_not_finding_tx:
-                self.requested_tx.pop(tx_hash)
+            self._requests_sent += len(batch)
+            try:
+                results = await self.network.get_transactions([tx_hash for tx_hash, _ in batch])
+            finally:
+                self._requests_answered += len(batch)
+            raw_txs = []
+            for (tx_hash, allow_server_not_finding_tx), raw in zip(batch, results):
+                if isinstance(raw, UntrustedServerReturnedError):
+                    # most likely, "No such mempool or blockchain transaction"
+                    if allow_server_not_finding_tx:
+                        self.requested_tx.pop(tx_hash)
+                        continue
+                    raise raw
+                raw_txs.append((tx_hash, raw))
+            if not raw_txs:
                 return
-            else:
-                raise
+            # parsing is CPU-bound; keep it off the event loop
+            txs = await run_in_thread(self._deserialize_transactions, raw_txs)
+            txs = [(tx_hash, tx, self.requested_tx.pop(tx_hash)) for tx_hash, tx in txs]
+            self.wallet.receive_txs_callback(txs)
+            self.logger.info(f"received {len(txs)} txs, bytes: {sum(len(raw) // 2 for _, raw in raw_txs)}")
+            # callbacks; 'new_transaction' is kept for existing listeners, e.g. plugins
+            for _, tx, _ in txs:
+                self.wallet.network.trigger_callback('new_transaction', self.wallet, tx)
+            self.wallet.network.trigger_callback('new_transactions', self.wallet, [tx for _, tx, _ in txs])
         finally:
-            self._requests_answered += 1
-        tx = Transaction(result)
-        try:
-            tx.deserialize()  # see if raises
-        except Exception as e:
-            # possible scenarios:
-            # 1: server is sending garbage
-            # 2: there is a bug in the deserialization code
-            # 3: there was a segwit-like upgrade that changed the tx structure
-            #    that we don't know about
-            raise SynchronizerFailure(f"cannot deserialize transaction {tx_hash}") from e
-        if tx_hash != tx.txid():
-            raise SynchronizerFailure(f"received tx does not match expected txid ({tx_hash} != {tx.txid()})")
-        tx_height = self.requested_tx.pop(tx_hash)
-        self.wallet.receive_tx_callback(tx_hash, tx, tx_height)
-        self.logger.info(f"received tx {tx_hash} height: {tx_height} bytes: {len(tx.raw)}")
-        # callbacks
-        self.wallet.network.trigger_callback('new_transaction', self.wallet, tx)
+            slots.release()
+
+    @staticmethod
+    def _deserialize_transactions(raw_txs: List[Tuple[str, str]]) -> List[Tuple[str, Transaction]]:
+        txs = []
+        for tx_hash, raw in raw_txs:
+            tx = Transaction(raw)
+            try:
+                tx.deserialize()  # see if raises
+            except Exception as e:
+                # possible scenarios:
+                # 1: server is sending garbage
+                # 2: there is a bug in the deserialization code
+                # 3: there was a segwit-like upgrade that changed the tx structure
+                #    that we don't know about
+                raise SynchronizerFailure(f"cannot deserialize transaction {tx_hash}") from e
+            if tx_hash != tx.txid():
+                raise SynchronizerFailure(f"received tx does not match expected txid ({tx_hash} != {tx.txid()})")
+            txs.append((tx_hash, tx))
+        return txs
 
     async def main(self):
         self.wallet.set_up_to_date(False)
+        await self.group.spawn(self._fetch_transactions())
         # request missing txns, if any
         for addr in self.wallet.db.get_history():
             history = self.wallet.db.get_addr_history(addr)
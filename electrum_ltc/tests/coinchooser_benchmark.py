@@ -0,0 +1,67 @@
+"""Synthetic UTXO sets, for coin chooser tests and benchmarks.
+
+Run as a script to compare the coin choosers on large UTXO sets:
+    python -m electrum_ltc.tests.coinchooser_benchmark [num_coins ...]
+"""
+
+import random
+import time
+from typing import List, Sequence
+
+from electrum_ltc import ecc
+from electrum_ltc.bitcoin import TYPE_ADDRESS, pubkey_to_address
+from electrum_ltc.coinchooser import COIN_CHOOSERS
+from electrum_ltc.simple_config import SimpleConfig
+from electrum_ltc.transaction import TxOutput
+from electrum_ltc.util import bh2u
+
+
+def make_coins(num_coins: int, *, seed: int = 0) -> List[dict]:
+    """p2wpkh UTXOs, one per address, with values spread log-uniformly
+    between 10k and 100M satoshis. Deterministic for a seed.
+    """
+    r = random.Random(seed)
+    # consecutive keys: a point addition per coin is much cheaper
+    # than a scalar multiplication
+    G = ecc.generator()
+    point = G * r.randrange(1, ecc.CURVE_ORDER - num_coins)
+    coins = []
+    for i in range(num_coins):
+        point = point + G
+        pubkey = bh2u(point.get_public_key_bytes(compressed=True))
+        coins.append({
+            'prevout_hash': '%064x' % r.getrandbits(256),
+            'prevout_n': 0,
+            'value': int(10 ** r.uniform(4, 8)),
+            'height': r.randint(1, 1000),
+            'address': pubkey_to_address('p2wpkh', pubkey),
+            'type': 'p2wpkh',
+            'x_pubkeys': [pubkey],
+            'num_sig': 1,
+            'signatures': [None],
+        })
+    return coins
+
+
+def _benchmark(sizes: Sequence[int]):
+    """Runs each coin chooser over synthetic UTXO sets, paying a few
+    amounts from each, and reports time, number of inputs and change."""
+    fee_estimator_vb = lambda size: SimpleConfig.estimate_fee_for_feerate(10000, size)
+    dust_threshold = 546 * 3
+    for num_coins in sizes:
+        coins = make_coins(num_coins)
+        change_addr = coins[0]['address']
+        for amount in (123456, 5432100, 98765432):
+            outputs = [TxOutput(TYPE_ADDRESS, coins[1]['address'], amount)]
+            for name, klass in sorted(COIN_CHOOSERS.items()):
+                t0 = time.monotonic()
+                tx = klass().make_tx(coins, [], outputs, [change_addr], fee_estimator_vb, dust_threshold)
+                elapsed = time.monotonic() - t0
+                has_change = len(tx.outputs()) > len(outputs)
+                print(f'{num_coins:>7} coins, amount {amount:>9}, {name:>14}: {elapsed:7.3f} s, '
+                      f'{len(tx.inputs()):>3} inputs, change: {has_change}')
+
+
+if __name__ == '__main__':
+    import sys
+    _benchmark([int(x) for x in sys.argv[1:]] or [10000, 30000, 100000])
@@ -0,0 +1,48 @@
+"""Run as a script to compare verifying signatures one by one with
+verify_message_hashes, for each available ECC implementation:
+    python -m electrum_ltc.tests.ecc_benchmark [num_sigs]
+"""
+
+import os
+import time
+
+from electrum_ltc import ecc_fast
+from electrum_ltc.crypto import sha256d
+from electrum_ltc.ecc import ECPrivkey, ECPubkey, verify_message_hashes
+
+
+def _benchmark(num_sigs: int):
+    """Compares per-signature verify_message_hash with
+    verify_message_hashes, for each available implementation."""
+    items = []
+    for i in range(num_sigs):
+        privkey = ECPrivkey(sha256d(i.to_bytes(4, 'big')))
+        msg_hash = sha256d(b'msg' + i.to_bytes(4, 'big'))
+        items.append((privkey.get_public_key_bytes(), msg_hash, privkey.sign(msg_hash)))
+
+    def per_signature():
+        for pubkey, msg_hash, sig_string in items:
+            ECPubkey(pubkey).verify_message_hash(sig_string, msg_hash)
+
+    implementations = [('python-ecdsa', ecc_fast.undo_monkey_patching_of_python_ecdsa_internals_with_libsecp256k1)]
+    if ecc_fast._libsecp256k1:
+        implementations.append(('libsecp256k1', ecc_fast.do_monkey_patching_of_python_ecdsa_internals_with_libsecp256k1))
+    else:
+        print('libsecp256k1 not available')
+    for name, setup in implementations:
+        setup()
+        runs = [('per signature', per_signature),
+                ('batch', lambda: verify_message_hashes(items, num_threads=1))]
+        if name == 'libsecp256k1':
+            runs.append((f'batch, {os.cpu_count()} threads',
+                         lambda: verify_message_hashes(items, num_threads=os.cpu_count())))
+        for run_name, func in runs:
+            t0 = time.monotonic()
+            func()
+            elapsed = time.monotonic() - t0
+            print(f'{name:>12}, {run_name:>16}: {num_sigs / elapsed:10.1f} signatures/s')
+
+
+if __name__ == '__main__':
+    import sys
+    _benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -0,0 +1,242 @@
+"""A local stand-in for an ElectrumX server, for tests and benchmarks.
+
+It serves scripthash histories, transactions and merkle proofs from
+in-memory dicts, over the same newline-framed JSON-RPC transport
+as a real server, and counts what it receives.
+
+Run as a script to benchmark request coalescing in NotificationSession,
+or scripthash subscriptions in SynchronizerBase:
+    python -m electrum_ltc.tests.fake_electrumx [num_requests]
+    python -m electrum_ltc.tests.fake_electrumx subscribe [num_addresses]
+"""
+
+import asyncio
+import hashlib
+import time
+from typing import Dict, List, Optional
+
+import aiorpcx
+from aiorpcx import RPCSession, serve_rs, handler_invocation
+from aiorpcx.jsonrpc import RPCError, JSONRPC
+
+from electrum_ltc import version
+from electrum_ltc.interface import NotificationSession
+from electrum_ltc.synchronizer import SynchronizerBase
+from electrum_ltc.util import SilentTaskGroup
+
+
+def history_status(history: List[dict]) -> Optional[str]:
+    """The status of a scripthash, as sent in subscription notifications."""
+    if not history:
+        return None
+    status = ''.join(f"{item['tx_hash']}:{item['height']:d}:" for item in history)
+    return hashlib.sha256(status.encode('ascii')).hexdigest()
+
+
+class FakeElectrumXSession(RPCSession):
+
+    def __init__(self, server: 'FakeElectrumX', *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.server = server
+        self.cost_hard_limit = 0  # disable aiorpcx resource limits
+        self.handlers = {
+            'server.version': self.server_version,
+            'server.ping': self.ping,
+            'blockchain.scripthash.get_history': self.get_history,
+            'blockchain.scripthash.subscribe': self.subscribe,
+            'blockchain.transaction.get': self.get_transaction,
+            'blockchain.transaction.get_merkle': self.get_merkle,
+        }
+
+    async def connection_lost(self):
+        await super().connection_lost()
+        self.server.sessions.remove(self)
+
+    async def handle_request(self, request):
+        self.server.num_requests += 1
+        if self.server.latency:
+            await asyncio.sleep(self.server.latency)
+        return await handler_invocation(self.handlers.get(request.method), request)()
+
+    async def server_version(self, client_name, protocol_version):
+        return ['FakeElectrumX', version.PROTOCOL_VERSION]
+
+    async def ping(self):
+        return None
+
+    async def get_history(self, scripthash):
+        return self.server.histories.get(scripthash, [])
+
+    async def subscribe(self, scripthash):
+        return history_status(self.server.histories.get(scripthash, []))
+
+    async def get_transaction(self, tx_hash, verbose=False):
+        try:
+            return self.server.transactions[tx_hash]
+        except KeyError:
+            raise RPCError(JSONRPC.INVALID_ARGS, f'unknown transaction {tx_hash}') from None
+
+    async def get_merkle(self, tx_hash, height):
+        try:
+            return self.server.merkles[tx_hash]
+        except KeyError:
+            raise RPCError(JSONRPC.INVALID_ARGS, f'unknown transaction {tx_hash}') from None
+
+
+class FakeElectrumX:
+    """Serves, over TCP:
+    histories: scripthash -> list of {'tx_hash', 'height'} dicts
+    transactions: txid -> raw tx hex
+    merkles: txid -> {'block_height', 'merkle', 'pos'}
+    latency: seconds added to the handling of every request
+    """
+
+    def __init__(self, *, histories: Dict[str, List[dict]] = None, transactions: Dict[str, str] = None,
+                 merkles: Dict[str, dict] = None, latency: float = 0.0):
+        self.histories = histories if histories is not None else {}
+        self.transactions = transactions if transactions is not None else {}
+        self.merkles = merkles if merkles is not None else {}
+        self.latency = latency
+        self.sessions = []  # type: List[FakeElectrumXSession]
+        self.num_requests = 0
+        self._server = None
+
+    def _make_session(self, *args, **kwargs):
+        session = FakeElectrumXSession(self, *args, **kwargs)
+        self.sessions.append(session)
+        return session
+
+    @property
+    def num_messages(self) -> int:
+        """Messages received by the sessions still connected; a batch counts once."""
+        return sum(session.recv_count for session in self.sessions)
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0) -> int:
+        """Starts listening, returns the port."""
+        self._server = await serve_rs(self._make_session, host, port)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        for session in list(self.sessions):
+            await session.close()
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def notify(self, scripthash: str):
+        """Sends the current status of scripthash to all sessions."""
+        status = history_status(self.histories.get(scripthash, []))
+        for session in self.sessions:
+            await session.send_notification('blockchain.scripthash.subscribe', (scripthash, status))
+
+
+class MockInterface:
+
+    def __init__(self, session: NotificationSession):
+        self.session = session
+        self.group = SilentTaskGroup()
+
+
+class MockNetwork:
+    """Just enough of Network to run a NetworkJobOnDefaultServer
+    on a session; set interface, then call the job's _restart."""
+
+    def __init__(self, loop, config: dict = None):
+        self.asyncio_loop = loop
+        self.config = config if config is not None else {}
+        self.interface = None  # type: Optional[MockInterface]
+
+    def register_callback(self, callback, events):
+        pass
+
+    def unregister_callback(self, callback):
+        pass
+
+    def get_network_timeout_seconds(self, request_type=None) -> int:
+        return 30
+
+
+class SubscriptionRecorder(SynchronizerBase):
+    """Subscribes to addresses, given with their scripthashes,
+    and records the last status of each."""
+
+    def __init__(self, network: MockNetwork, scripthashes: Dict[str, str]):
+        self.scripthashes = scripthashes
+        self.statuses = {}  # type: Dict[str, Optional[str]]
+        SynchronizerBase.__init__(self, network)
+
+    async def main(self):
+        # like the wallet, subscribe again after a reconnection
+        await self._add_addresses(list(self.scripthashes), list(self.scripthashes.values()))
+
+    async def _on_address_status(self, addr, status):
+        self.statuses[addr] = status
+
+    async def wait_for_statuses(self):
+        while self.requested_addrs or len(self.statuses) < len(self.scripthashes):
+            await asyncio.sleep(0.01)
+
+
+def _benchmark(num_requests: int):
+    """Compares individual and coalesced get_history requests."""
+    histories = {'%064x' % i: [{'tx_hash': '%064x' % i, 'height': i}] for i in range(num_requests)}
+
+    async def run():
+        server = FakeElectrumX(histories=histories)
+        port = await server.start()
+        async with aiorpcx.connect_rs('127.0.0.1', port, session_factory=NotificationSession) as session:
+            await bench(server, session)
+        await server.stop()
+
+    async def bench(server, session):
+        for name, send in (('individual', session.send_request),
+                           ('coalesced', session.send_request_coalesced)):
+            num_messages = server.num_messages
+            t0 = time.monotonic()
+            results = await asyncio.gather(*[send('blockchain.scripthash.get_history', [sh])
+                                             for sh in histories])
+            elapsed = time.monotonic() - t0
+            assert results == list(histories.values())
+            print(f'{name:>10}: {num_requests} requests in {elapsed:.3f} s, '
+                  f'{num_requests / elapsed:.0f} req/s, {server.num_messages - num_messages} messages')
+
+    asyncio.get_event_loop().run_until_complete(run())
+
+
+def _benchmark_subscriptions(num_addresses: int):
+    """Compares subscribing one address per request, all at once, as the
+    synchronizer used to, with batched subscriptions."""
+    scripthashes = {'addr%d' % i: '%064x' % i for i in range(num_addresses)}
+    histories = {sh: [{'tx_hash': sh, 'height': 1}] for sh in list(scripthashes.values())[::10]}
+    loop = asyncio.get_event_loop()
+
+    async def run(config):
+        server = FakeElectrumX(histories=histories)
+        port = await server.start()
+        async with aiorpcx.connect_rs('127.0.0.1', port, session_factory=NotificationSession) as session:
+            network = MockNetwork(loop, config)
+            network.interface = MockInterface(session)
+            t0 = time.monotonic()
+            recorder = SubscriptionRecorder(network, scripthashes)
+            await recorder.wait_for_statuses()
+            elapsed = time.monotonic() - t0
+            assert recorder.num_requests_sent_and_answered() == (num_addresses, num_addresses)
+            await recorder.stop()
+            await network.interface.group.cancel_remaining()
+            num_messages = server.num_messages
+        await server.stop()
+        return elapsed, num_messages
+
+    for name, config in (('one by one', {'subscription_batch_size': 1,
+                                         'subscription_max_batches_in_flight': num_addresses}),
+                         ('batched', {})):
+        elapsed, num_messages = loop.run_until_complete(run(config))
+        print(f'{name:>10}: {num_addresses} subscriptions in {elapsed:.3f} s, '
+              f'{num_addresses / elapsed:.0f} addr/s, {num_messages} messages')
+
+
+if __name__ == '__main__':
+    import sys
+    if sys.argv[1:2] == ['subscribe']:
+        _benchmark_subscriptions(int(sys.argv[2]) if len(sys.argv) > 2 else 100000)
+    else:
+        _benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
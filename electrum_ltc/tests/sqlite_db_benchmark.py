@@ -0,0 +1,68 @@
+"""Run as a script to compare the JSON and SQLite wallet backends on a
+synthetic wallet:
+    python -m electrum_ltc.tests.sqlite_db_benchmark [num_txs]
+"""
+
+import os
+import tempfile
+import time
+import tracemalloc
+
+from electrum_ltc.sqlite_db import SqliteDB
+from electrum_ltc.storage import WalletStorage
+from electrum_ltc.transaction import Transaction
+from electrum_ltc.util import TxMinedInfo
+
+
+def _benchmark(num_txs: int):
+    """Compares open time, memory and per-tx write cost of the JSON and
+    SQLite backends, on a synthetic wallet with num_txs transactions.
+    """
+    def fake_txid(i):
+        return '%064x' % i
+
+    def add_tx(db, i):
+        txid = fake_txid(i)
+        addr = 'addr%d' % (i % 1000)
+        db.add_transaction(txid, Transaction('00' * 250))
+        db.add_txo_addr(txid, addr, 0, 100000, False)
+        if i > 0:
+            prev = fake_txid(i - 1)
+            db.set_spent_outpoint(prev, 0, txid)
+            db.add_txi_addr(txid, 'addr%d' % ((i - 1) % 1000), prev + ':0', 100000)
+        db.add_verified_tx(txid, TxMinedInfo(height=i, conf=None, timestamp=i, txpos=0, header_hash='00' * 32))
+        db.set_addr_history(addr, [[txid, i]])
+
+    tmpdir = tempfile.mkdtemp()
+    json_path = os.path.join(tmpdir, 'wallet_json')
+    sqlite_path = os.path.join(tmpdir, 'wallet_sqlite')
+    storage = WalletStorage(json_path)
+    storage.put('wallet_type', 'standard')
+    storage.db.load_addresses('standard')
+    for i in range(num_txs):
+        add_tx(storage.db, i)
+    storage.write()
+    SqliteDB.create_from_json_db(sqlite_path, storage.db).close()
+
+    for name, path in (('json', json_path), ('sqlite', sqlite_path)):
+        tracemalloc.start()
+        t0 = time.monotonic()
+        storage = WalletStorage(path)
+        storage.db.load_addresses('standard')
+        t_open = time.monotonic() - t0
+        memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        n = 20
+        t0 = time.monotonic()
+        for i in range(num_txs, num_txs + n):
+            add_tx(storage.db, i)
+            storage.write()
+        t_write = (time.monotonic() - t0) / n
+        size = os.path.getsize(path)
+        print(f'{name:>6}: open {t_open:.3f}s, peak memory {memory / 1e6:.1f} MB, '
+              f'{t_write * 1000:.2f} ms per tx written, file {size / 1e6:.1f} MB')
+
+
+if __name__ == '__main__':
+    import sys
+    _benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
@@ -12,7 +12,7 @@ from electrum_ltc.bitcoin import (public_key_to_p2pkh, address_from_private_key,
 from electrum_ltc.bip32 import (BIP32Node, convert_bip32_intpath_to_strpath,
                                 xpub_from_xprv, xpub_type, is_xprv, is_bip32_derivation,
                                 is_xpub, convert_bip32_path_to_list_of_uint32,
-                                normalize_bip32_derivation)
+                                normalize_bip32_derivation, CKD_pub, CKD_pub_batch, BIP32_PRIME)
 from electrum_ltc.crypto import sha256d, SUPPORTED_PW_HASH_VERSIONS
 from electrum_ltc import ecc, crypto, constants
 from electrum_ltc.ecc import number_to_string, string_to_number
@@ -215,6 +215,39 @@ class Test_bitcoin(SequentialTestCase):
         sig2 = eckey2.sign_transaction(bfh('642a2e66332f507c92bda910158dfe46fc10afbf72218764899d3af99a043fac'))
         self.assertEqual(bfh('30440220618513f4cfc87dde798ce5febae7634c23e7b9254a1eabf486be820f6a7c2c4702204fef459393a2b931f949e63ced06888f35e286e446dc46feb24b5b5f81c6ed52'), sig2)
 
+    @needs_test_with_all_ecc_implementations
+    def test_sign_transaction_hashes(self):
+        items = [(bfh('7e1255fddb52db1729fc3ceb21a46f95b8d9fe94cc83425e936a6c5223bb679d'),
+                  bfh('5a548b12369a53faaa7e51b5081829474ebdd9c924b3a8230b69aa0be254cd94')),
+                 (bfh('c7ce8c1462c311eec24dff9e2532ac6241e50ae57e7d1833af21942136972f23'),
+                  bfh('642a2e66332f507c92bda910158dfe46fc10afbf72218764899d3af99a043fac'))]
+        expected = [bfh('3045022100902a288b98392254cd23c0e9a49ac6d7920f171b8249a48e484b998f1874a2010220723d844826828f092cf400cb210c4fa0b8cd1b9d1a7f21590e78e022ff6476b9'),
+                    bfh('30440220618513f4cfc87dde798ce5febae7634c23e7b9254a1eabf486be820f6a7c2c4702204fef459393a2b931f949e63ced06888f35e286e446dc46feb24b5b5f81c6ed52')]
+        self.assertEqual(expected, ecc.sign_transaction_hashes(items))
+        self.assertEqual(expected * 5, ecc.sign_transaction_hashes(items * 5, num_threads=3))
+        self.assertEqual([], ecc.sign_transaction_hashes([]))
+        with self.assertRaises(ecc.InvalidECPointException):
+            ecc.sign_transaction_hashes([(bytes(32), items[0][1])])
+
+    @needs_test_with_all_ecc_implementations
+    def test_verify_message_hashes(self):
+        eckey = ecc.ECPrivkey(bfh('7e1255fddb52db1729fc3ceb21a46f95b8d9fe94cc83425e936a6c5223bb679d'))
+        pubkey = eckey.get_public_key_bytes()
+        msg_hash = bfh('5a548b12369a53faaa7e51b5081829474ebdd9c924b3a8230b69aa0be254cd94')
+        sig_string = eckey.sign(msg_hash)
+        r, s = ecc.get_r_and_s_from_sig_string(sig_string)
+        high_s_sig_string = ecc.sig_string_from_r_and_s(r, ecc.CURVE_ORDER - s)
+        items = [(pubkey, msg_hash, sig_string),
+                 (eckey.get_public_key_bytes(compressed=False), msg_hash, sig_string),
+                 (pubkey, msg_hash, high_s_sig_string),
+                 (pubkey, bytes(32), sig_string),
+                 (ecc.generator().get_public_key_bytes(), msg_hash, sig_string),
+                 (b'\x02' + bytes(32), msg_hash, sig_string),
+                 (pubkey, msg_hash, sig_string[:-1])]
+        expected = [True, True, True, False, False, False, False]
+        self.assertEqual(expected, ecc.verify_message_hashes(items))
+        self.assertEqual(expected * 4, ecc.verify_message_hashes(items * 4, num_threads=3))
+
     @needs_test_with_all_aes_implementations
     def test_aes_homomorphic(self):
         """Make sure AES is homomorphic."""
@@ -432,6 +465,27 @@ class Test_xprv_xpub(SequentialTestCase):
         self.assertEqual("xpub6FnCn6nSzZAw5Tw7cgR9bi15UV96gLZhjDstkXXxvCLsUXBGXPdSnLFbdpq8p9HmGsApME5hQTZ3emM2rnY5agb9rXpVGyy3bdW6EEgAtqt", xpub)
         self.assertEqual("xprvA2nrNbFZABcdryreWet9Ea4LvTJcGsqrMzxHx98MMrotbir7yrKCEXw7nadnHM8Dq38EGfSh6dqA9QWTyefMLEcBYJUuekgW4BYPJcr9E7j", xprv)
 
+    def test_subkey_at_public_derivation_with_cache(self):
+        xpub = "xpub661MyMwAqRbcFtXgS5sYJABqqG9YLmC4Q1Rdap9gSE8NqtwybGhePY2gZ29ESFjqJoCu1Rupje8YtGqsefD265TMg7usUDFdp6W1EGMcet8"
+        node = BIP32Node.from_xkey(xpub)
+        cache = {}
+        for path in ([0, 5], [0, 6], [1, 5], [0]):
+            self.assertEqual(node.subkey_at_public_derivation(path).to_xpub(),
+                             node.subkey_at_public_derivation(path, cache=cache).to_xpub())
+        self.assertEqual({(), (0,), (0, 5), (0, 6), (1,), (1, 5)}, set(cache))
+        # cached nodes are reused
+        self.assertEqual(cache[(1, 5)], node.subkey_at_public_derivation([0, 5], cache={(0,): cache[(1,)]}))
+
+    @needs_test_with_all_ecc_implementations
+    def test_CKD_pub_batch(self):
+        node = BIP32Node.from_xkey("xpub661MyMwAqRbcFtXgS5sYJABqqG9YLmC4Q1Rdap9gSE8NqtwybGhePY2gZ29ESFjqJoCu1Rupje8YtGqsefD265TMg7usUDFdp6W1EGMcet8")
+        pubkey = node.eckey.get_public_key_bytes(compressed=True)
+        indices = [0, 1, 7, 1000000, 2**31 - 1]
+        self.assertEqual([CKD_pub(pubkey, node.chaincode, i) for i in indices],
+                         CKD_pub_batch(pubkey, node.chaincode, indices))
+        with self.assertRaises(Exception):
+            CKD_pub_batch(pubkey, node.chaincode, [0, BIP32_PRIME])
+
     @needs_test_with_all_ecc_implementations
     def test_xpub_from_xprv(self):
         """We can derive the xpub key from a xprv."""
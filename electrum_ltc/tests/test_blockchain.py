@@ -1,11 +1,14 @@
 import shutil
 import tempfile
 import os
+import itertools
+from unittest import mock
 
-from electrum_ltc import constants, blockchain
+from electrum_ltc import constants, blockchain, scrypt
 from electrum_ltc.simple_config import SimpleConfig
-from electrum_ltc.blockchain import Blockchain, deserialize_header, hash_header
-from electrum_ltc.util import bh2u, bfh, make_dir
+from electrum_ltc.blockchain import (Blockchain, MissingHeader, deserialize_header, serialize_header,
+                                     hash_header)
+from electrum_ltc.util import bh2u, bfh, make_dir, make_process_pool
 
 from . import SequentialTestCase
 
@@ -339,3 +342,224 @@ class TestBlockchain(SequentialTestCase):
 
         for b in (chain_u, chain_l, chain_z):
             self.assertTrue(all([b.can_connect(b.read_header(i), False) for i in range(b.height())]))
+
+    def test_read_header_from_mmap(self):
+        blockchain.blockchains[constants.net.GENESIS] = chain_u = Blockchain(
+            config=self.config, forkpoint=0, parent=None,
+            forkpoint_hash=constants.net.GENESIS, prev_hash=None)
+        open(chain_u.path(), 'w+').close()
+        self.assertIsNone(chain_u.read_raw_header(0))
+        for name in 'ABCDEF':
+            self._append_header(chain_u, self.HEADERS[name])
+        for name in 'ABCDEF':
+            header = self.HEADERS[name]
+            height = header['block_height']
+            self.assertEqual(bfh(blockchain.serialize_header(header)), bytes(chain_u.read_raw_header(height)))
+            self.assertEqual(header, chain_u.read_header(height))
+            self.assertEqual(hash_header(header), chain_u.get_hash(height))
+        # cached headers are not shared with callers
+        chain_u.read_header(3)['nonce'] = 0
+        self.assertEqual(self.HEADERS['D'], chain_u.read_header(3))
+        # overwrite part of the chain
+        chain_u.write(bfh(blockchain.serialize_header(self.HEADERS['G']))[:-1] + b'\x07', 2 * 80)
+        self.assertEqual(3, chain_u.size())
+        self.assertIsNone(chain_u.read_header(3))
+        self.assertNotEqual(self.HEADERS['C'], chain_u.read_header(2))
+        self.assertNotEqual(hash_header(self.HEADERS['C']), chain_u.get_hash(2))
+        with self.assertRaises(blockchain.MissingHeader):
+            chain_u.get_hash(3)
+
+    def test_header_index(self):
+        def new_best_chain():
+            return Blockchain(config=self.config, forkpoint=0, parent=None,
+                              forkpoint_hash=constants.net.GENESIS, prev_hash=None)
+        blockchain.blockchains[constants.net.GENESIS] = chain_u = new_best_chain()
+        open(chain_u.path(), 'w+').close()
+        for name in 'ABCDEFOPQ':
+            self._append_header(chain_u, self.HEADERS[name])
+        chain_l = chain_u.fork(self.HEADERS['G'])
+        for name in 'HI':
+            self._append_header(chain_l, self.HEADERS[name])
+        self.assertEqual(9, len(chain_u.header_index))
+        self.assertEqual(3, len(chain_l.header_index))
+        self._append_header(chain_l, self.HEADERS['J'])  # swap
+        for name in 'ABCDEFGHIJ':
+            header = self.HEADERS[name]
+            self.assertEqual(hash_header(header), chain_l.get_hash(header['block_height']))
+        for name in 'OPQ':
+            header = self.HEADERS[name]
+            self.assertEqual(hash_header(header), chain_u.get_hash(header['block_height']))
+        self.assertEqual(10, len(chain_l.header_index))
+        self.assertEqual(3, len(chain_u.header_index))
+        self.assertEqual(2, len(os.listdir(os.path.join(self.data_dir, "index"))))
+        # index is persisted
+        chain_reopened = new_best_chain()
+        self.assertEqual(10, len(chain_reopened.header_index))
+        # records not matching the headers file are dropped on load
+        chain_l.close_mmap()
+        with open(chain_l.path(), 'rb+') as f:
+            f.seek(8 * 80)
+            f.truncate()
+            f.write(bfh(blockchain.serialize_header(self.HEADERS['Q'])))
+        chain_reopened = new_best_chain()
+        self.assertEqual(8, len(chain_reopened.header_index))
+        self.assertEqual(hash_header(self.HEADERS['Q']), chain_reopened.get_hash(8))
+        self.assertEqual(9, len(chain_reopened.header_index))
+
+    @staticmethod
+    def _make_mainnet_headers(start_height, num_headers, prev_hash, *, spacing=150, salt=0):
+        """Unmined headers at the maximum target, spacing seconds apart."""
+        headers = []
+        for height in range(start_height, start_height + num_headers):
+            header = {'version': 0x20000000, 'prev_block_hash': prev_hash,
+                      'merkle_root': '%064x' % (salt << 32 | height), 'timestamp': 1317972665 + spacing * height,
+                      'bits': 0x1e0ffff0, 'nonce': 0, 'block_height': height}
+            headers.append(header)
+            prev_hash = hash_header(header)
+        return headers
+
+    def _check_indexed_chainwork(self, chain):
+        start = chain._index_start_height()
+        running_total = chain.get_chainwork(start - 1) if start > 0 else 0
+        for height in range(start, chain.height() + 1):
+            running_total += chain.chainwork_of_header_at_height(height)
+            chainwork = chain._read_header_index(height)[1]
+            self.assertEqual(running_total, chainwork)
+            self.assertEqual(running_total, chain.get_chainwork(height))
+
+    def test_header_index_chainwork(self):
+        # on regtest the index does not store chainwork
+        constants.set_mainnet()
+        self.addCleanup(constants.set_regtest)
+        for patcher in (mock.patch.object(constants.net, 'CHECKPOINTS', []),
+                        mock.patch.object(Blockchain, 'verify_header')):  # headers are not mined
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        blockchain.blockchains[constants.net.GENESIS] = chain_u = Blockchain(
+            config=self.config, forkpoint=0, parent=None,
+            forkpoint_hash=constants.net.GENESIS, prev_hash=None)
+        open(chain_u.path(), 'w+').close()
+        # blocks twice as fast as targeted: the second chunk has more work per header
+        chunk0 = self._make_mainnet_headers(0, 2016, '00' * 32, spacing=75)
+        chain_u.save_chunk(0, bfh(''.join(blockchain.serialize_header(h) for h in chunk0)))
+        for header in self._make_mainnet_headers(2016, 10, hash_header(chunk0[-1]), spacing=75):
+            self._append_header(chain_u, header)
+        self.assertGreater(chain_u.chainwork_of_header_at_height(2016),
+                           chain_u.chainwork_of_header_at_height(2015))
+        self._check_indexed_chainwork(chain_u)
+        # a longer fork of the second chunk takes over
+        fork_headers = self._make_mainnet_headers(2021, 10, chain_u.get_hash(2020), spacing=75, salt=1)
+        chain_l = chain_u.fork(fork_headers[0])
+        for header in fork_headers[1:]:
+            self._append_header(chain_l, header)
+        self.assertIsNone(chain_l.parent)
+        self.assertEqual(chain_l, chain_u.parent)
+        self.assertEqual(2030, chain_l.height())
+        self.assertEqual(2025, chain_u.height())
+        self.assertEqual(hash_header(fork_headers[-1]), chain_l.get_hash(2030))
+        self._check_indexed_chainwork(chain_l)
+        self._check_indexed_chainwork(chain_u)
+        self.assertGreater(chain_l.get_chainwork(), chain_u.get_chainwork())
+
+
+class TestPoWBackends(SequentialTestCase):
+
+    def test_python_backend_is_always_available(self):
+        names = [name for name, pow_hash in scrypt.get_available_backends()]
+        self.assertEqual('python', names[-1])
+
+    def test_backends_agree_with_python_implementation(self):
+        headers = [bfh(header) for header, _ in scrypt.TEST_VECTORS[2:]]
+        for name, pow_hash in scrypt.get_available_backends():
+            if name == 'python':
+                continue
+            self.assertTrue(scrypt.self_test(pow_hash, headers=headers), name)
+
+    def test_self_test_rejects_broken_backend(self):
+        self.assertFalse(scrypt.self_test(lambda header: bytes(32)))
+        self.assertFalse(scrypt.self_test(lambda header: 1/0))
+
+    def test_select_backend(self):
+        name, pow_hash = scrypt.select_backend('python')
+        self.assertEqual('python', name)
+        self.assertEqual(scrypt.scrypt_1024_1_1_80, pow_hash)
+        with self.assertRaises(ValueError):
+            scrypt.select_backend('nonexistent')
+
+    def test_pow_hash_header(self):
+        header = deserialize_header(bfh(scrypt.TEST_VECTORS[2][0]), 0)
+        self.assertEqual(bh2u(bfh(scrypt.TEST_VECTORS[2][1])[::-1]),
+                         blockchain.pow_hash_header(header))
+
+    def test_pow_hash_raw_headers_parallel(self):
+        data = b''.join(bfh(header) for header, _ in scrypt.TEST_VECTORS)
+        expected = [bh2u(bfh(h)[::-1]) for _, h in scrypt.TEST_VECTORS]
+        with make_process_pool(2) as pool:
+            for num_jobs in (1, 2, 3, 10):
+                self.assertEqual(expected, blockchain.pow_hash_raw_headers_parallel(
+                    data, pool, num_jobs=num_jobs))
+
+
+class TestParallelPoW(SequentialTestCase):
+
+    # easy enough to mine a few headers in the test; the bits are not
+    # valid on mainnet, but verify_header only compares them to the target
+    TARGET = (1 << 248) - 1
+    PREV_HASH = '00' * 31 + '01'
+    NUM_HEADERS = 8
+
+    def setUp(self):
+        super().setUp()
+        self.data_dir = tempfile.mkdtemp()
+        config = SimpleConfig({'electrum_path': self.data_dir, 'parallel_pow_verification': True})
+        self.chain = Blockchain(config=config, forkpoint=0, parent=None,
+                                forkpoint_hash=constants.net.GENESIS, prev_hash=None)
+        self.chain.get_target = lambda index: self.TARGET
+        self.chain.get_hash = self._get_hash
+        for patcher in (mock.patch.object(blockchain, 'MIN_HEADERS_FOR_PARALLEL_POW', self.NUM_HEADERS),
+                        mock.patch.object(blockchain.os, 'cpu_count', return_value=2)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(blockchain.shutdown_pow_pool)
+
+    def tearDown(self):
+        super().tearDown()
+        shutil.rmtree(self.data_dir)
+
+    def _get_hash(self, height):
+        if height == 2015:
+            return self.PREV_HASH
+        raise MissingHeader(height)
+
+    def _mine(self, header):
+        for nonce in itertools.count():
+            header['nonce'] = nonce
+            if int(blockchain.pow_hash_header(header), 16) <= self.TARGET:
+                return header
+
+    def _make_chunk(self):
+        headers = []
+        prev_hash = self.PREV_HASH
+        for i in range(self.NUM_HEADERS):
+            header = self._mine({'version': 0x20000000, 'prev_block_hash': prev_hash,
+                                 'merkle_root': '%064x' % i, 'timestamp': 1500000000 + 150 * i,
+                                 'bits': Blockchain.target_to_bits(self.TARGET), 'nonce': 0})
+            headers.append(header)
+            prev_hash = hash_header(header)
+        return headers
+
+    def test_verify_chunk(self):
+        headers = self._make_chunk()
+        data = bfh(''.join(serialize_header(header) for header in headers))
+        self.assertTrue(self.chain.use_parallel_pow(self.NUM_HEADERS))
+        with mock.patch.object(blockchain, 'pow_hash_raw_headers_parallel',
+                               wraps=blockchain.pow_hash_raw_headers_parallel) as parallel:
+            self.chain.verify_chunk(1, data)
+            self.assertEqual(1, parallel.call_count)
+        # the last header, with a nonce that does not meet the target
+        header = dict(headers[-1])
+        header['nonce'] = next(nonce for nonce in itertools.count(header['nonce'] + 1)
+                               if int(blockchain.pow_hash_header(dict(header, nonce=nonce)), 16) > self.TARGET)
+        data = data[:-blockchain.HEADER_SIZE] + bfh(serialize_header(header))
+        with self.assertRaisesRegex(Exception, 'insufficient proof of work'):
+            self.chain.verify_chunk(1, data)
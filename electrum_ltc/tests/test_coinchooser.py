@@ -0,0 +1,99 @@
+from electrum_ltc import coinchooser
+from electrum_ltc.coinchooser import (branch_and_bound, CoinChooserBnB, CoinChooserPrivacy,
+                                      SelectionTotals)
+from electrum_ltc.bitcoin import TYPE_ADDRESS
+from electrum_ltc.simple_config import SimpleConfig
+from electrum_ltc.transaction import TxOutput
+
+from . import SequentialTestCase
+from .coinchooser_benchmark import make_coins
+
+
+class TestBranchAndBound(SequentialTestCase):
+
+    def test_finds_exact_match(self):
+        values = [50, 40, 30, 20, 10, 5]
+        indices = branch_and_bound(values, 65, 65, max_tries=1000)
+        self.assertEqual(65, sum(values[i] for i in indices))
+
+    def test_prefers_smallest_sum_in_range(self):
+        values = [50, 40, 30, 21, 10]
+        indices = branch_and_bound(values, 60, 70, max_tries=1000)
+        self.assertEqual(60, sum(values[i] for i in indices))
+
+    def test_no_solution(self):
+        self.assertIsNone(branch_and_bound([50, 40, 30], 45, 49, max_tries=1000))
+        self.assertIsNone(branch_and_bound([50, 40, 30], 200, 300, max_tries=1000))
+        self.assertIsNone(branch_and_bound([], 1, 2, max_tries=1000))
+
+    def test_respects_max_tries(self):
+        values = [2 ** i for i in reversed(range(20))]
+        self.assertIsNone(branch_and_bound(values, 2 ** 20 - 1, 2 ** 20 - 1, max_tries=10))
+        self.assertEqual(list(range(20)), branch_and_bound(values, 2 ** 20 - 1, 2 ** 20 - 1, max_tries=1000))
+
+
+class TestSelectionTotals(SequentialTestCase):
+
+    def test_add_remove(self):
+        coins = make_coins(3)
+        coins[2]['type'] = 'p2pkh'
+        buckets = CoinChooserPrivacy().bucketize_coins(coins, fee_estimator_vb=lambda size: size)
+        totals = SelectionTotals.from_buckets(buckets[:2])
+        self.assertEqual(sum(b.value for b in buckets[:2]), totals.value)
+        self.assertEqual(100 + sum(b.weight for b in buckets[:2]) + 2, totals.tx_weight(base_weight=100))
+        totals.add(buckets[2])
+        self.assertEqual(sum(b.effective_value for b in buckets), totals.effective_value)
+        # the legacy input needs an empty witness
+        self.assertEqual(100 + sum(b.weight for b in buckets) + 2 + 1, totals.tx_weight(base_weight=100))
+        for bucket in buckets[:2]:
+            totals.remove(bucket)
+        self.assertEqual(100 + buckets[2].weight, totals.tx_weight(base_weight=100))
+        self.assertEqual(buckets[2].value, (SelectionTotals() + totals).value)
+
+
+class TestCoinChooserPrivacy(SequentialTestCase):
+
+    def test_constructs_only_final_tx(self):
+        coins = make_coins(200)
+        outputs = [TxOutput(TYPE_ADDRESS, coins[1]['address'], 5432100)]
+        chooser = CoinChooserPrivacy()
+        tx = chooser.make_tx(coins, [], outputs, [coins[0]['address']],
+                             TestCoinChooserBnB.fee_estimator_vb, TestCoinChooserBnB.dust_threshold)
+        self.assertEqual(2, len(tx.outputs()))
+        # the base tx, and the final one
+        self.assertEqual(2, chooser.num_txs_constructed)
+
+
+class TestCoinChooserBnB(SequentialTestCase):
+
+    fee_estimator_vb = staticmethod(lambda size: SimpleConfig.estimate_fee_for_feerate(10000, size))
+    dust_threshold = 1638
+
+    def _make_tx(self, chooser, coins, amount):
+        outputs = [TxOutput(TYPE_ADDRESS, coins[1]['address'], amount)]
+        tx = chooser.make_tx(coins, [], outputs, [coins[0]['address']],
+                             self.fee_estimator_vb, self.dust_threshold)
+        self.assertGreaterEqual(tx.get_fee(), self.fee_estimator_vb(tx.estimated_size()))
+        return tx
+
+    def test_changeless_solution(self):
+        coins = make_coins(500)
+        tx = self._make_tx(CoinChooserBnB(), coins, 1234567)
+        self.assertEqual(1, len(tx.outputs()))
+        self.assertLess(tx.get_fee() - self.fee_estimator_vb(tx.estimated_size()),
+                        self.dust_threshold + self.fee_estimator_vb(31))
+        # deterministic
+        self.assertEqual(tx.txid(), self._make_tx(CoinChooserBnB(), coins, 1234567).txid())
+
+    def test_falls_back_without_changeless_solution(self):
+        coins = make_coins(3)
+        for coin, value in zip(coins, (10 ** 6, 10 ** 7, 10 ** 8)):
+            coin['value'] = value
+        chooser = CoinChooserBnB()
+        tx = self._make_tx(chooser, coins, 3 * 10 ** 6)
+        self.assertEqual(2, len(tx.outputs()))
+        self.assertEqual(self._make_tx(CoinChooserPrivacy(), coins, 3 * 10 ** 6).txid(), tx.txid())
+
+    def test_get_coin_chooser(self):
+        self.assertIsInstance(coinchooser.get_coin_chooser({'coin_chooser': 'BranchAndBound'}), CoinChooserBnB)
+        self.assertIsInstance(coinchooser.get_coin_chooser({}), CoinChooserPrivacy)
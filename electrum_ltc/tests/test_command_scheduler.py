@@ -0,0 +1,124 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from electrum_ltc.command_scheduler import CommandScheduler, ReadWriteLock
+from electrum_ltc.commands import known_commands
+
+from . import SequentialTestCase
+
+
+class MockStorage:
+    def __init__(self, path):
+        self.path = path
+
+
+class MockWallet:
+    def __init__(self, path):
+        self.storage = MockStorage(path)
+
+    def basename(self):
+        return self.storage.path
+
+
+class TestReadWriteLock(SequentialTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+        super().tearDown()
+
+    def test_readers_share_writers_wait_in_order(self):
+        events = []
+        async def reader(lock, name, delay):
+            await lock.acquire_read()
+            events.append(name + ' start')
+            await asyncio.sleep(delay)
+            events.append(name + ' end')
+            lock.release_read()
+        async def writer(lock, name):
+            await lock.acquire_write()
+            events.append(name + ' start')
+            await asyncio.sleep(0.01)
+            events.append(name + ' end')
+            lock.release_write()
+        async def f():
+            lock = ReadWriteLock()
+            tasks = [asyncio.ensure_future(reader(lock, 'r1', 0.02)),
+                     asyncio.ensure_future(reader(lock, 'r2', 0.01))]
+            await asyncio.sleep(0)
+            # the reader queued behind the writer waits for it
+            tasks += [asyncio.ensure_future(writer(lock, 'w')),
+                      asyncio.ensure_future(reader(lock, 'r3', 0.01))]
+            await asyncio.gather(*tasks)
+        self.loop.run_until_complete(f())
+        self.assertEqual(['r1 start', 'r2 start', 'r2 end', 'r1 end', 'w start', 'w end', 'r3 start', 'r3 end'],
+                         events)
+
+    def test_cancelled_waiter(self):
+        async def f():
+            lock = ReadWriteLock()
+            await lock.acquire_read()
+            waiting_writer = asyncio.ensure_future(lock.acquire_write())
+            await asyncio.sleep(0)
+            waiting_writer.cancel()
+            await asyncio.sleep(0)
+            # readers are not blocked by the cancelled writer
+            await asyncio.wait_for(lock.acquire_read(), 1)
+            lock.release_read()
+            lock.release_read()
+            await asyncio.wait_for(lock.acquire_write(), 1)
+        self.loop.run_until_complete(f())
+
+
+class TestCommandScheduler(SequentialTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.loop = asyncio.new_event_loop()
+        self.executor = ThreadPoolExecutor(max_workers=4)
+        self.scheduler = CommandScheduler(executor=self.executor)
+
+    def tearDown(self):
+        self.executor.shutdown()
+        self.loop.close()
+        super().tearDown()
+
+    def run_commands(self, *calls):
+        """Runs (wallet, command name) pairs concurrently, each sleeping
+        for 0.1s. Returns the time taken."""
+        async def f():
+            await asyncio.gather(*[self.scheduler.run(wallet, known_commands[cmdname], time.sleep, 0.1)
+                                   for wallet, cmdname in calls])
+        t0 = time.monotonic()
+        self.loop.run_until_complete(f())
+        return time.monotonic() - t0
+
+    def test_read_only_commands(self):
+        self.assertTrue(known_commands['getbalance'].is_read_only)
+        self.assertTrue(known_commands['listunspent'].is_read_only)
+        self.assertTrue(known_commands['history'].is_read_only)
+        self.assertFalse(known_commands['payto'].is_read_only)
+        self.assertFalse(known_commands['setlabel'].is_read_only)
+
+    def test_reads_run_concurrently(self):
+        w = MockWallet('w1')
+        self.assertLess(self.run_commands((w, 'getbalance'), (w, 'listunspent'), (w, 'history')), 0.25)
+
+    def test_writes_are_exclusive(self):
+        w = MockWallet('w1')
+        self.assertGreaterEqual(self.run_commands((w, 'setlabel'), (w, 'getbalance'), (w, 'setlabel')), 0.3)
+        stats = self.scheduler.get_stats()['w1']
+        self.assertEqual(3, stats['commands'])
+        self.assertEqual(0, stats['waiting'])
+        self.assertGreaterEqual(stats['max_wait_ms'], 200)
+
+    def test_wallets_run_concurrently(self):
+        wallets = [MockWallet('w%d' % i) for i in range(4)]
+        self.assertLess(self.run_commands(*[(w, 'setlabel') for w in wallets]), 0.25)
+        self.assertEqual(['w0', 'w1', 'w2', 'w3'], sorted(self.scheduler.get_stats()))
+        self.scheduler.forget_wallet(wallets[0])
+        self.assertNotIn('w0', self.scheduler.get_stats())
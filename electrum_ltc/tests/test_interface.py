@@ -0,0 +1,96 @@
+import asyncio
+
+import aiorpcx
+from aiorpcx.jsonrpc import CodeMessageError
+
+from electrum_ltc.interface import NotificationSession, RequestTimedOut
+
+from . import SequentialTestCase
+from .fake_electrumx import FakeElectrumX, history_status
+
+
+class TestNotificationSessionCoalescing(SequentialTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.old_loop = asyncio.get_event_loop()
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.server = FakeElectrumX(
+            histories={'%064x' % i: [{'tx_hash': '%064x' % i, 'height': i}] for i in range(250)},
+            transactions={'%064x' % i: 'raw%d' % i for i in range(10)})
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(self.old_loop)
+        super().tearDown()
+
+    def run_with_session(self, f):
+        async def run():
+            port = await self.server.start()
+            try:
+                async with aiorpcx.connect_rs('127.0.0.1', port, session_factory=NotificationSession) as session:
+                    return await f(session)
+            finally:
+                await self.server.stop()
+        return self.loop.run_until_complete(run())
+
+    def test_requests_are_coalesced(self):
+        async def f(session):
+            results = await asyncio.gather(*[session.send_request_coalesced('blockchain.scripthash.get_history', [sh])
+                                             for sh in self.server.histories])
+            self.assertEqual(list(self.server.histories.values()), results)
+            # batches of max_batch_size, and the rest
+            self.assertEqual(3, self.server.num_messages)
+            self.assertEqual((250, 3), (session.num_coalesced_requests, session.num_coalesced_batches))
+            # a lone request is sent after batch_window, without a batch
+            self.assertEqual('raw1', await session.send_request_coalesced('blockchain.transaction.get', ['%064x' % 1]))
+            self.assertEqual(4, self.server.num_messages)
+        self.run_with_session(f)
+
+    def test_errors_are_demultiplexed(self):
+        async def f(session):
+            results = await asyncio.gather(*[session.send_request_coalesced('blockchain.transaction.get', [txid])
+                                             for txid in ('%064x' % 1, 'ff' * 32, '%064x' % 2)],
+                                           return_exceptions=True)
+            self.assertEqual('raw1', results[0])
+            self.assertIsInstance(results[1], CodeMessageError)
+            self.assertEqual('raw2', results[2])
+        self.run_with_session(f)
+
+    def test_per_request_timeout(self):
+        async def f(session):
+            self.server.latency = 0.3
+            results = await asyncio.gather(
+                session.send_request_coalesced('blockchain.transaction.get', ['%064x' % 1], timeout=0.1),
+                session.send_request_coalesced('blockchain.transaction.get', ['%064x' % 2], timeout=5),
+                return_exceptions=True)
+            self.assertIsInstance(results[0], RequestTimedOut)
+            self.assertEqual('raw2', results[1])
+        self.run_with_session(f)
+
+    def test_batch_timeout_defaults_to_session_timeout(self):
+        async def f(session):
+            self.server.latency = 0.3
+            session.set_default_timeout(0.1)
+            with self.assertRaises(RequestTimedOut):
+                await session.send_request_batch([('blockchain.transaction.get', ['%064x' % i]) for i in range(2)])
+        self.run_with_session(f)
+
+    def test_subscribe_batch(self):
+        async def f(session):
+            queue = asyncio.Queue()
+            params_list = [['%064x' % i] for i in range(3)]
+            self.server.latency = 0.3
+            with self.assertRaises(RequestTimedOut):
+                await session.subscribe_batch('blockchain.scripthash.subscribe', params_list, queue, timeout=0.1)
+            # nothing is left subscribed to after a failure
+            self.assertFalse(session.subscriptions)
+            self.assertTrue(queue.empty())
+            self.server.latency = 0
+            await session.subscribe_batch('blockchain.scripthash.subscribe', params_list, queue, timeout=5)
+            self.assertEqual(3, len(session.subscriptions))
+            statuses = [queue.get_nowait() for _ in range(3)]
+            self.assertEqual([params + [history_status(self.server.histories[params[0]])] for params in params_list],
+                             statuses)
+        self.run_with_session(f)
@@ -0,0 +1,93 @@
+import asyncio
+import base64
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import jsonrpclib
+
+from electrum_ltc.jsonrpc import AuthenticatedJSONRPCServer, METHOD_NOT_FOUND, PARSE_ERROR
+
+from . import SequentialTestCase
+
+
+class TestAuthenticatedJSONRPCServer(SequentialTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.loop = asyncio.new_event_loop()
+        self.loop_thread = threading.Thread(target=self.loop.run_forever)
+        self.loop_thread.start()
+        self.server = AuthenticatedJSONRPCServer(rpc_user='user', rpc_password='pass', max_workers=2)
+        self.server.register_function(lambda: True, 'ping')
+        self.server.register_function(lambda a, b=0: a + b, 'add')
+        self.server.register_function(lambda seconds: time.sleep(seconds), 'sleep')
+        async def echo(x):
+            return x
+        self.server.register_function(echo)
+        host, port = self.run_coro(self.server.start('127.0.0.1', 0))
+        self.url = 'http://%s:%d/' % (host, port)
+
+    def tearDown(self):
+        self.run_coro(self.server.stop())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.loop_thread.join()
+        self.loop.close()
+        super().tearDown()
+
+    def run_coro(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def post(self, data, *, credentials='user:pass'):
+        request = urllib.request.Request(self.url, data=data.encode('utf8'),
+                                         headers={'Content-Type': 'application/json'})
+        if credentials is not None:
+            request.add_header('Authorization', 'Basic ' + base64.b64encode(credentials.encode('utf8')).decode('ascii'))
+        with urllib.request.urlopen(request) as response:
+            body = response.read()
+        return json.loads(body) if body else None
+
+    def test_jsonrpclib_client(self):
+        server = jsonrpclib.Server('http://user:pass@' + self.url[len('http://'):])
+        self.assertTrue(server.ping())
+        self.assertEqual(5, server.add(2, 3))
+        self.assertEqual('x', server.echo('x'))
+
+    def test_authentication(self):
+        for credentials in (None, 'user:wrong', 'wrong:pass'):
+            with self.assertRaises(urllib.error.HTTPError) as ctx:
+                self.post('{"jsonrpc": "2.0", "id": 1, "method": "ping"}', credentials=credentials)
+            self.assertEqual(401, ctx.exception.code)
+        self.server.rpc_password = ''  # authentication disabled
+        self.assertTrue(self.post('{"jsonrpc": "2.0", "id": 1, "method": "ping"}', credentials=None)['result'])
+
+    def test_errors(self):
+        response = self.post('{"jsonrpc": "2.0", "id": 1, "method": "nope"}')
+        self.assertEqual(METHOD_NOT_FOUND, response['error']['code'])
+        self.assertEqual(PARSE_ERROR, self.post('{')['error']['code'])
+        response = self.post('{"jsonrpc": "2.0", "id": 2, "method": "add", "params": ["a", 1]}')
+        self.assertEqual(2, response['id'])
+        self.assertIn('TypeError', response['error']['message'])
+
+    def test_batch(self):
+        response = self.post(json.dumps([
+            {'jsonrpc': '2.0', 'id': 1, 'method': 'add', 'params': [1, 2]},
+            {'jsonrpc': '2.0', 'id': 2, 'method': 'add', 'params': {'a': 1, 'b': 5}},
+            {'jsonrpc': '2.0', 'method': 'ping'},  # notification
+            {'jsonrpc': '2.0', 'id': 3, 'method': 'nope'},
+        ]))
+        self.assertEqual([1, 2, 3], [x['id'] for x in response])
+        self.assertEqual([3, 6], [x['result'] for x in response[:2]])
+        self.assertEqual(METHOD_NOT_FOUND, response[2]['error']['code'])
+        self.assertIsNone(self.post('[{"jsonrpc": "2.0", "method": "ping"}]'))
+
+    def test_slow_request_does_not_block_others(self):
+        slow = threading.Thread(target=self.post, args=('{"jsonrpc": "2.0", "id": 1, "method": "sleep", "params": [1]}',))
+        slow.start()
+        time.sleep(0.1)
+        t0 = time.monotonic()
+        self.assertTrue(self.post('{"jsonrpc": "2.0", "id": 2, "method": "ping"}')['result'])
+        self.assertLess(time.monotonic() - t0, 0.5)
+        slow.join()
@@ -0,0 +1,139 @@
+import os
+import json
+import shutil
+import tempfile
+from unittest import mock
+
+from electrum_ltc import keystore
+from electrum_ltc.storage import WalletStorage
+from electrum_ltc.sqlite_db import SqliteDB
+from electrum_ltc.wallet import Standard_Wallet
+from electrum_ltc.transaction import Transaction
+from electrum_ltc.address_synchronizer import TX_HEIGHT_UNCONFIRMED
+from electrum_ltc.util import TxMinedInfo, standardize_path
+from electrum_ltc.daemon import Daemon
+
+from . import TestCaseForTestnet
+from . import test_wallet_vertical
+
+
+def normalized_dump(db):
+    """db.dump() with sets (which are dumped as lists in arbitrary order) sorted."""
+    data = json.loads(db.dump())
+    for name in ('txi', 'txo'):
+        for d in data.get(name, {}).values():
+            for addr in d:
+                d[addr] = sorted(d[addr])
+    data.pop('journal_id', None)
+    return data
+
+
+class TestSqliteDB(TestCaseForTestnet):
+
+    transactions = test_wallet_vertical.TestWalletHistory_SimpleRandomOrder.transactions
+
+    def setUp(self):
+        super().setUp()
+        self.user_dir = tempfile.mkdtemp()
+        self.wallet_path = os.path.join(self.user_dir, "somewallet")
+
+    def tearDown(self):
+        super().tearDown()
+        shutil.rmtree(self.user_dir)
+
+    def _create_json_wallet(self):
+        ks = keystore.from_old_mpk('e9d4b7866dd1e91c862aebf62a49548c7dbf7bcc6e4b7b8c9da820c7737968df9c09d5a3e271dc814a29981f81b3faaf2737b551ef5dcc6189cf0f8252c442b3')
+        storage = WalletStorage(self.wallet_path)
+        storage.put('keystore', ks.dump())
+        storage.put('gap_limit', 20)
+        w = Standard_Wallet(storage)
+        w.synchronize()
+        w.create_new_address(for_change=True)
+        for txid, raw in sorted(self.transactions.items()):
+            tx = Transaction(raw)
+            w.receive_tx_callback(txid, tx, TX_HEIGHT_UNCONFIRMED)
+        w.db.add_verified_tx(txid, TxMinedInfo(height=1000, conf=None, timestamp=1, txpos=3, header_hash='ab'))
+        w.db.update_tx_fees({txid: 500})
+        w.set_label(txid, 'label')
+        storage.write()
+        return w
+
+    def _load_wallet(self):
+        storage = WalletStorage(self.wallet_path)
+        return Standard_Wallet(storage)
+
+    def test_convertwallet_refused_while_loaded_by_daemon(self):
+        self._create_json_wallet()
+        daemon = Daemon.__new__(Daemon)  # only what run_cmdline needs
+        daemon.network = mock.Mock(config=mock.Mock(fee_estimates={}, mempool_fees={}))
+        daemon.wallets = {standardize_path(self.wallet_path): self._load_wallet()}
+        config_options = {'cmd': 'convertwallet', 'backend': 'sqlite',
+                          'wallet_path': self.wallet_path, 'electrum_path': self.user_dir}
+        self.assertIn('error', daemon._prepare_cmdline(config_options))
+        self.assertFalse(WalletStorage(self.wallet_path).is_sqlite())
+        # once closed
+        daemon.wallets = {}
+        wallet, cmd, func, args, kwargs = daemon._prepare_cmdline(config_options)
+        func(*args, **kwargs)
+        self.assertTrue(WalletStorage(self.wallet_path).is_sqlite())
+
+    def test_convert_roundtrip(self):
+        self._create_json_wallet()
+        w_json = self._load_wallet()
+        backup = WalletStorage(self.wallet_path).convert_db('sqlite')
+        self.assertTrue(os.path.exists(backup))
+        w_sqlite = self._load_wallet()
+        self.assertTrue(w_sqlite.storage.is_sqlite())
+        self.assertEqual(normalized_dump(w_json.db), normalized_dump(w_sqlite.db))
+        self.assertEqual(w_json.get_balance(), w_sqlite.get_balance())
+        self.assertEqual(w_json.get_addresses(), w_sqlite.get_addresses())
+        self.assertEqual(sorted(x['prevout_hash'] + str(x['prevout_n']) for x in w_json.get_utxos()),
+                         sorted(x['prevout_hash'] + str(x['prevout_n']) for x in w_sqlite.get_utxos()))
+        self.assertEqual(w_json.get_history(), w_sqlite.get_history())
+        self.assertEqual(w_json.get_label(sorted(self.transactions)[-1]), w_sqlite.get_label(sorted(self.transactions)[-1]))
+        w_sqlite.storage.db.close()
+
+        self.assertIsNotNone(WalletStorage(self.wallet_path).convert_db('json'))
+        w_json2 = self._load_wallet()
+        self.assertFalse(w_json2.storage.is_sqlite())
+        self.assertEqual(normalized_dump(w_json.db), normalized_dump(w_json2.db))
+
+    def test_modifications_are_persisted(self):
+        self._create_json_wallet()
+        shutil.copy(self.wallet_path, self.wallet_path + '_copy')
+        w_json = Standard_Wallet(WalletStorage(self.wallet_path + '_copy'))
+        WalletStorage(self.wallet_path).convert_db('sqlite')
+        w = self._load_wallet()
+        # apply the same changes to both backends
+        txid = sorted(self.transactions)[0]
+        for wallet in (w_json, w):
+            wallet.remove_transaction(txid)
+            wallet.create_new_address(for_change=False)
+            wallet.create_new_addresses(True, 3)
+            wallet.storage.put('foo', {'bar': 1})
+            wallet.storage.write()
+        self.assertEqual(normalized_dump(w_json.db), normalized_dump(w.db))
+        w.storage.db.close()
+        w2 = self._load_wallet()
+        self.assertEqual(normalized_dump(w_json.db), normalized_dump(w2.db))
+        self.assertEqual(w_json.get_balance(), w2.get_balance())
+        self.assertEqual({'bar': 1}, w2.storage.get('foo'))
+        self.assertIsNone(w2.db.get_transaction(txid))
+        # uncommitted changes are lost, as with an unsaved JSON wallet
+        w2.storage.put('foo', 2)
+        w2.db.conn.rollback()
+        w2.storage.db.close()
+        self.assertEqual({'bar': 1}, WalletStorage(self.wallet_path).get('foo'))
+
+    def test_storage_encryption_is_refused(self):
+        self._create_json_wallet()
+        WalletStorage(self.wallet_path).convert_db('sqlite')
+        storage = WalletStorage(self.wallet_path)
+        with self.assertRaises(Exception):
+            storage.set_password('secret', enc_version=1)
+        self.assertFalse(storage.is_encrypted())
+
+    def test_create_from_json_db_refuses_existing_file(self):
+        w = self._create_json_wallet()
+        with self.assertRaises(Exception):
+            SqliteDB.create_from_json_db(self.wallet_path, w.db)
@@ -0,0 +1,227 @@
+import os
+import sys
+import json
+import time
+import threading
+import subprocess
+from unittest import mock
+
+import electrum_ltc
+from electrum_ltc import storage as storage_module
+from electrum_ltc.storage import WalletStorage, WalletJournal, STO_EV_USER_PW
+from electrum_ltc.json_db import FINAL_SEED_VERSION
+from electrum_ltc.wallet import restore_wallet_from_text, Wallet
+from electrum_ltc.util import TxMinedInfo
+
+from .test_wallet import WalletTestCase
+
+
+# writes forever to a journaled wallet; killed by the test at a random point
+CRASH_WRITER_SCRIPT = '''
+import sys
+from electrum_ltc import storage
+storage.JOURNAL_MIN_COMPACTION_SIZE = 2000
+s = storage.WalletStorage(sys.argv[1], use_journal=True)
+s.write()
+i = s.get('counter', -1) + 1
+while True:
+    s.put('k%d' % i, 'x' * (i % 50))
+    s.put('counter', i)
+    s.write()
+    i += 1
+'''
+
+
+class TestStorageJournal(WalletTestCase):
+
+    def _read_base(self):
+        with open(self.wallet_path, "r", encoding='utf-8') as f:
+            return json.loads(f.read())
+
+    def test_writes_are_appended_to_journal(self):
+        storage = WalletStorage(self.wallet_path, use_journal=True)
+        storage.put('a', 1)
+        storage.write()
+        self.assertTrue(os.path.exists(storage.journal_path))
+        self.assertEqual(1, self._read_base()['a'])
+        storage.put('a', 2)
+        storage.put('b', [1, 2])
+        storage.write()
+        # wallet file untouched, changes are in the journal
+        self.assertEqual(1, self._read_base()['a'])
+        self.assertNotIn('b', self._read_base())
+        self.assertEqual(2, len(WalletJournal(storage.journal_path).read()))
+
+        storage2 = WalletStorage(self.wallet_path)
+        self.assertTrue(storage2.use_journal)
+        self.assertEqual(2, storage2.get('a'))
+        self.assertEqual([1, 2], storage2.get('b'))
+        self.assertEqual(FINAL_SEED_VERSION, storage2.get('seed_version'))
+
+    def test_disabling_journal_consolidates(self):
+        storage = WalletStorage(self.wallet_path, use_journal=True)
+        storage.put('a', 1)
+        storage.write()
+        storage.put('a', 2)
+        storage.write()
+        storage2 = WalletStorage(self.wallet_path, use_journal=False)
+        self.assertEqual(2, storage2.get('a'))
+        storage2.write()
+        self.assertFalse(os.path.exists(storage.journal_path))
+        self.assertEqual(2, self._read_base()['a'])
+        self.assertNotIn('journal_id', self._read_base())
+
+    def test_wallet_modifications_are_replayed(self):
+        restore_wallet_from_text('9dk', path=self.wallet_path, gap_limit=2)
+        storage = WalletStorage(self.wallet_path, use_journal=True)
+        wallet = Wallet(storage)
+        wallet.storage.write()
+        wallet.create_new_address(for_change=False)
+        wallet.set_label('foo', 'bar')
+        txid = 'a' * 64
+        wallet.db.add_verified_tx(txid, TxMinedInfo(height=10, conf=None, timestamp=1, txpos=2, header_hash='bb'))
+        wallet.db.update_tx_fees({txid: 100})
+        wallet.storage.write()
+        storage2 = WalletStorage(self.wallet_path)
+        self.assertEqual(storage.db.dump(), storage2.db.dump())
+        self.assertEqual(storage.db.get_verified_tx(txid), storage2.db.get_verified_tx(txid))
+        wallet2 = Wallet(storage2)
+        self.assertEqual(wallet.get_receiving_addresses(), wallet2.get_receiving_addresses())
+
+    def test_encrypted_journal(self):
+        storage = WalletStorage(self.wallet_path, use_journal=True)
+        storage.set_password('secret', enc_version=STO_EV_USER_PW)
+        storage.write()
+        storage.put('plaintext_key', 'plaintext_value')
+        storage.write()
+        with open(storage.journal_path, 'rb') as f:
+            self.assertNotIn(b'plaintext', f.read())
+        storage2 = WalletStorage(self.wallet_path)
+        self.assertTrue(storage2.is_encrypted())
+        storage2.decrypt('secret')
+        self.assertEqual('plaintext_value', storage2.get('plaintext_key'))
+
+    def test_torn_record_is_ignored(self):
+        storage = WalletStorage(self.wallet_path, use_journal=True)
+        storage.write()
+        storage.put('a', 1)
+        storage.write()
+        with open(storage.journal_path, 'ab') as f:
+            f.write(WalletJournal._frame(b'["put", ["a", 2], {}]')[:-3])
+        storage2 = WalletStorage(self.wallet_path)
+        self.assertEqual(1, storage2.get('a'))
+        # the torn record is dropped before new ones are appended
+        storage2.put('b', 2)
+        storage2.write()
+        storage3 = WalletStorage(self.wallet_path)
+        self.assertEqual(1, storage3.get('a'))
+        self.assertEqual(2, storage3.get('b'))
+
+    @mock.patch.object(storage_module, 'JOURNAL_MIN_COMPACTION_SIZE', 1000)
+    def test_compaction(self):
+        storage = WalletStorage(self.wallet_path, use_journal=True)
+        storage.write()
+        for i in range(100):
+            storage.put('k%d' % i, 'x' * 20)
+            storage.write()
+        storage.wait_for_compaction()
+        self.assertIn('k50', self._read_base())
+        self.assertLess(len(WalletJournal(storage.journal_path).read()), 100)
+        self.assertFalse(os.path.exists(storage._next_journal_path))
+        storage2 = WalletStorage(self.wallet_path)
+        for i in range(100):
+            self.assertEqual('x' * 20, storage2.get('k%d' % i))
+
+    @mock.patch.object(storage_module, 'JOURNAL_MIN_COMPACTION_SIZE', 1000)
+    def test_crash_during_compaction(self):
+        real_replace = os.replace
+        for crash_target in ('wallet', 'journal'):
+            # simulate a crash before replacing the wallet file,
+            # or between replacing the wallet file and the journal
+            if os.path.exists(self.wallet_path):
+                for path in os.listdir(self.user_dir):
+                    os.unlink(os.path.join(self.user_dir, path))
+            storage = WalletStorage(self.wallet_path, use_journal=True)
+            storage.write()
+            target = self.wallet_path if crash_target == 'wallet' else storage.journal_path
+            crashed = []
+            def replace(src, dst):
+                if dst == target and threading.current_thread().name == 'wallet journal compaction':
+                    crashed.append(dst)
+                    raise OSError('simulated crash')
+                return real_replace(src, dst)
+            with mock.patch.object(storage_module.os, 'replace', side_effect=replace):
+                for i in range(60):
+                    storage.put('k%d' % i, 'x' * 20)
+                    storage.write()
+                    storage.wait_for_compaction()
+                    if crashed:
+                        break
+            self.assertTrue(crashed)
+            # the process is gone; load what is on disk
+            self.assertTrue(os.path.exists(storage._next_journal_path))
+            storage2 = WalletStorage(self.wallet_path)
+            for j in range(i + 1):
+                self.assertEqual('x' * 20, storage2.get('k%d' % j))
+            # the next write consolidates
+            storage2.write()
+            self.assertFalse(os.path.exists(storage2._next_journal_path))
+            storage3 = WalletStorage(self.wallet_path)
+            self.assertEqual(storage2.db.dump(), storage3.db.dump())
+
+    @mock.patch.object(storage_module, 'JOURNAL_MIN_COMPACTION_SIZE', 1000)
+    def test_modifications_from_another_thread_during_write(self):
+        restore_wallet_from_text('9dk', path=self.wallet_path, gap_limit=2)
+        storage = WalletStorage(self.wallet_path, use_journal=True)
+        db = Wallet(storage).db
+        num_addresses = len(db.get_receiving_addresses())
+        added = []
+        def modify():
+            # not idempotent: replaying an op twice duplicates the address
+            addr = 'addr%d' % len(added)
+            db.add_receiving_address(addr)
+            added.append(addr)
+        real_fsync = os.fsync
+        def fsync(fd):
+            # modify the db from another thread whenever write() hits the disk
+            real_fsync(fd)
+            if threading.current_thread() is threading.main_thread():
+                thread = threading.Thread(target=modify)
+                thread.start()
+                thread.join()
+        with mock.patch.object(storage_module.os, 'fsync', side_effect=fsync):
+            # full writes, journal appends and compactions
+            for i in range(100):
+                storage.put('counter', i)
+                storage.write()
+            storage.wait_for_compaction()
+        storage.write()
+        storage.wait_for_compaction()
+        self.assertTrue(added)
+        storage2 = WalletStorage(self.wallet_path)
+        self.assertEqual(db.get_receiving_addresses(), storage2.db.get_receiving_addresses())
+        self.assertEqual(added, storage2.db.get_receiving_addresses()[num_addresses:])
+        self.assertEqual(storage.db.dump(), storage2.db.dump())
+
+    def test_kill_process_mid_write(self):
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.path.dirname(os.path.dirname(os.path.abspath(electrum_ltc.__file__)))
+        for delay in (0.3, 0.6, 0.9):
+            proc = subprocess.Popen([sys.executable, '-c', CRASH_WRITER_SCRIPT, self.wallet_path],
+                                    env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            try:
+                deadline = time.monotonic() + 30
+                while not os.path.exists(self.wallet_path + '.journal'):
+                    self.assertLess(time.monotonic(), deadline)
+                    time.sleep(0.05)
+                time.sleep(delay)
+            finally:
+                proc.kill()
+                proc.wait()
+            storage = WalletStorage(self.wallet_path)
+            counter = storage.get('counter')
+            self.assertIsNotNone(counter)
+            for i in range(counter + 1):
+                self.assertEqual('x' * (i % 50), storage.get('k%d' % i))
+            # a write may have been cut between its two records
+            self.assertIsNone(storage.get('k%d' % (counter + 2)))
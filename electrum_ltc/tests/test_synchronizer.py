@@ -0,0 +1,191 @@
+import asyncio
+
+import aiorpcx
+
+from electrum_ltc.interface import NotificationSession
+from electrum_ltc.network import UntrustedServerReturnedError
+from electrum_ltc.synchronizer import Synchronizer, SynchronizerFailure
+from electrum_ltc.transaction import Transaction
+
+from . import SequentialTestCase
+from .fake_electrumx import FakeElectrumX, MockInterface, SubscriptionRecorder, history_status
+from .fake_electrumx import MockNetwork as MockSessionNetwork
+from .test_transaction import signed_blob, v2_blob, signed_segwit_blob
+
+
+class MockNetwork:
+
+    def __init__(self, loop, raw_txs):
+        self.asyncio_loop = loop
+        self.config = {}
+        self.interface = None
+        self.raw_txs = raw_txs
+        self.batches = []
+        self.callbacks = []
+
+    def register_callback(self, callback, events):
+        pass
+
+    def trigger_callback(self, event, *args):
+        self.callbacks.append((event, args))
+
+    async def get_transactions(self, tx_hashes):
+        self.batches.append(list(tx_hashes))
+        await asyncio.sleep(0.01)
+        return [self.raw_txs.get(tx_hash, UntrustedServerReturnedError(original_exception=Exception()))
+                for tx_hash in tx_hashes]
+
+
+class MockDB:
+    def get_transaction(self, tx_hash):
+        return None
+
+
+class MockWallet:
+
+    def __init__(self, network):
+        self.network = network
+        self.db = MockDB()
+        self.received = []  # one list per call
+
+    def diagnostic_name(self):
+        return 'mock'
+
+    def receive_txs_callback(self, txs):
+        self.received.append(txs)
+
+
+class TestSynchronizerTxPipeline(SequentialTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.old_loop = asyncio.get_event_loop()
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        raw_txs = [signed_blob, v2_blob, signed_segwit_blob]
+        self.raw_txs = {Transaction(raw).txid(): raw for raw in raw_txs}
+        self.network = MockNetwork(self.loop, self.raw_txs)
+        self.wallet = MockWallet(self.network)
+        self.synchronizer = Synchronizer(self.wallet)
+        self.synchronizer.tx_batch_size = 2
+
+    def tearDown(self):
+        self.loop.run_until_complete(self.synchronizer.group.cancel_remaining())
+        self.loop.close()
+        asyncio.set_event_loop(self.old_loop)
+        super().tearDown()
+
+    def fetch(self, hist, **kwargs):
+        async def f():
+            await self.synchronizer.group.spawn(self.synchronizer._fetch_transactions())
+            await self.synchronizer._request_missing_txs(hist, **kwargs)
+            while self.synchronizer.requested_tx:
+                await asyncio.sleep(0.01)
+        self.loop.run_until_complete(asyncio.wait_for(f(), 5))
+
+    def test_transactions_are_fetched_and_added_in_batches(self):
+        hist = [(tx_hash, 100 + i) for i, tx_hash in enumerate(self.raw_txs)]
+        self.fetch(hist + hist)  # duplicates are requested once
+        self.assertEqual([list(self.raw_txs)[:2], list(self.raw_txs)[2:]], self.network.batches)
+        received = [(tx_hash, tx_height) for txs in self.wallet.received for tx_hash, tx, tx_height in txs]
+        self.assertEqual(hist, received)
+        # one 'new_transactions' callback per batch, and the per-tx one
+        self.assertEqual(['new_transaction', 'new_transaction', 'new_transactions', 'new_transaction', 'new_transactions'],
+                         [event for event, args in self.network.callbacks])
+        self.assertTrue(self.synchronizer.is_up_to_date())
+
+    def test_server_not_finding_tx(self):
+        hist = [('ab' * 32, 100), (list(self.raw_txs)[0], 101)]
+        self.fetch(hist, allow_server_not_finding_tx=True)
+        self.assertEqual([[(list(self.raw_txs)[0], 101)]],
+                         [[(tx_hash, tx_height) for tx_hash, tx, tx_height in txs] for txs in self.wallet.received])
+
+    def test_txid_mismatch(self):
+        tx_hash = list(self.raw_txs)[0]
+        self.raw_txs[tx_hash] = v2_blob
+        with self.assertRaises(SynchronizerFailure):
+            self.loop.run_until_complete(self.synchronizer._get_transactions([(tx_hash, False)], asyncio.Semaphore()))
+
+
+class TestSynchronizerSubscriptions(SequentialTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.old_loop = asyncio.get_event_loop()
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.scripthashes = {'addr%d' % i: '%064x' % i for i in range(25)}
+        self.histories = {'%064x' % i: [{'tx_hash': 'ab' * 32, 'height': i}] for i in range(0, 25, 3)}
+        self.server = FakeElectrumX(histories=self.histories)
+        self.network = MockSessionNetwork(self.loop, {'subscription_batch_size': 10,
+                                                      'subscription_max_batches_in_flight': 2})
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(self.old_loop)
+        super().tearDown()
+
+    def expected_statuses(self):
+        return {addr: history_status(self.histories.get(sh, [])) for addr, sh in self.scripthashes.items()}
+
+    def run_with_recorder(self, f):
+        async def run():
+            port = await self.server.start()
+            try:
+                async with aiorpcx.connect_rs('127.0.0.1', port, session_factory=NotificationSession) as session:
+                    self.network.interface = MockInterface(session)
+                    recorder = SubscriptionRecorder(self.network, self.scripthashes)
+                    try:
+                        await asyncio.wait_for(f(recorder, port), 5)
+                    finally:
+                        await recorder.stop()
+                        await self.network.interface.group.cancel_remaining()
+            finally:
+                await self.server.stop()
+        self.loop.run_until_complete(run())
+
+    def test_subscriptions_are_batched(self):
+        async def f(recorder, port):
+            in_flight = [0, 0]  # current, max
+            session = self.network.interface.session
+            send_request_batch = session.send_request_batch
+            async def counting_send_request_batch(requests, **kwargs):
+                in_flight[0] += 1
+                in_flight[1] = max(in_flight)
+                try:
+                    await asyncio.sleep(0.05)
+                    return await send_request_batch(requests, **kwargs)
+                finally:
+                    in_flight[0] -= 1
+            session.send_request_batch = counting_send_request_batch
+            await recorder.wait_for_statuses()
+            self.assertEqual(self.expected_statuses(), recorder.statuses)
+            self.assertEqual((25, 25), recorder.num_requests_sent_and_answered())
+            # batches of 10, 10 and 5
+            self.assertEqual(3, self.server.num_messages)
+            self.assertEqual(2, in_flight[1])
+            # notifications still reach the recorder
+            sh = self.scripthashes['addr1']
+            self.histories[sh] = [{'tx_hash': 'cd' * 32, 'height': 1}]
+            await self.server.notify(sh)
+            while recorder.statuses['addr1'] != history_status(self.histories[sh]):
+                await asyncio.sleep(0.01)
+        self.run_with_recorder(f)
+
+    def test_resubscribe_after_reconnection(self):
+        async def f(recorder, port):
+            await recorder.wait_for_statuses()
+            recorder.statuses.clear()
+            num_messages = self.server.num_messages
+            async with aiorpcx.connect_rs('127.0.0.1', port, session_factory=NotificationSession) as session:
+                old_interface = self.network.interface
+                self.network.interface = MockInterface(session)
+                await recorder._restart()
+                await recorder.wait_for_statuses()
+                self.assertIs(session, recorder.session)
+                self.assertEqual(self.expected_statuses(), recorder.statuses)
+                self.assertEqual((25, 25), recorder.num_requests_sent_and_answered())
+                # in batches, on the new session
+                self.assertEqual(3, self.server.num_messages - num_messages)
+                await old_interface.group.cancel_remaining()
+        self.run_with_recorder(f)
@@ -1,10 +1,11 @@
-from electrum_ltc import transaction
+from electrum_ltc import transaction, ecc, bitcoin
+from electrum_ltc.crypto import sha256d
 from electrum_ltc.transaction import TxOutputForUI, tx_from_str
 from electrum_ltc.bitcoin import TYPE_ADDRESS
 from electrum_ltc.keystore import xpubkey_to_address
 from electrum_ltc.util import bh2u, bfh
 
-from . import SequentialTestCase, TestCaseForTestnet
+from . import SequentialTestCase, TestCaseForTestnet, transaction_benchmark
 from .test_bitcoin import needs_test_with_all_ecc_implementations
 
 unsigned_blob = '45505446ff0001000000012a5c9a94fcde98f5581cd00162c60a13936ceb75389ea65bf38633b424eb4031000000005701ff4c53ff0488b21e03ef2afea18000000089689bff23e1e7fb2f161daa37270a97a3d8c2e537584b2d304ecb47b86d21fc021b010d3bd425f8cf2e04824bfdf1f1f5ff1d51fadd9a41f9e3fb8dd3403b1bfe00000000ffffffff0140420f00000000001976a914230ac37834073a42146f11ef8414ae929feaafc388ac00000000'
@@ -55,6 +56,40 @@ class TestBCDataStream(SequentialTestCase):
         self.assertEqual(s.read_bytes(4), b'r')
         self.assertEqual(s.read_bytes(1), b'')
 
+class TestBytesReader(SequentialTestCase):
+
+    def test_compact_size(self):
+        values = [0, 1, 252, 253, 2**16-1, 2**16, 2**32-1, 2**32, 2**64-1]
+        data = b''.join(transaction.compact_size(v) for v in values)
+        self.assertEqual(bh2u(data),
+                          '0001fcfdfd00fdfffffe00000100feffffffffff0000000001000000ffffffffffffffffff')
+        with self.assertRaises(transaction.SerializationError):
+            transaction.compact_size(-1)
+        s = transaction.BytesReader(data)
+        for v in values:
+            self.assertEqual(s.read_compact_size(), v)
+        self.assertFalse(s.can_read_more())
+        with self.assertRaises(transaction.SerializationError):
+            s.read_compact_size()
+
+    def test_bytes(self):
+        data = b'xxfoobar'
+        s = transaction.BytesReader(data, offset=2)
+        foo = s.read_bytes(3)
+        self.assertIsInstance(foo, memoryview)
+        self.assertIs(foo.obj, data)
+        self.assertEqual(foo, b'foo')
+        self.assertEqual(s.read_bytes(2), b'ba')
+        with self.assertRaises(transaction.SerializationError):
+            s.read_bytes(2)
+        with self.assertRaises(transaction.SerializationError):
+            s.read_uint32()
+        self.assertEqual(s.read_bytes(1), b'r')
+
+    def test_deserialize_from_bytes(self):
+        for blob in (unsigned_blob, signed_blob, signed_segwit_blob):
+            self.assertEqual(transaction.deserialize(blob), transaction.deserialize(bfh(blob)))
+
 class TestTransaction(SequentialTestCase):
 
     @needs_test_with_all_ecc_implementations
@@ -171,6 +206,84 @@ class TestTransaction(SequentialTestCase):
         tx = transaction.Transaction(v2_blob)
         self.assertEqual(tx.txid(), "b97f9180173ab141b61b9f944d841e60feec691d6daab4d4d932b24dd36606fe")
 
+    def test_txid_is_memoized(self):
+        stats = transaction.Transaction.enable_cache_stats()
+        self.addCleanup(transaction.Transaction.disable_cache_stats)
+        tx = transaction.Transaction(v2_blob)
+        txid = tx.txid()
+        self.assertEqual(txid, tx.txid())
+        self.assertEqual(1, stats['txid_miss'])
+        self.assertEqual(1, stats['txid_hit'])
+        self.assertEqual(v2_blob, tx.serialize_to_network())
+        self.assertEqual(v2_blob, tx.serialize_to_network())
+        self.assertEqual(1, stats['ser_witness_hit'])
+        # mutations invalidate the cache
+        for mutate in (lambda: tx.set_rbf(True),
+                       lambda: setattr(tx, 'locktime', 1),
+                       lambda: tx.add_outputs([transaction.TxOutput(TYPE_ADDRESS, 'LTv6KFwtiNafLvxggFFQMRSQEXtBUru9eG', 1000)])):
+            mutate()
+            new_txid = tx.txid()
+            self.assertNotEqual(txid, new_txid)
+            self.assertEqual(new_txid, transaction.Transaction(tx.serialize()).txid())
+            txid = new_txid
+
+    def test_legacy_sighash_shares_fields_between_inputs(self):
+        stats = transaction.Transaction.enable_cache_stats()
+        self.addCleanup(transaction.Transaction.disable_cache_stats)
+        tx = transaction_benchmark.make_tx(3, 'p2pkh', signed=False)
+        tx.deserialize(force_full_parse=True)
+        preimages = [tx.serialize_preimage(i) for i in range(3)]
+        self.assertEqual(1, stats['legacy_fields_miss'])
+        # only the input being signed has a script
+        self.assertEqual(preimages[0][-8-68:], preimages[1][-8-68:])
+        self.assertNotEqual(preimages[0], preimages[1])
+        pubkey = tx.inputs()[0]['pubkeys'][0]
+        tx.sign({pubkey: (transaction_benchmark.PRIVKEY, True)})
+        self.assertTrue(tx.is_complete())
+        self.assertEqual(1, stats['legacy_fields_miss'])
+        self.assertEqual(preimages, [tx.serialize_preimage(i) for i in range(3)])
+        # signatures verify against a freshly parsed copy
+        tx2 = transaction.Transaction(str(tx))
+        tx2.deserialize(force_full_parse=True)
+        for i, txin in enumerate(tx2.inputs()):
+            sig_string = ecc.sig_string_from_der_sig(bfh(txin['signatures'][0][:-2]))
+            pre_hash = sha256d(tx2.serialize_preimage_bytes(i))
+            ecc.ECPubkey(bfh(pubkey)).verify_message_hash(sig_string, pre_hash)
+        self.assertEqual(2, stats['legacy_fields_miss'])  # one for tx2
+        tx.set_rbf(True)
+        self.assertNotEqual(preimages[0], tx.serialize_preimage(0))
+        self.assertEqual(3, stats['legacy_fields_miss'])
+
+    @needs_test_with_all_ecc_implementations
+    def test_verify_signatures(self):
+        tx = transaction.Transaction(signed_blob)
+        tx.deserialize(force_full_parse=True)
+        self.assertTrue(tx.verify_signatures())
+        tx.locktime = 1
+        self.assertFalse(tx.verify_signatures())
+        # 2 of 3 multisig, signed by the first and last cosigner
+        privkeys = [bytes([i + 1] * 32) for i in range(3)]
+        pubkeys = sorted(ecc.ECPrivkey(k).get_public_key_hex() for k in privkeys)
+        keypairs = {ecc.ECPrivkey(k).get_public_key_hex(): (k, True) for k in privkeys}
+        redeem_script = transaction.multisig_script(pubkeys, 2)
+        address = bitcoin.hash160_to_p2sh(bitcoin.hash_160(bfh(redeem_script)))
+        txin = {'type': 'p2sh', 'address': address, 'prevout_hash': 'ab' * 32, 'prevout_n': 0,
+                'value': 100000, 'x_pubkeys': pubkeys, 'pubkeys': pubkeys,
+                'signatures': [None] * 3, 'num_sig': 2}
+        tx = transaction.Transaction.from_io([txin], [transaction.TxOutput(TYPE_ADDRESS, address, 90000)])
+        tx.sign({pubkeys[0]: keypairs[pubkeys[0]]})
+        partial = transaction.Transaction(str(tx))
+        self.assertTrue(partial.verify_signatures())
+        tx.sign({pubkeys[2]: keypairs[pubkeys[2]]})
+        self.assertTrue(tx.is_complete())
+        complete = transaction.Transaction(str(tx))
+        complete.deserialize(force_full_parse=True)
+        self.assertEqual(2, len(complete.inputs()[0]['signatures']))
+        self.assertTrue(complete.verify_signatures())
+        # a signature in the slot of another cosigner
+        partial.add_signature_to_txin(0, 1, tx.inputs()[0]['signatures'][0])
+        self.assertFalse(partial.verify_signatures())
+
     def test_tx_from_str(self):
         # json dict
         self.assertEqual('020000000001012005273af813ba23b0c205e4b145e525c280dd876e061f35bff7db9b2e0043640100000000fdffffff02d885010000000000160014e73f444b8767c84afb46ef4125d8b81d2542a53d00e1f5050000000017a914052ed032f5c74a636ed5059611bb90012d40316c870247304402200c628917673d75f05db893cc377b0a69127f75e10949b35da52aa1b77a14c350022055187adf9a668fdf45fc09002726ba7160e713ed79dddcd20171308273f1a2f1012103cb3e00561c3439ccbacc033a72e0513bcfabff8826de0bc651d661991ade6171049e1600',
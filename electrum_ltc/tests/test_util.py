@@ -1,7 +1,7 @@
 from decimal import Decimal
 
 from electrum_ltc.util import (format_satoshis, format_fee_satoshis, parse_URI,
-                               is_hash256_str, chunks)
+                               is_hash256_str, chunks, LRUCache)
 
 from . import SequentialTestCase
 
@@ -110,3 +110,15 @@ class TestUtil(SequentialTestCase):
                          list(chunks([1, 2, 3, 4, 5], 2)))
         with self.assertRaises(ValueError):
             list(chunks([1, 2, 3], 0))
+
+    def test_lru_cache(self):
+        cache = LRUCache(maxsize=2)
+        cache['a'] = 1
+        cache['b'] = 2
+        self.assertEqual(1, cache['a'])
+        cache['c'] = 3
+        self.assertEqual({'a': 1, 'c': 3}, dict(cache))
+        self.assertEqual(1, cache.get('a'))
+        cache['d'] = 4
+        self.assertEqual({'a': 1, 'd': 4}, dict(cache))
+        self.assertIsNone(cache.get('c'))
@@ -0,0 +1,153 @@
+import asyncio
+
+from aiorpcx.jsonrpc import RPCError
+
+from electrum_ltc.bitcoin import hash_decode, hash_encode
+from electrum_ltc.crypto import sha256d
+from electrum_ltc.network import UntrustedServerReturnedError
+from electrum_ltc.verifier import SPV
+
+from . import SequentialTestCase
+
+
+def merkle_tree(tx_hashes):
+    """Returns the merkle root of tx_hashes, and the branch of each."""
+    level = [hash_decode(tx_hash) for tx_hash in tx_hashes]
+    branches = [[] for _ in tx_hashes]
+    positions = list(range(len(tx_hashes)))
+    while len(level) > 1:
+        if len(level) % 2:
+            level.append(level[-1])
+        for i, pos in enumerate(positions):
+            branches[i].append(hash_encode(level[pos ^ 1]))
+            positions[i] = pos >> 1
+        level = [sha256d(level[i] + level[i + 1]) for i in range(0, len(level), 2)]
+    return hash_encode(level[0]), branches
+
+
+class MockBlockchain:
+
+    def __init__(self, headers):
+        self.headers = headers
+        self.num_header_reads = 0
+
+    def height(self):
+        return max(self.headers)
+
+    def read_header(self, height):
+        self.num_header_reads += 1
+        return self.headers.get(height)
+
+
+class MockNetwork:
+
+    def __init__(self, loop, chain, merkles):
+        self.asyncio_loop = loop
+        self.config = {'spv_batch_size': 2, 'spv_max_batches_in_flight': 2}
+        self.interface = None
+        self.bhi_lock = asyncio.Lock()
+        self.spv_verifiers = set()
+        self.chain = chain
+        self.merkles = merkles
+        self.batches = []
+        self.num_batches_in_flight = 0
+        self.max_batches_in_flight = 0
+
+    def register_callback(self, callback, events):
+        pass
+
+    def blockchain(self):
+        return self.chain
+
+    async def get_merkle_for_transactions(self, txs):
+        self.batches.append(list(txs))
+        self.num_batches_in_flight += 1
+        self.max_batches_in_flight = max(self.max_batches_in_flight, self.num_batches_in_flight)
+        try:
+            await asyncio.sleep(0.01)
+        finally:
+            self.num_batches_in_flight -= 1
+        return [self.merkles.get(tx_hash) or
+                UntrustedServerReturnedError(original_exception=RPCError(1, 'tx not found'))
+                for tx_hash, tx_height in txs]
+
+
+class MockWallet:
+
+    def __init__(self, unverified):
+        self.unverified = unverified
+        self.verified = {}
+
+    def diagnostic_name(self):
+        return 'mock'
+
+    def get_unverified_txs(self):
+        return dict(self.unverified)
+
+    def add_verified_tx(self, tx_hash, info):
+        self.unverified.pop(tx_hash)
+        self.verified[tx_hash] = info
+
+    def remove_unverified_tx(self, tx_hash, tx_height):
+        self.unverified.pop(tx_hash)
+
+
+class TestSPVBatches(SequentialTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.old_loop = asyncio.get_event_loop()
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        # three txs in block 100, two in block 101
+        self.blocks = {100: ['%064x' % i for i in range(1, 4)],
+                       101: ['%064x' % i for i in range(4, 6)]}
+        headers = {}
+        merkles = {}
+        for height, tx_hashes in self.blocks.items():
+            root, branches = merkle_tree(tx_hashes)
+            headers[height] = {'version': 1, 'prev_block_hash': '00' * 32, 'merkle_root': root,
+                               'timestamp': 1000 + height, 'bits': 0, 'nonce': 0, 'block_height': height}
+            for pos, (tx_hash, branch) in enumerate(zip(tx_hashes, branches)):
+                merkles[tx_hash] = {'block_height': height, 'merkle': branch, 'pos': pos}
+        self.chain = MockBlockchain(headers)
+        self.network = MockNetwork(self.loop, self.chain, merkles)
+        self.unverified = {tx_hash: height for height, tx_hashes in self.blocks.items() for tx_hash in tx_hashes}
+        self.unverified['ff' * 32] = 100  # the server does not know it
+        self.wallet = MockWallet(dict(self.unverified))
+        self.spv = SPV(self.network, self.wallet)
+        self.spv.blockchain = self.chain
+
+    def tearDown(self):
+        self.loop.run_until_complete(self.spv.group.cancel_remaining())
+        self.loop.close()
+        asyncio.set_event_loop(self.old_loop)
+        super().tearDown()
+
+    def test_proofs_are_requested_in_batches(self):
+        async def f():
+            while self.wallet.unverified:
+                await self.spv._request_proofs()
+                await asyncio.sleep(0.005)
+        self.loop.run_until_complete(asyncio.wait_for(f(), 5))
+        self.assertEqual([2, 2, 2], [len(batch) for batch in self.network.batches])
+        self.assertEqual(sorted(self.unverified), sorted(tx_hash for batch in self.network.batches
+                                                         for tx_hash, tx_height in batch))
+        self.assertEqual(2, self.network.max_batches_in_flight)
+        self.assertEqual(sorted(self.unverified)[:-1], sorted(self.wallet.verified))
+        self.assertEqual(101, self.wallet.verified['%064x' % 5].height)
+        self.assertEqual(1, self.wallet.verified['%064x' % 5].txpos)
+        stats = self.spv.get_stats()
+        self.assertEqual(5, stats['proofs_verified'])
+        self.assertEqual(0, stats['outstanding'])
+        self.assertGreater(stats['proofs_per_second'], 0)
+        self.assertTrue(self.spv.is_up_to_date())
+
+    def test_proofs_of_a_block_are_checked_against_one_header(self):
+        batch = [(tx_hash, height) for height, tx_hashes in self.blocks.items() for tx_hash in tx_hashes]
+        self.spv.requested_merkle.update(tx_hash for tx_hash, height in batch)
+        self.loop.run_until_complete(self.spv._request_and_verify_proofs(batch))
+        self.assertEqual(2, self.chain.num_header_reads)
+        self.assertEqual(5, len(self.wallet.verified))
+        self.assertEqual(5, self.spv.get_stats()['proofs_verified'])
+        self.assertFalse(self.spv.requested_merkle)
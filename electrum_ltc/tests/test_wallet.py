@@ -5,18 +5,23 @@ import os
 import json
 from decimal import Decimal
 import time
+from unittest import mock
 
 from io import StringIO
 from electrum_ltc.storage import WalletStorage
 from electrum_ltc.json_db import FINAL_SEED_VERSION
 from electrum_ltc.wallet import (Abstract_Wallet, Standard_Wallet, create_new_wallet,
-                                 restore_wallet_from_text, Imported_Wallet)
+                                 restore_wallet_from_text, Imported_Wallet, InternalAddressCorruption)
+from electrum_ltc.address_deriver import _derive_block
 from electrum_ltc.exchange_rate import ExchangeBase, FxThread
 from electrum_ltc.util import TxMinedInfo
+from electrum_ltc.address_synchronizer import TX_HEIGHT_UNCONFIRMED
+from electrum_ltc.transaction import Transaction
 from electrum_ltc.bitcoin import COIN
 from electrum_ltc.json_db import JsonDB
 
 from . import SequentialTestCase
+from .test_transaction import signed_segwit_blob
 
 
 class FakeSynchronizer(object):
@@ -224,3 +229,97 @@ class TestCreateRestoreWallet(WalletTestCase):
         # also test addr deletion
         wallet.delete_address('ltc1qnp78h78vp92pwdwq5xvh8eprlga5q8gu7xl7hg')
         self.assertEqual(1, len(wallet.get_receiving_addresses()))
+
+    def test_history_after_deleting_address(self):
+        # a tx paying two imported addresses stays when one of them is deleted
+        tx = Transaction(signed_segwit_blob)
+        addr1, addr2 = [o.address for o in tx.outputs()]
+        wallet = restore_wallet_from_text(addr1 + ' ' + addr2, path=self.wallet_path, network=None)['wallet']
+        wallet.receive_tx_callback(tx.txid(), tx, TX_HEIGHT_UNCONFIRMED)
+        self.assertEqual([(tx.txid(), 109936100, 109936100)], [(h[0], h[2], h[3]) for h in wallet.get_history()])
+        wallet.delete_address(addr1)
+        hist = wallet.get_history()
+        self.assertEqual([(tx.txid(), 79936100, 79936100)], [(h[0], h[2], h[3]) for h in hist])
+        self.assertEqual(sum(wallet.get_balance()), hist[-1][3])
+
+
+class TestBulkAddressGeneration(WalletTestCase):
+
+    def test_create_new_addresses(self):
+        xpub = 'zpub6nydoME6CFdJtMpzHW5BNoPz6i6XbeT9qfz72wsRqGdgGEYeivso6xjfw8cGcCyHwF7BNW4LDuHF35XrZsovBLWMF4qXSjmhTXYiHbWqGLt'
+        wallet = restore_wallet_from_text(xpub, path=self.wallet_path, network=None, gap_limit=5)['wallet']
+        self.assertEqual(5, len(wallet.get_receiving_addresses()))
+        self.assertEqual('ltc1q2ccr34wzep58d4239tl3x3734ttle92arvely7', wallet.get_receiving_addresses()[0])
+        addresses = wallet.create_new_addresses(False, 10)
+        self.assertEqual(wallet.get_receiving_addresses()[5:], addresses)
+        self.assertEqual([wallet.pubkeys_to_address(wallet.keystore.get_pubkey_from_xpub(xpub, (0, n)))
+                          for n in range(15)],
+                         wallet.get_receiving_addresses())
+        self.assertEqual((False, 14), wallet.get_address_index(addresses[-1]))
+        self.assertEqual([], wallet.db.get_addr_history(addresses[-1]))
+
+    def test_synchronize_restores_gap_after_used_address(self):
+        xpub = 'zpub6nydoME6CFdJtMpzHW5BNoPz6i6XbeT9qfz72wsRqGdgGEYeivso6xjfw8cGcCyHwF7BNW4LDuHF35XrZsovBLWMF4qXSjmhTXYiHbWqGLt'
+        wallet = restore_wallet_from_text(xpub, path=self.wallet_path, network=None, gap_limit=5)['wallet']
+        addr = wallet.get_receiving_addresses()[3]
+        wallet.db.set_addr_history(addr, [('ab' * 32, 1000)])
+        wallet.get_local_height = lambda: 2000
+        wallet.synchronize()
+        self.assertEqual(9, len(wallet.get_receiving_addresses()))
+
+
+class TestParallelRestore(WalletTestCase):
+
+    def test_restore_with_worker_processes(self):
+        xpub = 'zpub6nydoME6CFdJtMpzHW5BNoPz6i6XbeT9qfz72wsRqGdgGEYeivso6xjfw8cGcCyHwF7BNW4LDuHF35XrZsovBLWMF4qXSjmhTXYiHbWqGLt'
+        wallet = restore_wallet_from_text(xpub, path=self.wallet_path, network=None,
+                                          gap_limit=450, num_processes=2)['wallet']
+        self.assertIsNone(wallet._parallel_deriver)
+        self.assertEqual(450, wallet.gap_limit)
+        self.assertEqual(450, len(wallet.get_receiving_addresses()))
+        self.assertEqual('ltc1q2ccr34wzep58d4239tl3x3734ttle92arvely7', wallet.get_receiving_addresses()[0])
+        serial = restore_wallet_from_text(xpub, path=self.wallet_path + '2', network=None, gap_limit=450)['wallet']
+        self.assertEqual(serial.get_addresses(), wallet.get_addresses())
+        self.assertEqual(serial.keystore.dump_pubkey_cache(), wallet.keystore.dump_pubkey_cache())
+
+    def test_corrupted_block_is_rejected(self):
+        xpub = 'zpub6nydoME6CFdJtMpzHW5BNoPz6i6XbeT9qfz72wsRqGdgGEYeivso6xjfw8cGcCyHwF7BNW4LDuHF35XrZsovBLWMF4qXSjmhTXYiHbWqGLt'
+        wallet = restore_wallet_from_text(xpub, path=self.wallet_path, network=None, gap_limit=5)['wallet']
+        block = _derive_block(wallet.get_derivation_params(), 0, 5, 10)
+        # only the end of the block is wrong
+        block = block._replace(addresses=block.addresses[:-1] + [block.addresses[0]])
+        wallet._parallel_deriver = mock.Mock(derive_blocks=lambda for_change, start, stop: iter([block]))
+        with self.assertRaises(InternalAddressCorruption):
+            wallet._create_new_addresses_in_parallel(False, 5, 10)
+        self.assertEqual(5, len(wallet.get_receiving_addresses()))
+
+
+class TestPubkeyCache(WalletTestCase):
+
+    xpub = 'zpub6nydoME6CFdJtMpzHW5BNoPz6i6XbeT9qfz72wsRqGdgGEYeivso6xjfw8cGcCyHwF7BNW4LDuHF35XrZsovBLWMF4qXSjmhTXYiHbWqGLt'
+
+    def _create_wallet(self):
+        wallet = restore_wallet_from_text(self.xpub, path=self.wallet_path, network=None, gap_limit=5)['wallet']
+        wallet.stop_threads()
+        return wallet
+
+    def test_pubkey_cache_is_persisted(self):
+        wallet = self._create_wallet()
+        cache = wallet.storage.get('pubkey_cache')[self.xpub]
+        self.assertEqual(5, len(cache['0']))
+        self.assertEqual(wallet.get_public_key(wallet.get_receiving_addresses()[3]), cache['0'][3])
+        wallet2 = Standard_Wallet(WalletStorage(self.wallet_path))
+        self.assertEqual(len(wallet.keystore._pubkey_cache), len(wallet2.keystore._pubkey_cache))
+        self.assertEqual(wallet.get_addresses(), [wallet2.derive_address(*wallet2.get_address_index(addr))
+                                                  for addr in wallet2.get_addresses()])
+
+    def test_corrupted_pubkey_cache_is_discarded(self):
+        wallet = self._create_wallet()
+        cache = wallet.storage.get('pubkey_cache')
+        for branch, pubkeys in cache[self.xpub].items():
+            cache[self.xpub][branch] = pubkeys[1:] + pubkeys[:1]
+        wallet.storage.put('pubkey_cache', cache)
+        wallet.storage.write()
+        wallet2 = Standard_Wallet(WalletStorage(self.wallet_path))
+        self.assertEqual(0, len(wallet2.keystore._pubkey_cache))
+        self.assertEqual(wallet.get_receiving_addresses()[1], wallet2.derive_address(False, 1))
@@ -5,7 +5,7 @@ import tempfile
 from typing import Sequence
 import asyncio
 
-from electrum_ltc import storage, bitcoin, keystore, bip32
+from electrum_ltc import storage, bitcoin, keystore, bip32, json_db
 from electrum_ltc import Transaction
 from electrum_ltc import SimpleConfig
 from electrum_ltc.address_synchronizer import TX_HEIGHT_UNCONFIRMED, TX_HEIGHT_UNCONF_PARENT
@@ -1866,6 +1866,71 @@ class TestWalletHistory_SimpleRandomOrder(TestCaseForTestnet):
             w.receive_tx_callback(tx.txid(), tx, TX_HEIGHT_UNCONFIRMED)
         self.assertEqual(27633300, sum(w.get_balance()))
 
+    @mock.patch.object(storage.WalletStorage, '_write')
+    def test_get_history_pagination(self, mock_write):
+        w = self.create_old_wallet()
+        for i in [2, 12, 7, 9, 11, 10, 16, 6, 17, 1, 13, 15, 5, 8, 4, 0, 14, 18, 3]:
+            tx = Transaction(self.transactions[self.txid_list[i]])
+            w.receive_tx_callback(tx.txid(), tx, TX_HEIGHT_UNCONFIRMED)
+        full = w.get_history()
+        self.assertEqual(19, len(full))
+        self.assertEqual(27633300, full[-1][3])
+        # all txns are unconfirmed here, so only the set of items is comparable
+        self.assertEqual(set((txid, delta) for txid, _, delta, _ in full),
+                         set((txid, delta) for txid, _, delta, _ in w.get_history(domain=w.get_addresses())))
+        self.assertEqual(full[5:10], w.get_history(offset=5, limit=5))
+        self.assertEqual(full[15:], w.get_history(offset=15))
+        # removing a tx only updates the index incrementally
+        txid = full[3][0]
+        w.remove_transaction(txid)
+        hist = w.get_history()
+        self.assertEqual(18, len(hist))
+        self.assertNotIn(txid, [item[0] for item in hist])
+        self.assertEqual(sum(w.get_balance()), hist[-1][3])
+
+    @mock.patch.object(storage.WalletStorage, '_write')
+    def test_utxo_index(self, mock_write):
+        w = self.create_old_wallet()
+        for i in [9, 18, 2, 0, 13, 3, 1, 11, 4, 17, 7, 14, 12, 15, 10, 8, 5, 6, 16]:
+            tx = Transaction(self.transactions[self.txid_list[i]])
+            w.receive_tx_callback(tx.txid(), tx, TX_HEIGHT_UNCONFIRMED)
+            self.assertEqual([], w.check_utxo_index())
+        self.assertEqual(27633300, sum(utxo['value'] for utxo in w.get_utxos()))
+        # removing a parent before its children, then adding it back
+        txid = self.txid_list[0]
+        children = w.get_depending_transactions(txid)
+        self.assertTrue(children)
+        w.remove_transaction(txid)
+        self.assertEqual([], w.check_utxo_index())
+        tx = Transaction(self.transactions[txid])
+        w.receive_tx_callback(txid, tx, TX_HEIGHT_UNCONFIRMED)
+        self.assertEqual([], w.check_utxo_index())
+        self.assertEqual(27633300, sum(utxo['value'] for utxo in w.get_utxos()))
+        for txid2 in children | {txid}:
+            w.remove_transaction(txid2)
+            self.assertEqual([], w.check_utxo_index())
+        self.assertEqual(sum(w.get_balance()), sum(utxo['value'] for utxo in w.get_utxos()))
+
+    @mock.patch.object(storage.WalletStorage, '_write')
+    def test_db_loads_transactions_lazily(self, mock_write):
+        w = self.create_old_wallet()
+        for txid in self.txid_list:
+            tx = Transaction(self.transactions[txid])
+            w.receive_tx_callback(txid, tx, TX_HEIGHT_UNCONFIRMED)
+        with mock.patch.object(json_db, 'TX_CACHE_SIZE', 5):
+            db = json_db.JsonDB(w.db.dump(), manual_upgrades=False)
+        self.assertTrue(all(isinstance(raw, str) for raw in db.transactions.values()))
+        self.assertEqual(0, len(db._tx_cache))
+        for txid in self.txid_list:
+            tx = db.get_transaction(txid)
+            self.assertEqual(txid, tx.txid())
+            self.assertIs(tx, db.get_transaction(txid))
+        self.assertEqual(5, len(db._tx_cache))
+        self.assertEqual([], db.check_utxo_index())
+        self.assertEqual(w.db.dump(), db.dump())
+        self.assertIn('parse_json', db.load_timings)
+        self.assertIn('utxo_index', db.load_timings)
+
 
 class TestWalletHistory_EvilGapLimit(TestCaseForTestnet):
     transactions = {
@@ -0,0 +1,103 @@
+"""Large synthetic transactions, for transaction tests and benchmarks.
+
+Run as a script to measure parse, serialize, txid, sighash and signing
+throughput:
+    python -m electrum_ltc.tests.transaction_benchmark [num_inputs]
+"""
+
+import time
+
+from electrum_ltc import bitcoin, ecc, ecc_fast
+from electrum_ltc.bitcoin import TYPE_ADDRESS
+from electrum_ltc.crypto import sha256d
+from electrum_ltc.transaction import Transaction, TxOutput
+from electrum_ltc.util import bh2u
+
+
+PRIVKEY = bytes([1] * 32)
+
+
+def make_tx(num_inputs: int, txin_type: str, *, signed=True) -> Transaction:
+    """Returns a tx spending num_inputs coins of txin_type, all locked
+    to PRIVKEY. If signed, the signatures are not valid, only well-formed.
+    """
+    privkey = ecc.ECPrivkey(PRIVKEY)
+    pubkey = privkey.get_public_key_hex(compressed=True)
+    address = bitcoin.pubkey_to_address(txin_type, pubkey)
+    sig = bh2u(privkey.sign_transaction(bytes(32))) + '01' if signed else None
+    inputs = [{
+        'type': txin_type,
+        'address': address,
+        'prevout_hash': '%064x' % (i + 1),
+        'prevout_n': i % 3,
+        'value': 100000,
+        'sequence': 0xffffffff - 1,
+        'x_pubkeys': [pubkey],
+        'pubkeys': [pubkey],
+        'signatures': [sig],
+        'num_sig': 1,
+    } for i in range(num_inputs)]
+    outputs = [TxOutput(TYPE_ADDRESS, address, 100000 * num_inputs - 10000)]
+    return Transaction(Transaction.from_io(inputs, outputs).serialize())
+
+
+def _benchmark(num_inputs: int):
+    """Reports parse, serialize, txid and sighash throughput on large
+    multi-input p2pkh and p2wpkh transactions, and the signing rate of a
+    p2pkh sweep with each available ECC implementation."""
+    def rate(func, min_time=1.0):
+        n = 0
+        t0 = time.monotonic()
+        while time.monotonic() - t0 < min_time:
+            func()
+            n += 1
+        return n / (time.monotonic() - t0)
+
+    def all_sighashes(tx):
+        tx._invalidate_caches()
+        for i in range(num_inputs):
+            sha256d(tx.serialize_preimage_bytes(i))
+
+    for txin_type in ('p2pkh', 'p2wpkh'):
+        raw = str(make_tx(num_inputs, txin_type))
+        parsed = Transaction(raw)
+        parsed.deserialize()
+        size = len(raw) // 2
+        results = [
+            ('parse', rate(lambda: Transaction(raw).deserialize())),
+            ('parse (full)', rate(lambda: Transaction(raw).deserialize(force_full_parse=True))),
+            ('serialize', rate(lambda: (parsed._ser_cache.clear(), parsed.serialize_to_network()))),
+            ('txid', rate(lambda: (parsed._ser_cache.clear(), parsed.txid()))),
+            ('txid (cached)', rate(lambda: parsed.txid())),
+        ]
+        print(f'{txin_type}, {num_inputs} inputs, {size} bytes:')
+        for name, r in results:
+            print(f'  {name:>14}: {r:8.1f} tx/s {r * size / 1e6:8.2f} MB/s')
+        unsigned = make_tx(num_inputs, txin_type, signed=False)
+        unsigned.deserialize(force_full_parse=True)
+        r = rate(lambda: all_sighashes(unsigned))
+        print(f'  {"sighashes":>14}: {r * num_inputs:8.1f} inputs/s')
+
+    implementations = [('python-ecdsa', ecc_fast.undo_monkey_patching_of_python_ecdsa_internals_with_libsecp256k1)]
+    if ecc_fast._libsecp256k1:
+        implementations.append(('libsecp256k1', ecc_fast.do_monkey_patching_of_python_ecdsa_internals_with_libsecp256k1))
+    else:
+        print('libsecp256k1 not available')
+    for name, setup in implementations:
+        setup()
+        for num_threads in ((1, None) if name == 'libsecp256k1' else (1,)):
+            tx = make_tx(num_inputs, 'p2pkh', signed=False)
+            tx.deserialize(force_full_parse=True)
+            pubkey = tx.inputs()[0]['pubkeys'][0]
+            t0 = time.monotonic()
+            tx.sign({pubkey: (PRIVKEY, True)}, num_threads=num_threads)
+            elapsed = time.monotonic() - t0
+            assert tx.is_complete()
+            threads = 'auto' if num_threads is None else num_threads
+            print(f'{name} (threads: {threads}): signed {num_inputs}-input p2pkh sweep '
+                  f'in {elapsed:.2f}s, {num_inputs / elapsed:.1f} signatures/s')
+
+
+if __name__ == '__main__':
+    import sys
+    _benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 500)
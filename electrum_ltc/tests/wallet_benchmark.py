@@ -0,0 +1,55 @@
+"""Run as a script to compare generating receiving addresses one at a
+time with create_new_addresses, for each available ECC implementation:
+    python -m electrum_ltc.tests.wallet_benchmark [num_addresses]
+"""
+
+import os
+import tempfile
+import time
+
+from electrum_ltc import ecc_fast, keystore
+from electrum_ltc.storage import WalletStorage
+from electrum_ltc.wallet import Standard_Wallet
+
+
+def _benchmark(num_addresses: int):
+    """Compares generating receiving addresses one at a time with
+    create_new_addresses, for each available ECC implementation."""
+    xpub = 'zpub6nydoME6CFdJtMpzHW5BNoPz6i6XbeT9qfz72wsRqGdgGEYeivso6xjfw8cGcCyHwF7BNW4LDuHF35XrZsovBLWMF4qXSjmhTXYiHbWqGLt'
+
+    def new_wallet():
+        storage = WalletStorage(os.path.join(tempfile.mkdtemp(), 'benchmark_wallet'))
+        storage.put('keystore', keystore.from_xpub(xpub).dump())
+        return Standard_Wallet(storage)
+
+    def one_at_a_time(wallet, count):
+        # what create_new_address did before bulk derivation
+        for i in range(count):
+            n = wallet.db.num_receiving_addresses()
+            address = wallet.pubkeys_to_address(wallet.keystore.get_pubkey_from_xpub(
+                wallet.keystore.get_branch_node(False).to_xpub(), (n,)))
+            wallet.db.add_receiving_address(address)
+            wallet.add_address(address)
+
+    implementations = [('python-ecdsa', ecc_fast.undo_monkey_patching_of_python_ecdsa_internals_with_libsecp256k1)]
+    if ecc_fast._libsecp256k1:
+        implementations.append(('libsecp256k1', ecc_fast.do_monkey_patching_of_python_ecdsa_internals_with_libsecp256k1))
+    else:
+        print('libsecp256k1 not available')
+    for name, setup in implementations:
+        setup()
+        # the old code path is too slow to run to completion with python-ecdsa
+        count = num_addresses if name == 'libsecp256k1' else min(num_addresses, 2000)
+        runs = [('one at a time', one_at_a_time),
+                ('bulk', lambda wallet, count: wallet.create_new_addresses(False, count))]
+        for run_name, func in runs:
+            wallet = new_wallet()
+            t0 = time.monotonic()
+            func(wallet, count)
+            elapsed = time.monotonic() - t0
+            print(f'{name:>12}, {run_name:>13}: {count} addresses, {count / elapsed:10.1f} addresses/s')
+
+
+if __name__ == '__main__':
+    import sys
+    _benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
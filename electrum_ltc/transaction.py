@@ -30,6 +30,7 @@
 import struct
 import traceback
 import sys
+import collections
 from typing import (Sequence, Union, NamedTuple, Tuple, Optional, Iterable,
                     Callable, List, Dict)
 
@@ -92,6 +93,16 @@ class BIP143SharedTxDigestFields(NamedTuple):
     hashOutputs: str
 
 
+class LegacySharedTxDigestFields(NamedTuple):
+    prefix: bytes       # nVersion and number of inputs
+    blank_txins: bytes  # all inputs, serialized with an empty script
+    suffix: bytes       # outputs, nLocktime and nHashType
+
+
+# outpoint, empty script, nSequence
+BLANK_TXIN_SIZE = 36 + 1 + 4
+
+
 class BCDataStream(object):
     """Workalike python implementation of Bitcoin's CDataStream class."""
 
@@ -201,6 +212,80 @@ class BCDataStream(object):
         self.write(s)
 
 
+_INT32 = struct.Struct('<i')
+_UINT16 = struct.Struct('<H')
+_UINT32 = struct.Struct('<I')
+_INT64 = struct.Struct('<q')
+_UINT64 = struct.Struct('<Q')
+
+
+def compact_size(size: int) -> bytes:
+    """Like bitcoin.var_int, but returns bytes."""
+    if size < 0:
+        raise SerializationError("attempt to write size < 0")
+    elif size < 253:
+        return bytes((size,))
+    elif size < 2**16:
+        return b'\xfd' + _UINT16.pack(size)
+    elif size < 2**32:
+        return b'\xfe' + _UINT32.pack(size)
+    else:
+        return b'\xff' + _UINT64.pack(size)
+
+
+class BytesReader:
+    """Zero-copy counterpart of BCDataStream for parsing.
+
+    Reads return memoryview slices of the underlying buffer; they are
+    only copied when converted, e.g. to hex at the API edge.
+    """
+
+    __slots__ = ('input', 'read_cursor')
+
+    def __init__(self, data, offset: int = 0):
+        self.input = memoryview(data)
+        self.read_cursor = offset
+
+    def read_bytes(self, length) -> memoryview:
+        end = self.read_cursor + length
+        if end > len(self.input):
+            raise SerializationError("attempt to read past end of buffer")
+        result = self.input[self.read_cursor:end]
+        self.read_cursor = end
+        return result
+
+    def can_read_more(self) -> bool:
+        return self.read_cursor < len(self.input)
+
+    def _read_num(self, s: struct.Struct):
+        try:
+            (i,) = s.unpack_from(self.input, self.read_cursor)
+        except struct.error as e:
+            raise SerializationError(e) from e
+        self.read_cursor += s.size
+        return i
+
+    def read_int32(self): return self._read_num(_INT32)
+    def read_uint16(self): return self._read_num(_UINT16)
+    def read_uint32(self): return self._read_num(_UINT32)
+    def read_int64(self): return self._read_num(_INT64)
+    def read_uint64(self): return self._read_num(_UINT64)
+
+    def read_compact_size(self):
+        try:
+            size = self.input[self.read_cursor]
+        except IndexError as e:
+            raise SerializationError("attempt to read past end of buffer") from e
+        self.read_cursor += 1
+        if size == 253:
+            size = self._read_num(_UINT16)
+        elif size == 254:
+            size = self._read_num(_UINT32)
+        elif size == 255:
+            size = self._read_num(_UINT64)
+        return size
+
+
 def script_GetOp(_bytes : bytes):
     i = 0
     while i < len(_bytes):
@@ -432,7 +517,7 @@ def get_address_from_output_script(_bytes: bytes, *, net=None) -> Tuple[int, str
 
 def parse_input(vds, full_parse: bool):
     d = {}
-    prevout_hash = hash_encode(vds.read_bytes(32))
+    prevout_hash = bytes(vds.read_bytes(32))[::-1].hex()
     prevout_n = vds.read_uint32()
     scriptSig = vds.read_bytes(vds.read_compact_size())
     sequence = vds.read_uint32()
@@ -449,6 +534,7 @@ def parse_input(vds, full_parse: bool):
     d['pubkeys'] = []
     d['signatures'] = {}
     if d['type'] != 'coinbase' and scriptSig:
+        scriptSig = bytes(scriptSig)
         try:
             parse_scriptSig(d, scriptSig)
         except BaseException:
@@ -469,6 +555,7 @@ def construct_witness(items: Sequence[Union[str, int, bytes]]) -> str:
 
 
 def parse_witness(vds, txin, full_parse: bool):
+    start = vds.read_cursor
     n = vds.read_compact_size()
     if n == 0:
         txin['witness'] = '00'
@@ -476,12 +563,16 @@ def parse_witness(vds, txin, full_parse: bool):
     if n == 0xffffffff:
         txin['value'] = vds.read_uint64()
         txin['witness_version'] = vds.read_uint16()
+        start = vds.read_cursor
         n = vds.read_compact_size()
     # now 'n' is the number of items in the witness
-    w = list(bh2u(vds.read_bytes(vds.read_compact_size())) for i in range(n))
-    txin['witness'] = construct_witness(w)
+    items = [vds.read_bytes(vds.read_compact_size()) for i in range(n)]
+    # the witness is kept in its serialized form, which is
+    # what construct_witness would rebuild from the items
+    txin['witness'] = bh2u(vds.input[start:vds.read_cursor])
     if not full_parse:
         return
+    w = [bh2u(x) for x in items]
 
     try:
         if txin.get('witness_version', 0) != 0:
@@ -528,15 +619,15 @@ def parse_output(vds, i):
         raise SerializationError('invalid output amount (too large)')
     if d['value'] < 0:
         raise SerializationError('invalid output amount (negative)')
-    scriptPubKey = vds.read_bytes(vds.read_compact_size())
+    scriptPubKey = bytes(vds.read_bytes(vds.read_compact_size()))
     d['type'], d['address'] = get_address_from_output_script(scriptPubKey)
     d['scriptPubKey'] = bh2u(scriptPubKey)
     d['prevout_n'] = i
     return d
 
 
-def deserialize(raw: str, force_full_parse=False) -> dict:
-    raw_bytes = bfh(raw)
+def deserialize(raw: Union[str, bytes], force_full_parse=False) -> dict:
+    raw_bytes = bfh(raw) if isinstance(raw, str) else raw
     d = {}
     if raw_bytes[:5] == PARTIAL_TXN_HEADER_MAGIC:
         d['partial'] = is_partial = True
@@ -544,12 +635,12 @@ def deserialize(raw: str, force_full_parse=False) -> dict:
         if partial_format_version != 0:
             raise SerializationError('unknown tx partial serialization format version: {}'
                                      .format(partial_format_version))
-        raw_bytes = raw_bytes[6:]
+        offset = 6
     else:
         d['partial'] = is_partial = False
+        offset = 0
     full_parse = force_full_parse or is_partial
-    vds = BCDataStream()
-    vds.write(raw_bytes)
+    vds = BytesReader(raw_bytes, offset)
     d['version'] = vds.read_int32()
     n_vin = vds.read_compact_size()
     is_segwit = (n_vin == 0)
@@ -587,6 +678,9 @@ def multisig_script(public_keys: Sequence[str], m: int) -> str:
 
 class Transaction:
 
+    # when set to a Counter, memoized serializations count their hits and misses
+    cache_stats = None  # type: Optional[collections.Counter]
+
     def __str__(self):
         if self.raw is None:
             self.raw = self.serialize()
@@ -603,6 +697,12 @@ class Transaction:
             raise Exception("cannot initialize transaction", raw)
         self._inputs = None
         self._outputs = None  # type: List[TxOutput]
+        # memoized network serializations, txid and wtxid;
+        # cleared by every method that mutates the tx
+        self._ser_cache = {}
+        # data shared by the sighashes of all inputs; unlike _ser_cache
+        # it survives adding or removing signatures
+        self._sighash_cache = {}
         self.locktime = 0
         self.version = 2
         # by default we assume this is a partial txn;
@@ -611,9 +711,56 @@ class Transaction:
         self._segwit_ser = None  # None means "don't know"
         self.output_info = None  # type: Optional[Dict[str, TxOutputHwInfo]]
 
+    @property
+    def locktime(self) -> int:
+        return self._locktime
+
+    @locktime.setter
+    def locktime(self, value: int):
+        self._locktime = value
+        self._invalidate_caches()
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    @version.setter
+    def version(self, value: int):
+        self._version = value
+        self._invalidate_caches()
+
+    def _invalidate_caches(self):
+        self._ser_cache.clear()
+        self._sighash_cache.clear()
+
+    def _cached(self, key: str, func: Callable, *, cache: dict = None):
+        if cache is None:
+            cache = self._ser_cache
+        stats = Transaction.cache_stats
+        try:
+            value = cache[key]
+        except KeyError:
+            value = cache[key] = func()
+            if stats is not None:
+                stats[key + '_miss'] += 1
+        else:
+            if stats is not None:
+                stats[key + '_hit'] += 1
+        return value
+
+    @classmethod
+    def enable_cache_stats(cls) -> collections.Counter:
+        cls.cache_stats = collections.Counter()
+        return cls.cache_stats
+
+    @classmethod
+    def disable_cache_stats(cls) -> None:
+        cls.cache_stats = None
+
     def update(self, raw):
         self.raw = raw
         self._inputs = None
+        self._invalidate_caches()
         self.deserialize()
 
     def inputs(self):
@@ -656,7 +803,7 @@ class Transaction:
             sig = signatures[i]
             if sig in txin.get('signatures'):
                 continue
-            pre_hash = sha256d(bfh(self.serialize_preimage(i)))
+            pre_hash = sha256d(self.serialize_preimage_bytes(i))
             sig_string = ecc.sig_string_from_der_sig(bfh(sig[:-2]))
             for recid in range(4):
                 try:
@@ -684,12 +831,14 @@ class Transaction:
         txin['scriptSig'] = None  # force re-serialization
         txin['witness'] = None    # force re-serialization
         self.raw = None
+        self._ser_cache.clear()
 
     def add_inputs_info(self, wallet):
         if self.is_complete():
             return
         for txin in self.inputs():
             wallet.add_input_info(txin)
+        self._invalidate_caches()
 
     def remove_signatures(self):
         for txin in self.inputs():
@@ -698,6 +847,7 @@ class Transaction:
             txin['witness'] = None
         assert not self.is_complete()
         self.raw = None
+        self._ser_cache.clear()
 
     def deserialize(self, force_full_parse=False):
         if self.raw is None:
@@ -706,6 +856,7 @@ class Transaction:
         if self._inputs is not None:
             return
         d = deserialize(self.raw, force_full_parse)
+        self._invalidate_caches()
         self._inputs = d['inputs']
         self._outputs = [TxOutput(x['type'], x['address'], x['value']) for x in d['outputs']]
         self.locktime = d['lockTime']
@@ -923,7 +1074,11 @@ class Transaction:
 
     @classmethod
     def serialize_outpoint(self, txin):
-        return bh2u(bfh(txin['prevout_hash'])[::-1]) + int_to_hex(txin['prevout_n'], 4)
+        return bh2u(self._outpoint_bytes(txin))
+
+    @classmethod
+    def _outpoint_bytes(cls, txin) -> bytes:
+        return bfh(txin['prevout_hash'])[::-1] + _UINT32.pack(txin['prevout_n'])
 
     @classmethod
     def get_outpoint_from_txin(cls, txin):
@@ -935,69 +1090,117 @@ class Transaction:
 
     @classmethod
     def serialize_input(self, txin, script):
+        buf = bytearray()
+        self._write_input(buf, txin, bfh(script))
+        return bh2u(buf)
+
+    @classmethod
+    def _write_input(cls, buf: bytearray, txin, script: bytes) -> None:
         # Prev hash and index
-        s = self.serialize_outpoint(txin)
+        buf += cls._outpoint_bytes(txin)
         # Script length, script, sequence
-        s += var_int(len(script)//2)
-        s += script
-        s += int_to_hex(txin.get('sequence', 0xffffffff - 1), 4)
-        return s
+        buf += compact_size(len(script))
+        buf += script
+        buf += _UINT32.pack(txin.get('sequence', 0xffffffff - 1))
 
     def set_rbf(self, rbf):
         nSequence = 0xffffffff - (2 if rbf else 1)
         for txin in self.inputs():
             txin['sequence'] = nSequence
+        self._invalidate_caches()
 
     def BIP69_sort(self, inputs=True, outputs=True):
         if inputs:
             self._inputs.sort(key = lambda i: (i['prevout_hash'], i['prevout_n']))
         if outputs:
             self._outputs.sort(key = lambda o: (o.value, self.pay_script(o.type, o.address)))
+        self._invalidate_caches()
 
     @classmethod
     def serialize_output(cls, output: TxOutput) -> str:
-        s = int_to_hex(output.value, 8)
-        script = cls.pay_script(output.type, output.address)
-        s += var_int(len(script)//2)
-        s += script
-        return s
+        buf = bytearray()
+        cls._write_output(buf, output)
+        return bh2u(buf)
+
+    @classmethod
+    def _write_output(cls, buf: bytearray, output: TxOutput) -> None:
+        script = bfh(cls.pay_script(output.type, output.address))
+        buf += _INT64.pack(output.value)
+        buf += compact_size(len(script))
+        buf += script
 
     def _calc_bip143_shared_txdigest_fields(self) -> BIP143SharedTxDigestFields:
         inputs = self.inputs()
         outputs = self.outputs()
-        hashPrevouts = bh2u(sha256d(bfh(''.join(self.serialize_outpoint(txin) for txin in inputs))))
-        hashSequence = bh2u(sha256d(bfh(''.join(int_to_hex(txin.get('sequence', 0xffffffff - 1), 4) for txin in inputs))))
-        hashOutputs = bh2u(sha256d(bfh(''.join(self.serialize_output(o) for o in outputs))))
-        return BIP143SharedTxDigestFields(hashPrevouts=hashPrevouts,
-                                          hashSequence=hashSequence,
-                                          hashOutputs=hashOutputs)
+        prevouts = b''.join(self._outpoint_bytes(txin) for txin in inputs)
+        sequences = b''.join(_UINT32.pack(txin.get('sequence', 0xffffffff - 1)) for txin in inputs)
+        txouts = bytearray()
+        for o in outputs:
+            self._write_output(txouts, o)
+        return BIP143SharedTxDigestFields(hashPrevouts=bh2u(sha256d(prevouts)),
+                                          hashSequence=bh2u(sha256d(sequences)),
+                                          hashOutputs=bh2u(sha256d(txouts)))
+
+    def _get_bip143_shared_txdigest_fields(self) -> BIP143SharedTxDigestFields:
+        return self._cached('bip143_fields', self._calc_bip143_shared_txdigest_fields,
+                            cache=self._sighash_cache)
+
+    def _calc_legacy_shared_txdigest_fields(self) -> LegacySharedTxDigestFields:
+        inputs = self.inputs()
+        outputs = self.outputs()
+        blank_txins = bytearray()
+        for txin in inputs:
+            self._write_input(blank_txins, txin, b'')
+        suffix = bytearray(compact_size(len(outputs)))
+        for o in outputs:
+            self._write_output(suffix, o)
+        suffix += _UINT32.pack(self.locktime)
+        suffix += _UINT32.pack(1)  # SIGHASH_ALL
+        return LegacySharedTxDigestFields(prefix=_INT32.pack(self.version) + compact_size(len(inputs)),
+                                          blank_txins=bytes(blank_txins),
+                                          suffix=bytes(suffix))
+
+    def _get_legacy_shared_txdigest_fields(self) -> LegacySharedTxDigestFields:
+        return self._cached('legacy_fields', self._calc_legacy_shared_txdigest_fields,
+                            cache=self._sighash_cache)
 
     def serialize_preimage(self, txin_index: int, *,
                            bip143_shared_txdigest_fields: BIP143SharedTxDigestFields = None) -> str:
-        nVersion = int_to_hex(self.version, 4)
-        nHashType = int_to_hex(1, 4)  # SIGHASH_ALL
-        nLocktime = int_to_hex(self.locktime, 4)
-        inputs = self.inputs()
-        outputs = self.outputs()
-        txin = inputs[txin_index]
-        if self.is_segwit_input(txin):
-            if bip143_shared_txdigest_fields is None:
-                bip143_shared_txdigest_fields = self._calc_bip143_shared_txdigest_fields()
-            hashPrevouts = bip143_shared_txdigest_fields.hashPrevouts
-            hashSequence = bip143_shared_txdigest_fields.hashSequence
-            hashOutputs = bip143_shared_txdigest_fields.hashOutputs
-            outpoint = self.serialize_outpoint(txin)
-            preimage_script = self.get_preimage_script(txin)
-            scriptCode = var_int(len(preimage_script) // 2) + preimage_script
-            amount = int_to_hex(txin['value'], 8)
-            nSequence = int_to_hex(txin.get('sequence', 0xffffffff - 1), 4)
-            preimage = nVersion + hashPrevouts + hashSequence + outpoint + scriptCode + amount + nSequence + hashOutputs + nLocktime + nHashType
-        else:
-            txins = var_int(len(inputs)) + ''.join(self.serialize_input(txin, self.get_preimage_script(txin) if txin_index==k else '')
-                                                   for k, txin in enumerate(inputs))
-            txouts = var_int(len(outputs)) + ''.join(self.serialize_output(o) for o in outputs)
-            preimage = nVersion + txins + txouts + nLocktime + nHashType
-        return preimage
+        return bh2u(self.serialize_preimage_bytes(
+            txin_index, bip143_shared_txdigest_fields=bip143_shared_txdigest_fields))
+
+    def serialize_preimage_bytes(self, txin_index: int, *,
+                                 bip143_shared_txdigest_fields: BIP143SharedTxDigestFields = None) -> bytes:
+        txin = self.inputs()[txin_index]
+        if not self.is_segwit_input(txin):
+            # Every input other than the one being signed is serialized
+            # with an empty script, so all but one input and the outputs
+            # are the same in each preimage, and shared between them.
+            shared = self._get_legacy_shared_txdigest_fields()
+            txin_ser = bytearray()
+            self._write_input(txin_ser, txin, bfh(self.get_preimage_script(txin)))
+            blank_txins = memoryview(shared.blank_txins)
+            start = txin_index * BLANK_TXIN_SIZE
+            return b''.join((shared.prefix,
+                             blank_txins[:start],
+                             txin_ser,
+                             blank_txins[start + BLANK_TXIN_SIZE:],
+                             shared.suffix))
+        if bip143_shared_txdigest_fields is None:
+            bip143_shared_txdigest_fields = self._get_bip143_shared_txdigest_fields()
+        buf = bytearray(_INT32.pack(self.version))
+        buf += bfh(bip143_shared_txdigest_fields.hashPrevouts)
+        buf += bfh(bip143_shared_txdigest_fields.hashSequence)
+        buf += self._outpoint_bytes(txin)
+        preimage_script = bfh(self.get_preimage_script(txin))
+        buf += compact_size(len(preimage_script))
+        buf += preimage_script
+        buf += _INT64.pack(txin['value'])
+        buf += _UINT32.pack(txin.get('sequence', 0xffffffff - 1))
+        buf += bfh(bip143_shared_txdigest_fields.hashOutputs)
+        buf += _UINT32.pack(self.locktime)
+        buf += _UINT32.pack(1)  # SIGHASH_ALL
+        return bytes(buf)
 
     def is_segwit(self, guess_for_address=False):
         if not self.is_partial_originally:
@@ -1015,39 +1218,57 @@ class Transaction:
             return network_ser
 
     def serialize_to_network(self, estimate_size=False, witness=True):
+        return bh2u(self.serialize_to_network_bytes(estimate_size, witness))
+
+    def serialize_to_network_bytes(self, estimate_size=False, witness=True) -> bytes:
         self.deserialize()
-        nVersion = int_to_hex(self.version, 4)
-        nLocktime = int_to_hex(self.locktime, 4)
+        if estimate_size:
+            return self._serialize_to_network_bytes(estimate_size=True, witness=witness)
+        return self._cached('ser_witness' if witness else 'ser_nowitness',
+                            lambda: self._serialize_to_network_bytes(estimate_size=False, witness=witness))
+
+    def _serialize_to_network_bytes(self, *, estimate_size: bool, witness: bool) -> bytes:
         inputs = self.inputs()
         outputs = self.outputs()
-        txins = var_int(len(inputs)) + ''.join(self.serialize_input(txin, self.input_script(txin, estimate_size)) for txin in inputs)
-        txouts = var_int(len(outputs)) + ''.join(self.serialize_output(o) for o in outputs)
         use_segwit_ser_for_estimate_size = estimate_size and self.is_segwit(guess_for_address=True)
         use_segwit_ser_for_actual_use = not estimate_size and \
                                         (self.is_segwit() or any(txin['type'] == 'address' for txin in inputs))
-        use_segwit_ser = use_segwit_ser_for_estimate_size or use_segwit_ser_for_actual_use
-        if witness and use_segwit_ser:
-            marker = '00'
-            flag = '01'
-            witness = ''.join(self.serialize_witness(x, estimate_size) for x in inputs)
-            return nVersion + marker + flag + txins + txouts + witness + nLocktime
-        else:
-            return nVersion + txins + txouts + nLocktime
+        use_segwit_ser = witness and (use_segwit_ser_for_estimate_size or use_segwit_ser_for_actual_use)
+        buf = bytearray(_INT32.pack(self.version))
+        if use_segwit_ser:
+            buf += b'\x00\x01'  # marker, flag
+        buf += compact_size(len(inputs))
+        for txin in inputs:
+            self._write_input(buf, txin, bfh(self.input_script(txin, estimate_size)))
+        buf += compact_size(len(outputs))
+        for o in outputs:
+            self._write_output(buf, o)
+        if use_segwit_ser:
+            for txin in inputs:
+                buf += bfh(self.serialize_witness(txin, estimate_size))
+        buf += _UINT32.pack(self.locktime)
+        return bytes(buf)
 
     def txid(self):
         self.deserialize()
+        return self._cached('txid', self._calc_txid)
+
+    def _calc_txid(self):
         all_segwit = all(self.is_segwit_input(x) for x in self.inputs())
         if not all_segwit and not self.is_complete():
             return None
-        ser = self.serialize_to_network(witness=False)
-        return bh2u(sha256d(bfh(ser))[::-1])
+        ser = self.serialize_to_network_bytes(witness=False)
+        return bh2u(sha256d(ser)[::-1])
 
     def wtxid(self):
         self.deserialize()
+        return self._cached('wtxid', self._calc_wtxid)
+
+    def _calc_wtxid(self):
         if not self.is_complete():
             return None
-        ser = self.serialize_to_network(witness=True)
-        return bh2u(sha256d(bfh(ser))[::-1])
+        ser = self.serialize_to_network_bytes(witness=True)
+        return bh2u(sha256d(ser)[::-1])
 
     def add_inputs(self, inputs):
         self._inputs.extend(inputs)
@@ -1107,7 +1328,9 @@ class Transaction:
 
     def estimated_total_size(self):
         """Return an estimated total transaction size in bytes."""
-        return len(self.serialize(True)) // 2 if not self.is_complete() or self.raw is None else len(self.raw) // 2  # ASCII hex string
+        if not self.is_complete() or self.raw is None:
+            return len(self.serialize_to_network_bytes(estimate_size=True))
+        return len(self.raw) // 2  # ASCII hex string
 
     def estimated_witness_size(self):
         """Return an estimate of witness size in bytes."""
@@ -1144,14 +1367,23 @@ class Transaction:
         s, r = self.signature_count()
         return r == s
 
-    def sign(self, keypairs) -> None:
+    def sign(self, keypairs, *, num_threads: int = None) -> None:
         # keypairs:  (x_)pubkey -> secret_bytes
-        bip143_shared_txdigest_fields = self._calc_bip143_shared_txdigest_fields()
+        # All sighashes are computed first, then signed as one batch;
+        # see ecc.sign_transaction_hashes for num_threads.
+        bip143_shared_txdigest_fields = self._get_bip143_shared_txdigest_fields()
+        to_sign = []  # (txin index, signing position, secret, hashed preimage)
         for i, txin in enumerate(self.inputs()):
+            if self.is_txin_complete(txin):
+                continue
             pubkeys, x_pubkeys = self.get_sorted_pubkeys(txin)
+            num_missing = txin.get('num_sig', 1) - len(list(filter(None, txin['signatures'])))
+            pre_hash = None
             for j, (pubkey, x_pubkey) in enumerate(zip(pubkeys, x_pubkeys)):
-                if self.is_txin_complete(txin):
+                if num_missing <= 0:
                     break
+                if txin['signatures'][j]:
+                    continue
                 if pubkey in keypairs:
                     _pubkey = pubkey
                 elif x_pubkey in keypairs:
@@ -1160,15 +1392,60 @@ class Transaction:
                     continue
                 _logger.info(f"adding signature for {_pubkey}")
                 sec, compressed = keypairs.get(_pubkey)
-                sig = self.sign_txin(i, sec, bip143_shared_txdigest_fields=bip143_shared_txdigest_fields)
-                self.add_signature_to_txin(i, j, sig)
+                if pre_hash is None:
+                    pre_hash = sha256d(self.serialize_preimage_bytes(
+                        i, bip143_shared_txdigest_fields=bip143_shared_txdigest_fields))
+                to_sign.append((i, j, sec, pre_hash))
+                num_missing -= 1
+
+        sigs = ecc.sign_transaction_hashes([(sec, pre_hash) for i, j, sec, pre_hash in to_sign],
+                                           num_threads=num_threads)
+        for (i, j, sec, pre_hash), sig in zip(to_sign, sigs):
+            self.add_signature_to_txin(i, j, bh2u(sig) + '01')
 
         _logger.info(f"is_complete {self.is_complete()}")
         self.raw = self.serialize()
 
+    VERIFIABLE_TXIN_TYPES = ('p2pkh', 'p2sh', 'p2wpkh', 'p2wpkh-p2sh', 'p2wsh', 'p2wsh-p2sh')
+
+    def verify_signatures(self, *, num_threads: int = None) -> bool:
+        """Checks all signatures present in the inputs, as one batch (see
+        ecc.verify_message_hashes). Returns False if any of them is invalid.
+        Signatures whose sighash cannot be computed (inputs of unknown type,
+        or segwit inputs without their value) are not checked.
+        """
+        items = []
+        owners = []  # (txin index, signature index) of each item
+        for i, txin in enumerate(self.inputs()):
+            signatures = [sig for sig in txin.get('signatures') or [] if sig]
+            if not signatures or txin['type'] not in self.VERIFIABLE_TXIN_TYPES:
+                continue
+            if self.is_segwit_input(txin) and 'value' not in txin:
+                continue
+            pubkeys, x_pubkeys = self.get_sorted_pubkeys(txin)
+            pre_hash = sha256d(self.serialize_preimage_bytes(i))
+            # partial txns keep one slot per pubkey; complete ones only the
+            # signatures, in pubkey order, so any pubkey may match
+            aligned = len(txin['signatures']) == len(pubkeys)
+            for k, sig in enumerate(txin['signatures'] if aligned else signatures):
+                if not sig:
+                    continue
+                try:
+                    if sig[-2:] != '01':  # SIGHASH_ALL
+                        raise ValueError('unexpected sighash type')
+                    sig_string = ecc.sig_string_from_der_sig(bfh(sig[:-2]))
+                except Exception:
+                    return False
+                for pubkey in ([pubkeys[k]] if aligned else pubkeys):
+                    items.append((bfh(pubkey), pre_hash, sig_string))
+                    owners.append((i, k))
+        results = ecc.verify_message_hashes(items, num_threads=num_threads)
+        valid = set(owner for owner, ok in zip(owners, results) if ok)
+        return valid == set(owners)
+
     def sign_txin(self, txin_index, privkey_bytes, *, bip143_shared_txdigest_fields=None) -> str:
-        pre_hash = sha256d(bfh(self.serialize_preimage(txin_index,
-                                                       bip143_shared_txdigest_fields=bip143_shared_txdigest_fields)))
+        pre_hash = sha256d(self.serialize_preimage_bytes(txin_index,
+                                                         bip143_shared_txdigest_fields=bip143_shared_txdigest_fields))
         privkey = ecc.ECPrivkey(privkey_bytes)
         sig = privkey.sign_transaction(pre_hash)
         sig = bh2u(sig) + '01'
@@ -1225,3 +1502,4 @@ def tx_from_str(txt: str) -> str:
     tx_dict = json.loads(str(txt))
     assert "hex" in tx_dict.keys()
     return tx_dict["hex"]
+
@@ -30,6 +30,7 @@ from decimal import Decimal
 import traceback
 import urllib
 import threading
+import multiprocessing
 import hmac
 import stat
 from locale import localeconv
@@ -1120,6 +1121,34 @@ class OrderedDictWithIndex(OrderedDict):
         return ret
 
 
+class LRUCache(OrderedDict):
+    """A dict of bounded size. When full, the least recently
+    used item is evicted to make room for new ones.
+    """
+
+    def __init__(self, maxsize: int):
+        assert maxsize > 0, maxsize
+        super().__init__()
+        self.maxsize = maxsize
+
+    def __getitem__(self, key):
+        value = super().__getitem__(key)
+        self.move_to_end(key)
+        return value
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.move_to_end(key)
+        while len(self) > self.maxsize:
+            self.popitem(last=False)
+
+
 def multisig_type(wallet_type):
     '''If wallet_type is mofn multi-sig, return [m, n],
     otherwise return None.'''
@@ -1129,3 +1158,13 @@ def multisig_type(wallet_type):
     if match:
         match = [int(x) for x in match.group(1, 2)]
     return match
+
+
+def make_process_pool(processes: int = None, *, initializer: Callable = None,
+                      initargs: tuple = ()) -> 'multiprocessing.pool.Pool':
+    """Returns a pool of worker processes that are spawned, not forked:
+    the parent may be a multithreaded daemon, whose locks a forked child
+    could inherit in a held state. Workers start with a fresh interpreter,
+    so state such as constants.net has to be passed to the initializer.
+    """
+    return multiprocessing.get_context('spawn').Pool(processes, initializer, initargs)
@@ -22,6 +22,8 @@
 # SOFTWARE.
 
 import asyncio
+import time
+from collections import defaultdict, deque
 from typing import Sequence, Optional, TYPE_CHECKING
 
 import aiorpcx
@@ -51,17 +53,30 @@ class SPV(NetworkJobOnDefaultServer):
 
     def __init__(self, network: 'Network', wallet: 'AddressSynchronizer'):
         self.wallet = wallet
+        # merkle proofs are requested in JSON-RPC batches,
+        # with a bounded number of batches in flight
+        self.batch_size = network.config.get('spv_batch_size', 100)
+        self.max_batches_in_flight = network.config.get('spv_max_batches_in_flight', 4)
+        # throughput counters; these survive server switches
+        self.num_proofs_verified = 0
+        self._recent_batches = deque(maxlen=100)  # (timestamp, num proofs verified)
         NetworkJobOnDefaultServer.__init__(self, network)
+        network.spv_verifiers.add(self)
 
     def _reset(self):
         super()._reset()
         self.merkle_roots = {}  # txid -> merkle root (once it has been verified)
         self.requested_merkle = set()  # txid set of pending requests
+        self._num_batches_in_flight = 0
 
     async def _start_tasks(self):
         async with self.group as group:
             await group.spawn(self.main)
 
+    async def stop(self):
+        self.network.spv_verifiers.discard(self)
+        await super().stop()
+
     def diagnostic_name(self):
         return self.wallet.diagnostic_name()
 
@@ -76,7 +91,10 @@ class SPV(NetworkJobOnDefaultServer):
         local_height = self.blockchain.height()
         unverified = self.wallet.get_unverified_txs()
 
+        batch = []
         for tx_hash, tx_height in unverified.items():
+            if self._num_batches_in_flight >= self.max_batches_in_flight:
+                break  # rest will be requested later
             # do not request merkle branch if we already requested it
             if tx_hash in self.requested_merkle or tx_hash in self.merkle_roots:
                 continue
@@ -90,31 +108,58 @@ class SPV(NetworkJobOnDefaultServer):
                     await self.group.spawn(self.network.request_chunk(tx_height, None, can_return_early=True))
                 continue
             # request now
-            self.logger.info(f'requested merkle {tx_hash}')
             self.requested_merkle.add(tx_hash)
-            await self.group.spawn(self._request_and_verify_single_proof, tx_hash, tx_height)
+            batch.append((tx_hash, tx_height))
+            if len(batch) >= self.batch_size:
+                await self._spawn_batch(batch)
+                batch = []
+        if batch:
+            await self._spawn_batch(batch)
+
+    async def _spawn_batch(self, batch):
+        self.logger.info(f'requested merkle for {len(batch)} txs')
+        self._num_batches_in_flight += 1
+        await self.group.spawn(self._request_and_verify_proofs, batch)
 
-    async def _request_and_verify_single_proof(self, tx_hash, tx_height):
+    async def _request_and_verify_proofs(self, batch):
         try:
-            merkle = await self.network.get_merkle_for_transaction(tx_hash, tx_height)
-        except UntrustedServerReturnedError as e:
-            if not isinstance(e.original_exception, aiorpcx.jsonrpc.RPCError):
-                raise
-            self.logger.info(f'tx {tx_hash} not at height {tx_height}')
-            self.wallet.remove_unverified_tx(tx_hash, tx_height)
-            self.requested_merkle.discard(tx_hash)
-            return
+            merkles = await self.network.get_merkle_for_transactions(batch)
+        finally:
+            self._num_batches_in_flight -= 1
+        proofs_by_height = defaultdict(list)  # block height -> list of (tx_hash, merkle)
+        for (tx_hash, tx_height), merkle in zip(batch, merkles):
+            if isinstance(merkle, UntrustedServerReturnedError):
+                if not isinstance(merkle.original_exception, aiorpcx.jsonrpc.RPCError):
+                    raise merkle
+                self.logger.info(f'tx {tx_hash} not at height {tx_height}')
+                self.wallet.remove_unverified_tx(tx_hash, tx_height)
+                self.requested_merkle.discard(tx_hash)
+                continue
+            if tx_height != merkle.get('block_height'):
+                self.logger.info('requested tx_height {} differs from received tx_height {} for txid {}'
+                                 .format(tx_height, merkle.get('block_height'), tx_hash))
+            proofs_by_height[merkle.get('block_height')].append((tx_hash, merkle))
+        # we need to wait if header sync/reorg is still ongoing, hence lock:
+        async with self.network.bhi_lock:
+            chain = self.network.blockchain()
+            headers = {height: chain.read_header(height) for height in proofs_by_height}
+        num_verified = 0
+        for tx_height, proofs in proofs_by_height.items():
+            # all proofs for the same block are checked against a single header
+            header = headers[tx_height]
+            header_hash = hash_header(header) if header else None
+            for tx_hash, merkle in proofs:
+                self._verify_proof(tx_hash, merkle, header, header_hash)
+                num_verified += 1
+        self.num_proofs_verified += num_verified
+        self._recent_batches.append((time.monotonic(), num_verified))
+
+    def _verify_proof(self, tx_hash: str, merkle: dict, header: Optional[dict], header_hash: Optional[str]):
         # Verify the hash of the server-provided merkle branch to a
         # transaction matches the merkle root of its block
-        if tx_height != merkle.get('block_height'):
-            self.logger.info('requested tx_height {} differs from received tx_height {} for txid {}'
-                             .format(tx_height, merkle.get('block_height'), tx_hash))
         tx_height = merkle.get('block_height')
         pos = merkle.get('pos')
         merkle_branch = merkle.get('merkle')
-        # we need to wait if header sync/reorg is still ongoing, hence lock:
-        async with self.network.bhi_lock:
-            header = self.network.blockchain().read_header(tx_height)
         try:
             verify_tx_is_in_block(tx_hash, merkle_branch, pos, header, tx_height)
         except MerkleVerificationFailure as e:
@@ -127,7 +172,6 @@ class SPV(NetworkJobOnDefaultServer):
         self.merkle_roots[tx_hash] = header.get('merkle_root')
         self.requested_merkle.discard(tx_hash)
         self.logger.info(f"verified {tx_hash}")
-        header_hash = hash_header(header)
         tx_info = TxMinedInfo(height=tx_height,
                               timestamp=header.get('timestamp'),
                               txpos=pos,
@@ -136,6 +180,21 @@ class SPV(NetworkJobOnDefaultServer):
         #if self.is_up_to_date() and self.wallet.is_up_to_date():
         #    self.wallet.save_verified_tx(write=True)
 
+    def get_stats(self) -> dict:
+        """Throughput counters, as shown in Network status."""
+        now = time.monotonic()
+        recent = [(t, n) for (t, n) in self._recent_batches if now - t < 60]
+        if recent:
+            elapsed = max(now - recent[0][0], 1)
+            proofs_per_second = sum(n for t, n in recent) / elapsed
+        else:
+            proofs_per_second = 0
+        return {
+            'proofs_verified': self.num_proofs_verified,
+            'proofs_per_second': proofs_per_second,
+            'outstanding': len(self.requested_merkle),
+        }
+
     @classmethod
     def hash_merkle_root(cls, merkle_branch: Sequence[str], tx_hash: str, leaf_pos_in_tree: int):
         """Return calculated merkle root."""
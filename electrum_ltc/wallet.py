@@ -64,6 +64,7 @@ from .contacts import Contacts
 from .interface import NetworkException
 from .ecc_fast import is_using_fast_ecc
 from .mnemonic import Mnemonic
+from .address_deriver import ParallelAddressDeriver, DerivationParams
 from .logging import get_logger
 
 if TYPE_CHECKING:
@@ -1574,6 +1575,8 @@ class Imported_Wallet(Simple_Wallet):
                     for tx_hash, height in details:
                         transactions_new.add(tx_hash)
             transactions_to_remove -= transactions_new
+            # the txs kept may have had a part of their value on this address
+            self._mark_history_index_dirty_for_address(address)
             self.db.remove_addr_history(address)
             for tx_hash in transactions_to_remove:
                 self.remove_transaction(tx_hash)
@@ -1668,9 +1671,14 @@ class Imported_Wallet(Simple_Wallet):
             if self.db.get_imported_address(addr)['pubkey'] == pubkey:
                 return addr
 
+# smallest number of new addresses worth sending to the worker processes
+PARALLEL_DERIVATION_MIN_ADDRESSES = 200
+
+
 class Deterministic_Wallet(Abstract_Wallet):
 
     def __init__(self, storage):
+        self._parallel_deriver = None  # type: Optional[ParallelAddressDeriver]
         Abstract_Wallet.__init__(self, storage)
         self.gap_limit = storage.get('gap_limit', 20)
         # generate addresses now. note that without libsecp this might block
@@ -1680,6 +1688,32 @@ class Deterministic_Wallet(Abstract_Wallet):
     def has_seed(self):
         return self.keystore.has_seed()
 
+    def load_and_cleanup(self):
+        super().load_and_cleanup()
+        # loaded after the address sanity checks, so that those re-derive
+        self.load_pubkey_cache()
+
+    def stop_threads(self):
+        self.stop_parallel_derivation()
+        self.save_pubkey_cache()
+        super().stop_threads()
+
+    def _get_xpub_keystores(self):
+        return [k for k in self.get_keystores() if isinstance(k, keystore.Xpub)]
+
+    def load_pubkey_cache(self):
+        cache = self.storage.get('pubkey_cache', {})
+        for k in self._get_xpub_keystores():
+            k.load_pubkey_cache(cache.get(k.xpub))
+
+    def save_pubkey_cache(self):
+        """Persists the derived pubkeys of the keystores, so that reopening
+        a large wallet does not need to derive them again.
+        """
+        cache = {k.xpub: k.dump_pubkey_cache() for k in self._get_xpub_keystores()}
+        if cache != self.storage.get('pubkey_cache', {}):
+            self.storage.put('pubkey_cache', cache)
+
     def get_addresses(self):
         # note: overridden so that the history can be cleared.
         # addresses are ordered based on derivation
@@ -1754,31 +1788,86 @@ class Deterministic_Wallet(Abstract_Wallet):
         x = self.derive_pubkeys(for_change, n)
         return self.pubkeys_to_address(x)
 
+    def derive_addresses(self, for_change, start, stop):
+        return [self.pubkeys_to_address(x) for x in self.derive_pubkeys_range(for_change, start, stop)]
+
     def create_new_address(self, for_change=False):
+        return self.create_new_addresses(for_change, 1)[0]
+
+    def create_new_addresses(self, for_change, count):
+        """Derives the next 'count' addresses of a branch in one batch."""
         assert type(for_change) is bool
         with self.lock:
             n = self.db.num_change_addresses() if for_change else self.db.num_receiving_addresses()
-            address = self.derive_address(for_change, n)
-            self.db.add_change_address(address) if for_change else self.db.add_receiving_address(address)
-            self.add_address(address)
-            if for_change:
-                # note: if it's actually used, it will get filtered later
-                self._unused_change_addresses.append(address)
-            return address
+            if self._parallel_deriver and count >= PARALLEL_DERIVATION_MIN_ADDRESSES:
+                return self._create_new_addresses_in_parallel(for_change, n, n + count)
+            addresses = self.derive_addresses(for_change, n, n + count)
+            self._add_new_addresses(for_change, addresses)
+            return addresses
+
+    def _add_new_addresses(self, for_change, addresses, scripthashes=None):
+        self.db.add_change_addresses(addresses) if for_change else self.db.add_receiving_addresses(addresses)
+        self.add_addresses(addresses, scripthashes=scripthashes)
+        if for_change:
+            # note: if it's actually used, it will get filtered later
+            self._unused_change_addresses.extend(addresses)
+
+    def _create_new_addresses_in_parallel(self, for_change, start, stop):
+        addresses = []
+        for block in self._parallel_deriver.derive_blocks(for_change, start, stop):
+            # spot check each block against the regular derivation, at both ends
+            last = block.start + len(block.addresses) - 1
+            if (block.addresses[0] != self.derive_address(for_change, block.start)
+                    or block.addresses[-1] != self.derive_address(for_change, last)):
+                raise InternalAddressCorruption()
+            for k, pubkeys in zip(self.get_keystores(), block.pubkeys):
+                k.add_pubkeys_to_cache(for_change, block.start, pubkeys)
+            self._add_new_addresses(for_change, block.addresses, block.scripthashes)
+            addresses += block.addresses
+        return addresses
+
+    def get_derivation_params(self) -> Optional[DerivationParams]:
+        """What ParallelAddressDeriver needs to derive our addresses,
+        or None if this wallet does not support it."""
+        return None
+
+    def start_parallel_derivation(self, *, num_processes=None) -> bool:
+        """Derive large runs of new addresses (e.g. when restoring with
+        a large gap limit) in worker processes. Returns False if this
+        wallet does not support it.
+        """
+        params = self.get_derivation_params()
+        if params is None:
+            return False
+        with self.lock:
+            if self._parallel_deriver is None:
+                self._parallel_deriver = ParallelAddressDeriver(params, num_processes=num_processes)
+        return True
+
+    def stop_parallel_derivation(self):
+        with self.lock:
+            deriver, self._parallel_deriver = self._parallel_deriver, None
+        if deriver:
+            self.logger.info(f'derived {deriver.num_derived} addresses in worker processes, '
+                             f'{deriver.get_rate():.1f} addr/s')
+            deriver.shutdown()
 
     def synchronize_sequence(self, for_change):
         limit = self.gap_limit_for_change if for_change else self.gap_limit
         while True:
             num_addr = self.db.num_change_addresses() if for_change else self.db.num_receiving_addresses()
             if num_addr < limit:
-                self.create_new_address(for_change)
+                self.create_new_addresses(for_change, limit - num_addr)
                 continue
             if for_change:
                 last_few_addresses = self.get_change_addresses(slice_start=-limit)
             else:
                 last_few_addresses = self.get_receiving_addresses(slice_start=-limit)
-            if any(map(self.address_is_old, last_few_addresses)):
-                self.create_new_address(for_change)
+            # restore the gap after the last used address in one go
+            for i in reversed(range(limit)):
+                if self.address_is_old(last_few_addresses[i]):
+                    self.create_new_addresses(for_change, i + 1)
+                    break
             else:
                 break
 
@@ -1852,6 +1941,9 @@ class Simple_Deterministic_Wallet(Simple_Wallet, Deterministic_Wallet):
     def derive_pubkeys(self, c, i):
         return self.keystore.derive_pubkey(c, i)
 
+    def derive_pubkeys_range(self, c, start, stop):
+        return self.keystore.derive_pubkeys_range(c, start, stop)
+
 
 
 
@@ -1863,6 +1955,11 @@ class Standard_Wallet(Simple_Deterministic_Wallet):
     def pubkeys_to_address(self, pubkey):
         return bitcoin.pubkey_to_address(self.txin_type, pubkey)
 
+    def get_derivation_params(self):
+        if not isinstance(self.keystore, keystore.Xpub):
+            return None
+        return DerivationParams(xpubs=[self.keystore.xpub], txin_type=self.txin_type)
+
 
 class Multisig_Wallet(Deterministic_Wallet):
     # generic m of n
@@ -1895,6 +1992,16 @@ class Multisig_Wallet(Deterministic_Wallet):
     def derive_pubkeys(self, c, i):
         return [k.derive_pubkey(c, i) for k in self.get_keystores()]
 
+    def derive_pubkeys_range(self, c, start, stop):
+        per_keystore = [k.derive_pubkeys_range(c, start, stop) for k in self.get_keystores()]
+        return [list(pubkeys) for pubkeys in zip(*per_keystore)]
+
+    def get_derivation_params(self):
+        if not all(isinstance(k, keystore.Xpub) for k in self.get_keystores()):
+            return None
+        return DerivationParams(xpubs=[k.xpub for k in self.get_keystores()],
+                                txin_type=self.txin_type, multisig_m=self.m)
+
     def load_keystore(self):
         self.keystores = {}
         for i in range(self.n):
@@ -2025,10 +2132,12 @@ def create_new_wallet(*, path, passphrase=None, password=None, encrypt_file=True
 
 def restore_wallet_from_text(text, *, path, network=None,
                              passphrase=None, password=None, encrypt_file=True,
-                             gap_limit=None):
+                             gap_limit=None, num_processes=None):
     """Restore a wallet from text. Text can be a seed phrase, a master
     public key, a master private key, a list of bitcoin addresses
-    or bitcoin private keys."""
+    or bitcoin private keys.
+    If num_processes is set, addresses are derived in that many worker
+    processes (see ParallelAddressDeriver)."""
     storage = WalletStorage(path)
     if storage.file_exists():
         raise Exception("Remove the existing wallet first!")
@@ -2059,9 +2168,16 @@ def restore_wallet_from_text(text, *, path, network=None,
             raise Exception("Seed or key not recognized")
         storage.put('keystore', k.dump())
         storage.put('wallet_type', 'standard')
-        if gap_limit is not None:
+        if gap_limit is not None and not num_processes:
             storage.put('gap_limit', gap_limit)
         wallet = Wallet(storage)
+        if num_processes:
+            # falls back to deriving in this process if not supported
+            wallet.start_parallel_derivation(num_processes=num_processes)
+            if gap_limit is not None:
+                # the constructor only derived up to the default gap limit
+                wallet.gap_limit = gap_limit
+                storage.put('gap_limit', gap_limit)
 
     assert not storage.file_exists(), "file was created too soon! plaintext keys might have been written to disk"
     wallet.update_password(old_pw=None, new_pw=password, encrypt_storage=encrypt_file)
@@ -2078,5 +2194,8 @@ def restore_wallet_from_text(text, *, path, network=None,
         msg = ("This wallet was restored offline. It may contain more addresses than displayed. "
                "Start a daemon (not offline) to sync history.")
 
+    if isinstance(wallet, Deterministic_Wallet):
+        wallet.stop_parallel_derivation()
     wallet.storage.write()
     return {'wallet': wallet, 'msg': msg}
+